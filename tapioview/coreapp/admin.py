@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Report, Source, ReductionStrategy, ReductionModification
+from . import snapshots
+from .models import Portfolio, Report, ReportSnapshot, Source, ReductionStrategy, ReductionModification
 
 class SourceInline(admin.TabularInline):
     model = Source
@@ -20,7 +21,28 @@ class ReportAdmin(admin.ModelAdmin):
 class ReductionStrategyAdmin(admin.ModelAdmin):
     inlines = [SourceInline, ReductionModificationInline]
 
+class PortfolioAdmin(admin.ModelAdmin):
+    filter_horizontal = ['reports']
+
+class ReportSnapshotAdmin(admin.ModelAdmin):
+    # Frozen by the API, a deletion unfreezes the year (see coreapp.snapshots)
+    list_display = ['report', 'year', 'total_emission', 'created_at']
+    exclude = ['source_ids', 'source_values']
+    readonly_fields = ['report', 'year', 'total_emission', 'strategy_deltas', 'created_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def delete_model(self, request, obj):
+        snapshots.unfreeze_report(obj.report, obj.year)
+
+    def delete_queryset(self, request, queryset):
+        for snapshot in queryset.select_related('report'):
+            snapshots.unfreeze_report(snapshot.report, snapshot.year)
+
 admin.site.register(Report, ReportAdmin)
 admin.site.register(Source)
 admin.site.register(ReductionStrategy, ReductionStrategyAdmin)
-admin.site.register(ReductionModification)
\ No newline at end of file
+admin.site.register(ReductionModification)
+admin.site.register(Portfolio, PortfolioAdmin)
+admin.site.register(ReportSnapshot, ReportSnapshotAdmin)
@@ -0,0 +1,204 @@
+"""
+Materialized per-year totals.
+
+ReportYearEmission and StrategyYearDelta store Report.year_emission and
+ReductionStrategy.year_delta_emission for every year of
+settings.EMISSION_YEARS_HORIZON. A read is a single row, and a write only adjusts
+the years affected by the changed source or modification (see coreapp.signals).
+A report or strategy without stored rows (created before the table, or after a
+change of the horizon) is materialized on its first read.
+The rows of a frozen year (coreapp.snapshots) are never changed.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from coreapp.models import Report, ReductionStrategy, Source, ReductionModification, ReportYearEmission, StrategyYearDelta
+from coreapp.frames import ReportFrame
+from coreapp.timeline import ModificationTimeline
+
+DEFAULT_HORIZON = (2000, 2060)
+
+REPORT = 'report'
+STRATEGY = 'strategy'
+
+
+def horizon_years() -> range:
+    first_year, last_year = getattr(settings, 'EMISSION_YEARS_HORIZON', DEFAULT_HORIZON)
+    return range(first_year, last_year + 1)
+
+
+# Reads
+
+def report_year_emission(report: Report, year: int) -> float:
+    """
+    Stored total emission of the report, read from the `stored_year_emissions`
+    prefetch when present (see coreapp.queries). Outside of the horizon, computed
+    by the database
+    """
+    if year not in horizon_years():
+        if getattr(report, 'computed_year', None) == year:
+            return report.computed_year_emission # see ReportQuerySet.with_year_emission
+        return report.year_emission(year)
+    if hasattr(report, 'stored_year_emissions'):
+        rows = report.stored_year_emissions
+    else:
+        rows = report.yearEmissions.filter(year=year)
+    for row in rows:
+        return row.total_emission
+    return materialize_report(report)[year]
+
+
+def strategy_year_delta(strategy: ReductionStrategy, year: int) -> float:
+    """
+    Stored delta of the strategy, read from the `stored_year_deltas`
+    prefetch when present (see coreapp.queries). Outside of the horizon, computed
+    with the frame of the report
+    """
+    if year not in horizon_years():
+        if getattr(strategy, 'computed_year', None) == year:
+            return strategy.computed_year_delta # see frames.annotate_year_deltas
+        return strategy.year_delta_emission(year)
+    if hasattr(strategy, 'stored_year_deltas'):
+        rows = strategy.stored_year_deltas
+    else:
+        rows = strategy.yearDeltas.filter(year=year)
+    for row in rows:
+        return row.delta_total_emission
+    return materialize_strategy(strategy)[year]
+
+
+# Full computation
+
+def materialize_report(report: Report, frame: ReportFrame | None = None) -> dict[int, float]:
+    """
+    (Re)compute and store the total emission of every year of the horizon, but the frozen years.
+    `frame` is the already loaded frame of the report
+    """
+    years = horizon_years()
+    if frame is None:
+        totals = dict(zip(years, report.range_emission(years.start, years.stop - 1)))
+    else:
+        totals = dict(zip(years, frame.range_emission(years.start, years.stop - 1)))
+    with transaction.atomic():
+        rows = ReportYearEmission.objects.filter(report=report)
+        frozen = dict(rows.filter(frozen=True).values_list('year', 'total_emission'))
+        rows.filter(frozen=False).delete()
+        ReportYearEmission.objects.bulk_create(
+            ReportYearEmission(report=report, year=year, total_emission=total)
+            for year, total in totals.items() if year not in frozen)
+    totals.update(frozen)
+    return totals
+
+
+def materialize_strategy(strategy: ReductionStrategy, frame: ReportFrame | None = None) -> dict[int, float]:
+    """
+    (Re)compute and store the delta of every year of the horizon, but the frozen years.
+    `frame` is the already loaded frame of the report, loaded for this strategy otherwise
+    """
+    years = horizon_years()
+    if frame is None:
+        frame = ReportFrame.load(strategy.report_id, strategy_ids=[strategy.pk])
+    deltas = dict(zip(years, frame.range_delta_emission(strategy.pk, years.start, years.stop - 1)))
+    with transaction.atomic():
+        rows = StrategyYearDelta.objects.filter(strategy=strategy)
+        frozen = dict(rows.filter(frozen=True).values_list('year', 'delta_total_emission'))
+        rows.filter(frozen=False).delete()
+        StrategyYearDelta.objects.bulk_create(
+            StrategyYearDelta(strategy=strategy, year=year, delta_total_emission=delta)
+            for year, delta in deltas.items() if year not in frozen)
+    deltas.update(frozen)
+    return deltas
+
+
+# Incremental maintenance
+
+def add_contribution(contributions: dict, key: tuple[str, int], values: dict[int, float]):
+    years = contributions.setdefault(key, defaultdict(float))
+    for year, value in values.items():
+        years[year] += value
+
+
+def source_years(*sources: Source) -> range:
+    """
+    Years of the horizon where the sources contribute: from the first of their acquisition years
+    """
+    years = horizon_years()
+    if all(source.acquisition_year for source in sources):
+        return range(max(years.start, min(source.acquisition_year for source in sources)), years.stop)
+    return years
+
+
+def source_contributions(source: Source, years: range | None = None) -> dict:
+    """
+    Contribution of a source to each stored total: {(REPORT|STRATEGY, id): {year: value}},
+    for the years (the horizon by default). The modifications are read from the database.
+    The strategies to which the source does not contribute are left out.
+    """
+    if years is None:
+        years = horizon_years()
+    contributions = {}
+    emissions = {year: source.year_emission(year) for year in years}
+
+    if source.report_id:
+        add_contribution(contributions, (REPORT, source.report_id), emissions)
+
+        modifications = defaultdict(list)
+        if source.pk:
+            for modification in ReductionModification.objects.filter(source_id=source.pk, strategy__report_id=source.report_id):
+                modifications[modification.strategy_id].append(modification)
+        strategy_ids = set(modifications)
+        if source.value * source.emission_factor < 0:
+            # Without modification, the delta of a negative source is its emission (see ModificationTimeline.source_delta)
+            strategy_ids.update(ReductionStrategy.objects.filter(report_id=source.report_id).values_list('id', flat=True))
+        for strategy_id in strategy_ids:
+            timeline = ModificationTimeline(modifications[strategy_id])
+            add_contribution(contributions, (STRATEGY, strategy_id),
+                             {year: timeline.source_delta(source, year) for year in years})
+
+    if source.strategy_id:
+        # new sources are subtracted from the delta
+        add_contribution(contributions, (STRATEGY, source.strategy_id),
+                         {year: -emission for year, emission in emissions.items()})
+
+    return contributions
+
+
+def modification_contributions(pairs) -> dict:
+    """
+    Contribution of the modifications of each (strategy_id, source_id) pair to the stored
+    delta of the strategy
+    """
+    contributions = {}
+    for strategy_id, source_id in pairs:
+        source = Source.objects.filter(pk=source_id, report__reductionStrategies=strategy_id).first()
+        if source is None:
+            continue # only the sources of the strategy report are modified
+        timeline = ModificationTimeline(ReductionModification.objects.filter(strategy_id=strategy_id, source_id=source_id))
+        add_contribution(contributions, (STRATEGY, strategy_id),
+                         {year: timeline.source_delta(source, year) for year in horizon_years()})
+    return contributions
+
+
+def apply_contributions(before: dict, after: dict):
+    """
+    Adjust the stored rows (but the frozen ones) by the difference between two contributions.
+    Years with the same difference are updated with a single query.
+    """
+    for key in before.keys() | after.keys():
+        old_values = before.get(key, {})
+        new_values = after.get(key, {})
+        years_by_difference = defaultdict(list)
+        for year in old_values.keys() | new_values.keys():
+            difference = new_values.get(year, 0) - old_values.get(year, 0)
+            if difference:
+                years_by_difference[difference].append(year)
+
+        kind, object_id = key
+        for difference, years in years_by_difference.items():
+            if kind == REPORT:
+                ReportYearEmission.objects.filter(report_id=object_id, year__in=years, frozen=False).update(
+                    total_emission=F('total_emission') + difference)
+            else:
+                StrategyYearDelta.objects.filter(strategy_id=object_id, year__in=years, frozen=False).update(
+                    delta_total_emission=F('delta_total_emission') + difference)
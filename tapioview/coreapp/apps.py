@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CoreappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'coreapp'
+
+    def ready(self):
+        from coreapp import schema, signals # noqa: F401
@@ -0,0 +1,146 @@
+"""
+Contribution of each modification of a strategy to its delta.
+
+The modifications of a source apply in the order of the rules (coreapp.timeline:
+start year, then order). For each modification:
+
+* its marginal contribution is the delta of its source with the modifications up
+  to this one, minus the delta with the modifications before it. The marginal
+  contributions add up to the delta of the strategy, but for the `unattributed`
+  part: the unmodified delta of the sources and the emission of the new sources;
+* its leave-one-out contribution is the delta of its source with all its
+  modifications, minus the delta without this one: what removing it would lose.
+
+Only the source of a modification is evaluated again. The variants of a source
+(with its first modifications, without one of them) are read from its timeline,
+walked once: the state of the variant of each modification in each year is
+derived from the state of all the modifications of the source, so the work is
+the number of modifications times the number of years, and does not depend on
+the other sources of the report.
+"""
+import numpy as np
+from coreapp import caching, engine, frames, metrics
+from coreapp.instrumentation import EMISSION, timer
+from coreapp.models import ReductionStrategy, ReductionModification
+
+ATTRIBUTION_CACHE_NAME = 'attribution'
+
+ATTRIBUTION_COLUMNS = ['id', *frames.MODIFICATION_COLUMNS]
+
+
+def variant_changes(group_start: np.ndarray, start_year: np.ndarray, value: np.ndarray, emission_factor: np.ndarray,
+                    lifetime: np.ndarray, years: np.ndarray) -> tuple[tuple, tuple]:
+    """
+    ((value change, last emission factor set) with the modifications of the source up to i,
+    (value change, last emission factor set) with all of them but i), as the (modifications x years)
+    arrays of engine.ModificationColumns.changes, for the modifications sorted per source
+    (group_start: position of the first modification of the source) then as the rules
+    """
+    count = len(group_start)
+    if count == 0:
+        empty = np.zeros((0, len(years)))
+        return (empty, empty), (empty, empty)
+    position = np.arange(count)
+    # The changes not set (or 0) are ignored by the rules
+    value = np.nan_to_num(value, nan=0.0)
+    emission_factor = np.where(emission_factor == 0, np.nan, emission_factor)
+    cumulative = np.cumsum(value)
+    cumulative = cumulative - (cumulative[group_start] - value[group_start])
+    # Position of the last emission factor set, in the modifications of the same source
+    setter = np.maximum.accumulate(np.where(np.isnan(emission_factor), -1, position))
+    setter = np.where(setter >= group_start, setter, -1)
+    last_factor = np.where(setter >= 0, emission_factor[np.maximum(setter, 0)], np.nan)
+
+    # Last modification of the source started in each year: the keys source x span + year are sorted
+    base = min(start_year.min(), years.min())
+    span = max(start_year.max(), years.max()) - base + 1
+    source = np.cumsum(position == group_start) - 1
+    keys = source * span + (start_year - base)
+    last = np.searchsorted(keys, (source * span)[:, None] + (years - base)[None, :], side='right') - 1
+    started = last >= group_start[:, None]
+    amortized = (lifetime[:, None] > 0) & (start_year[group_start][:, None] + lifetime[:, None] < years[None, :])
+    # Once the first modification is amortized, only its emission factor is kept
+    first_factor = emission_factor[group_start]
+
+    # Up to i
+    upto = np.minimum(position[:, None], last)
+    prefix_value = np.where(started & ~amortized, cumulative[upto], 0.0)
+    prefix_factor = np.where(amortized, first_factor[:, None], last_factor[upto])
+    prefix_factor = np.where(started, prefix_factor, np.nan)
+
+    # Without i: the first modification of the variant is the next one when i is the first
+    first = np.minimum(np.where(position == group_start, position + 1, group_start), count - 1)
+    remaining = (last - group_start[:, None] + 1) - (start_year <= years[:, None]).T
+    without_last = np.where(last == position[:, None], last - 1, last)
+    index = np.maximum(without_last, 0)
+    without_value = cumulative[index] - np.where(position[:, None] < without_last, value[:, None], 0.0)
+    previous_factor = np.where(position > group_start, last_factor[np.maximum(position - 1, 0)], np.nan)
+    without_factor = np.where(setter[index] == position[:, None], previous_factor[:, None], last_factor[index])
+    amortized = (lifetime[:, None] > 0) & (start_year[first][:, None] + lifetime[:, None] < years[None, :])
+    without_value = np.where((remaining > 0) & ~amortized, without_value, 0.0)
+    without_factor = np.where(amortized, emission_factor[first][:, None], without_factor)
+    without_factor = np.where(remaining > 0, without_factor, np.nan)
+    return (prefix_value, prefix_factor), (without_value, without_factor)
+
+
+def compute_attribution(strategy: ReductionStrategy, start_year: int, end_year: int) -> dict:
+    metrics.registry.inc(metrics.COMPUTATIONS, method='attribution')
+    frame = frames.load_frames([strategy.report_id], strategy_ids=[strategy.pk])[strategy.report_id]
+    rows = frames.fetch_columns(ReductionModification.objects.filter(strategy_id=strategy.pk).order_by(), *ATTRIBUTION_COLUMNS)
+    years = engine.year_range(start_year, end_year)
+
+    known, source_rows = frames.known_source_rows(frame.source_ids, rows[:, 1])
+    rows = rows[known]
+    # Sorted per source then as the rules
+    order = np.lexsort((rows[:, 3], rows[:, 2], source_rows))
+    rows, source_rows = rows[order], source_rows[order]
+    count = len(rows)
+    group_start = np.searchsorted(source_rows, source_rows)
+    group_end = np.searchsorted(source_rows, source_rows, side='right')
+    rank = np.arange(count) - group_start
+
+    # Deltas of the source of each modification: with the modifications up to it, without it, without modification
+    sources = frame.sources.take(source_rows)
+    prefix, without = variant_changes(group_start, rows[:, 2].astype(np.int64), rows[:, 4], rows[:, 5], sources.lifetime, years)
+    prefix = sources.modified_deltas(years, *prefix)
+    without = sources.modified_deltas(years, *without)
+    unmodified = sources.modified_deltas(years, np.zeros(prefix.shape), np.full(prefix.shape, np.nan))
+
+    previous = np.where((rank > 0)[:, None], prefix[np.maximum(np.arange(count) - 1, 0)], unmodified)
+    marginal = prefix - previous
+    leave_one_out = prefix[group_end - 1] - without
+
+    strategy_delta = frame.range_delta_emission(strategy.pk, start_year, end_year)
+    unattributed = np.asarray(strategy_delta) - marginal.sum(axis=0)
+
+    # Marginal abatement table: the largest marginal contributions over the range first
+    totals = marginal.sum(axis=1)
+    ranking = np.lexsort((rows[:, 0], -totals))
+    cumulative = np.cumsum(totals[ranking])
+    table = []
+    for rank_number, i in enumerate(ranking.tolist(), start=1):
+        table.append({'rank': rank_number,
+                      'id': int(rows[i, 0]),
+                      'source': int(rows[i, 1]),
+                      'modification_start_year': int(rows[i, 2]),
+                      'marginal_total': totals[i].item(),
+                      'leave_one_out_total': leave_one_out[i].sum().item(),
+                      'cumulative_marginal_total': cumulative[rank_number - 1].item(),
+                      'years': [{'year': year, 'marginal': value, 'leave_one_out': removed}
+                                for year, value, removed in zip(years.tolist(), marginal[i].tolist(), leave_one_out[i].tolist())]})
+
+    return {'id': strategy.pk,
+            'name': strategy.name,
+            'years': [{'year': year, 'delta_total_emission': delta, 'unattributed': rest}
+                      for year, delta, rest in zip(years.tolist(), strategy_delta, unattributed.tolist())],
+            'modifications': table}
+
+
+def strategy_attribution(strategy: ReductionStrategy, start_year: int, end_year: int) -> dict:
+    """
+    Marginal and leave-one-out contribution of each modification of the strategy for every
+    year of the range, the largest marginal contributions first. Cached for the revision of the report
+    """
+    with timer(EMISSION):
+        return caching.cached(strategy.report_id, ATTRIBUTION_CACHE_NAME, strategy.pk, start_year, end_year,
+                              compute=lambda: compute_attribution(strategy, start_year, end_year))
@@ -0,0 +1,206 @@
+"""
+Benchmark suite of the emission computation.
+
+For each size, a report is generated (coreapp.datasets) and the computations
+are timed without the computation cache: Report.year_emission,
+ReductionStrategy.year_delta_emission and the serialization of the nested
+report, and its rendering by DRF's JSONRenderer and by the renderers of
+coreapp.renderers. The computations on model instances are compared with the
+compact frames of coreapp.frames, in time and in peak memory (tracemalloc), and
+the loading of a frame from the database with its memory-mapped on-disk copy
+(coreapp.columnstore). The Monte Carlo draws of coreapp.uncertainty are timed
+with uncertain emission factors on all the sources and modifications, and the
+attribution of the delta of a strategy to its modifications (coreapp.attribution).
+The startup suite times new processes running `manage.py check` and importing
+the WSGI and ASGI applications, with the development and production settings.
+The results are plain dicts, written as JSON by the `benchmark` command
+so that two versions can be compared.
+"""
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import django
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from coreapp import attribution, datasets, frames, uncertainty
+from coreapp.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from coreapp.models import LOGNORMAL, NORMAL, Report, ReductionStrategy, ReductionModification, Source
+from coreapp.parameters import DEFAULT_PERCENTILES
+from coreapp.serializers import serialize_report
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_REPEAT = 5
+DEFAULT_YEAR = 2020
+UNCERTAINTY_DRAWS = 1000
+
+STARTUP_SETTINGS = ['tapioview.settings', 'tapioview.settings_production']
+# name: python arguments, run in a new process
+STARTUP_COMMANDS = {
+    'manage.py check': ['manage.py', 'check'],
+    'import wsgi.application': ['-c', 'import tapioview.wsgi'],
+    'import asgi.application': ['-c', 'import tapioview.asgi'],
+    # The URLs are loaded by the first request
+    'wsgi.application + URLs': ['-c', 'import tapioview.wsgi; from django.urls import get_resolver; get_resolver().url_patterns'],
+}
+
+
+def measure(function, repeat: int = DEFAULT_REPEAT) -> dict:
+    """
+    Timings of `repeat` calls of function(), in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {'repeat': repeat,
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'mean': statistics.mean(timings)}
+
+
+def peak_memory(function) -> int:
+    """
+    Peak of the memory allocated during function(), in bytes
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def instances_deltas(report_id: int) -> dict[int, list[float]]:
+    """
+    ReductionStrategy.range_delta_emission of all the strategies, on model instances
+    """
+    strategies = ReductionStrategy.objects.filter(report_id=report_id).prefetch_related('report__sources', 'sourcesStrategy', 'modifications')
+    return {strategy.pk: ReductionStrategy.range_delta_emission.__wrapped__(strategy, datasets.FIRST_YEAR, datasets.LAST_YEAR)
+            for strategy in strategies}
+
+
+def benchmark_size(size: int, strategies: int, modifications: int, repeat: int, year: int) -> list[dict]:
+    results = []
+
+    def record(name: str, function):
+        results.append({'size': size, 'name': name, **measure(function, repeat)})
+
+    start = time.perf_counter()
+    report_id = datasets.generate_report(sources=size, strategies=strategies, modifications=modifications).pk
+    generation = time.perf_counter() - start
+    results.append({'size': size, 'name': 'generate_dataset', 'repeat': 1,
+                    'min': generation, 'median': generation, 'mean': generation})
+    strategy_id = ReductionStrategy.objects.filter(report_id=report_id).values_list('pk', flat=True).first()
+
+    # New instances for each call: the sources are loaded again, as in a request.
+    # __wrapped__ is the computation without the cache (coreapp.caching)
+    record('Report.year_emission',
+           lambda: Report.year_emission.__wrapped__(Report.objects.get(pk=report_id), year))
+    record('Report.range_emission',
+           lambda: Report.range_emission.__wrapped__(Report.objects.get(pk=report_id), datasets.FIRST_YEAR, datasets.LAST_YEAR))
+    if strategy_id is not None:
+        record('ReductionStrategy.year_delta_emission',
+               lambda: ReductionStrategy.range_delta_emission.__wrapped__(
+                   ReductionStrategy.objects.get(pk=strategy_id), year, year))
+
+    # Loading and computation, on model instances then on the frame of the report
+    comparisons = [
+        ('instances.source_emissions',
+         lambda: {source.pk: source.year_emission(year) for source in Source.objects.filter(report_id=report_id)}),
+        ('ReportFrame.source_emissions', lambda: frames.ReportFrame.load(report_id, strategy_ids=[]).source_emissions(year)),
+        ('instances.range_delta_emission', lambda: instances_deltas(report_id)),
+        ('ReportFrame.range_deltas',
+         lambda: frames.ReportFrame.load(report_id).range_deltas(datasets.FIRST_YEAR, datasets.LAST_YEAR)),
+    ]
+    for name, function in comparisons:
+        record(name, function)
+        results[-1]['peak_bytes'] = peak_memory(function)
+
+    # Loading of the frame from the database, then memory-mapped from the on-disk cache
+    with tempfile.TemporaryDirectory() as directory, override_settings(FRAME_STORE_DIR=directory):
+        frames.load_frames([report_id]) # published
+        for name, function in [('ReportFrame.load', lambda: frames.ReportFrame.load(report_id)),
+                               ('columnstore.load_frames', lambda: frames.load_frames([report_id]))]:
+            record(name, function)
+            results[-1]['peak_bytes'] = peak_memory(function)
+
+    Source.objects.filter(report_id=report_id).update(emission_factor_distribution=NORMAL, emission_factor_uncertainty=0.1)
+    (ReductionModification.objects.filter(strategy__report_id=report_id).exclude(emission_factor_change=None)
+     .update(emission_factor_change_distribution=LOGNORMAL, emission_factor_change_uncertainty=0.2))
+    report = Report.objects.get(pk=report_id)
+    record(f'uncertainty.compute_uncertainty({UNCERTAINTY_DRAWS} draws)',
+           lambda: uncertainty.compute_uncertainty(report, datasets.FIRST_YEAR, datasets.LAST_YEAR,
+                                                   UNCERTAINTY_DRAWS, DEFAULT_PERCENTILES, 0))
+    results[-1]['peak_bytes'] = peak_memory(lambda: uncertainty.compute_uncertainty(
+        report, datasets.FIRST_YEAR, datasets.LAST_YEAR, UNCERTAINTY_DRAWS, DEFAULT_PERCENTILES, 0))
+
+    if strategy_id is not None:
+        strategy = ReductionStrategy.objects.get(pk=strategy_id)
+        record('attribution.compute_attribution',
+               lambda: attribution.compute_attribution(strategy, datasets.FIRST_YEAR, datasets.LAST_YEAR))
+
+    record('ReportSerializer', lambda: serialize_report(report_id, None))
+    record('ReportSerializer?year', lambda: serialize_report(report_id, year))
+
+    data = serialize_report(report_id, year)
+    renderers = [JSONRenderer(), ORJSONRenderer()] + ([MessagePackRenderer()] if msgpack else [])
+    for renderer in renderers:
+        record(type(renderer).__name__, lambda: renderer.render(data))
+        results[-1]['bytes'] = len(renderer.render(data))
+    return results
+
+
+def run_suite(sizes=DEFAULT_SIZES, strategies: int = 2, modifications: int = 1,
+              repeat: int = DEFAULT_REPEAT, year: int = DEFAULT_YEAR, progress=None) -> dict:
+    """
+    Run the benchmarks for every size. The generated reports are rolled back.
+    """
+    results = []
+    for size in sizes:
+        if progress:
+            progress(f'{size} sources...')
+        with transaction.atomic():
+            results += benchmark_size(size, strategies, modifications, repeat, year)
+            transaction.set_rollback(True)
+
+    return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'parameters': {'sizes': list(sizes),
+                           'strategies': strategies,
+                           'modifications': modifications,
+                           'repeat': repeat,
+                           'year': year},
+            'results': results}
+
+
+def run_startup_suite(settings_modules=STARTUP_SETTINGS, repeat: int = DEFAULT_REPEAT, progress=None) -> dict:
+    """
+    Time the startup commands in new processes, for each settings module
+    """
+    results = []
+    for settings_module in settings_modules:
+        if progress:
+            progress(f'{settings_module}...')
+        environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': settings_module}
+        environment.setdefault('DJANGO_SECRET_KEY', 'benchmark') # required by the production settings
+        for name, arguments in STARTUP_COMMANDS.items():
+            command = [sys.executable, *arguments]
+            results.append({'settings': settings_module, 'name': name,
+                            **measure(lambda: subprocess.run(command, cwd=settings.BASE_DIR, env=environment,
+                                                             check=True, capture_output=True), repeat)})
+
+    return {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'parameters': {'settings': list(settings_modules), 'repeat': repeat},
+            'results': results}
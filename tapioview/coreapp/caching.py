@@ -0,0 +1,150 @@
+"""
+Versioned cache of the computed totals.
+
+The cache keys contain the revision of the report. Every write to a report, its
+sources, strategies or modifications gives the report a new revision (see
+coreapp.signals), so the entries of the previous revision are never read again
+and are simply evicted by the backend (MAX_ENTRIES, TIMEOUT).
+
+The revision is read from the database on every use, one indexed query for any
+number of reports: a write seen by one process is seen by all of them, whatever the
+cache backend. The local-memory backend is per process: use the file-based (or any
+shared) backend to share the computed totals between several worker processes.
+"""
+import secrets
+from functools import wraps
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from coreapp import metrics
+from coreapp.instrumentation import EMISSION, timer
+
+DEFAULT_TIMEOUT = 3600
+
+# Counters of this process
+counters = {'hits': 0, 'misses': 0}
+
+
+def get_cache():
+    return caches[getattr(settings, 'COMPUTATION_CACHE_ALIAS', 'default')]
+
+
+def new_revision() -> int:
+    """
+    Random revision, so that a revision is never reused, even when a report id is
+    """
+    return secrets.randbits(62)
+
+
+def report_revision(report_id: int) -> int | None:
+    """
+    Current revision of the report, None if it does not exist
+    """
+    return report_revisions([report_id]).get(report_id)
+
+
+def report_revisions(report_ids) -> dict[int, int]:
+    """
+    Current revisions of the reports that exist, with one query
+    """
+    report_ids = list(report_ids)
+    if not report_ids:
+        return {}
+    Report = apps.get_model('coreapp', 'Report')
+    return dict(Report.objects.filter(pk__in=report_ids).values_list('pk', 'revision'))
+
+
+def bump_revisions(report_ids):
+    """
+    Give a new revision to the reports, invalidating all their cached results
+    """
+    report_ids = {report_id for report_id in report_ids if report_id}
+    if not report_ids:
+        return
+    Report = apps.get_model('coreapp', 'Report')
+    Report.objects.filter(pk__in=report_ids).update(revision=new_revision(), updated_at=timezone.now())
+
+
+def _key(name: str, report_id: int, revision: int, args) -> str:
+    return ':'.join(['coreapp', name, str(report_id), str(revision), *map(str, args)])
+
+
+def _count(hits: int, misses: int):
+    counters['hits'] += hits
+    counters['misses'] += misses
+    if hits:
+        metrics.registry.inc(metrics.CACHE_REQUESTS, hits, result='hit')
+    if misses:
+        metrics.registry.inc(metrics.CACHE_REQUESTS, misses, result='miss')
+
+
+def cached(report_id: int, name: str, *args, compute):
+    """
+    Value of compute() for the current revision of the report
+    """
+    revision = report_revision(report_id)
+    if revision is None:
+        return compute()
+
+    cache = get_cache()
+    key = _key(name, report_id, revision, args)
+    value = cache.get(key)
+    if value is not None:
+        _count(1, 0)
+        return value
+
+    _count(0, 1)
+    value = compute()
+    cache.set(key, value, getattr(settings, 'COMPUTATION_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+    return value
+
+
+def cached_many(report_ids, name: str, *args, compute) -> dict:
+    """
+    {report id: value} for the current revision of each report, the values
+    missing from the cache are given by compute(report ids) in one call
+    """
+    revisions = report_revisions(report_ids)
+    keys = {_key(name, report_id, revision, args): report_id for report_id, revision in revisions.items()}
+
+    cache = get_cache()
+    values = {keys[key]: value for key, value in cache.get_many(keys).items()}
+    missing = [report_id for report_id in report_ids if report_id not in values]
+    _count(len(values), len(missing))
+    if missing:
+        computed = compute(missing)
+        cache.set_many({key: computed[report_id] for key, report_id in keys.items() if report_id in computed},
+                       getattr(settings, 'COMPUTATION_CACHE_TIMEOUT', DEFAULT_TIMEOUT))
+        values.update(computed)
+    return values
+
+
+def cached_computation(report_id_attribute: str):
+    """
+    Cache the result of a model method, per report revision and arguments.
+    `report_id_attribute` is the attribute of the instance holding its report id.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args):
+            method_name = f'{type(self).__name__}.{method.__name__}'
+
+            def compute():
+                metrics.registry.inc(metrics.COMPUTATIONS, method=method_name)
+                return method(self, *args)
+
+            with timer(EMISSION):
+                report_id = getattr(self, report_id_attribute)
+                if report_id is None or self.pk is None:
+                    return compute()
+                return cached(report_id, f'{method_name}:{self.pk}', *args, compute=compute)
+        return wrapper
+    return decorator
+
+
+def cache_stats() -> dict:
+    """
+    Hits and misses of this process
+    """
+    return dict(counters)
@@ -0,0 +1,118 @@
+"""
+On-disk columnar cache of the reports, shared by the worker processes.
+
+With settings.FRAME_STORE_DIR, the column arrays of a report (see
+coreapp.frames) are saved once per revision of the report, as .npy files:
+
+    FRAME_STORE_DIR/<report id>/<revision>/manifest.json, <array name>.npy ...
+
+The processes memory-map these files instead of loading the report from the
+database: the operating system keeps one copy of the pages for all of them, and
+the first request of a new worker does not run any query but the revision one.
+
+A revision is written to a temporary directory, then published by renaming it,
+so a directory that exists is always complete. The revisions are random, so a
+process publishing a revision cannot tell the older ones from a newer one
+published meanwhile: prune() removes the revisions that are not the current one
+in the database (`manage.py prune_frame_store`, e.g. hourly), those of the deleted
+reports and the ones older than FRAME_STORE_MAX_AGE.
+Removing files still mapped by another process is safe: they are freed once unmapped.
+"""
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from django.conf import settings
+from coreapp import caching, metrics
+
+MANIFEST = 'manifest.json'
+TEMPORARY_PREFIX = '.tmp-'
+# A temporary directory older than this is left by a process that died while writing it
+TEMPORARY_MAX_AGE = 3600
+DEFAULT_MAX_AGE = 7 * 24 * 3600
+
+
+def store_dir() -> Path | None:
+    path = getattr(settings, 'FRAME_STORE_DIR', None)
+    return Path(path) if path else None
+
+
+def _revision_dir(directory: Path, report_id: int, revision: int) -> Path:
+    return directory / str(report_id) / str(revision)
+
+
+def read(report_id: int, revision: int) -> tuple[dict, dict[str, np.ndarray]] | None:
+    """
+    (manifest, {name: memory-mapped array}) of the revision of the report, None if not published
+    """
+    directory = store_dir()
+    if directory is None:
+        return None
+    path = _revision_dir(directory, report_id, revision)
+    try:
+        manifest = json.loads((path / MANIFEST).read_text())
+        arrays = {name: np.load(path / f'{name}.npy', mmap_mode='r') for name in manifest['arrays']}
+    except (OSError, ValueError):
+        # Not published, or removed while being read
+        metrics.registry.inc(metrics.FRAME_STORE_REQUESTS, result='miss')
+        return None
+    metrics.registry.inc(metrics.FRAME_STORE_REQUESTS, result='hit')
+    return manifest, arrays
+
+
+def publish(report_id: int, revision: int, manifest: dict, arrays: dict[str, np.ndarray]) -> bool:
+    """
+    Save the arrays of the revision of the report.
+    False if the store is disabled or the revision was already published
+    """
+    directory = store_dir()
+    if directory is None:
+        return False
+    report_dir = directory / str(report_id)
+    temporary = None
+    try:
+        report_dir.mkdir(parents=True, exist_ok=True)
+        temporary = Path(tempfile.mkdtemp(prefix=TEMPORARY_PREFIX, dir=report_dir))
+        for name, array in arrays.items():
+            np.save(temporary / f'{name}.npy', np.ascontiguousarray(array), allow_pickle=False)
+        (temporary / MANIFEST).write_text(json.dumps({**manifest, 'arrays': list(arrays)}))
+        os.rename(temporary, report_dir / str(revision))
+    except OSError:
+        # Published by another process in the meantime, or the store is not writable
+        if temporary is not None:
+            shutil.rmtree(temporary, ignore_errors=True)
+        return False
+    return True
+
+
+def prune(max_age: float | None = None) -> int:
+    """
+    Remove the revisions that are not current, older than `max_age` seconds
+    (FRAME_STORE_MAX_AGE by default) or of deleted reports. Number of revisions removed
+    """
+    directory = store_dir()
+    if directory is None or not directory.exists():
+        return 0
+    if max_age is None:
+        max_age = getattr(settings, 'FRAME_STORE_MAX_AGE', DEFAULT_MAX_AGE)
+    report_dirs = {int(path.name): path for path in directory.iterdir() if path.name.isdigit()}
+    revisions = caching.report_revisions(report_dirs)
+    now = time.time()
+
+    removed = 0
+    for report_id, report_dir in report_dirs.items():
+        for path in report_dir.iterdir():
+            age = now - path.stat().st_mtime
+            if path.name.startswith(TEMPORARY_PREFIX):
+                stale = age > TEMPORARY_MAX_AGE
+            else:
+                stale = path.name != str(revisions.get(report_id)) or age > max_age
+                removed += stale
+            if stale:
+                shutil.rmtree(path, ignore_errors=True)
+        if report_id not in revisions and not any(report_dir.iterdir()):
+            report_dir.rmdir()
+    return removed
@@ -0,0 +1,57 @@
+"""
+Comparison of all the strategies of a report over a range of years.
+
+The report is loaded as a compact frame (coreapp.frames): the strategies, the
+report sources, the modifications of all the strategies and the new sources of
+the strategies are each loaded with one query, for one or many reports
+(frames.load_reports) or memory-mapped from the on-disk cache (frames.load_frames),
+then the comparison itself runs without any query (comparison_from_frame). The
+baseline is computed once for all the strategies.
+"""
+from coreapp import caching, frames, metrics
+from coreapp.instrumentation import EMISSION, timer
+from coreapp.models import Report
+
+# Cache entries shared with coreapp.portfolios
+COMPARISON_CACHE_NAME = 'comparison'
+
+
+def comparison_from_data(data: frames.ReportData, start_year: int, end_year: int) -> dict:
+    """
+    The comparison of the report, without any query
+    """
+    return comparison_from_frame(frames.ReportFrame.from_data(data), start_year, end_year)
+
+
+def comparison_from_frame(frame: frames.ReportFrame, start_year: int, end_year: int) -> dict:
+    years = list(range(start_year, end_year + 1))
+    baseline = frame.range_emission(start_year, end_year)
+
+    strategies = []
+    for strategy_id, deltas in frame.range_deltas(start_year, end_year).items():
+        strategies.append({'id': strategy_id,
+                           'name': frame.strategies[strategy_id].name,
+                           'years': [{'year': year,
+                                      'baseline_emission': baseline[i],
+                                      'delta_total_emission': delta,
+                                      'total_emission': baseline[i] - delta}
+                                     for i, (year, delta) in enumerate(zip(years, deltas))]})
+
+    return {'id': frame.id,
+            'years': [{'year': year, 'total_emission': emission} for year, emission in zip(years, baseline)],
+            'strategies': strategies}
+
+
+def compute_comparison(report: Report, start_year: int, end_year: int) -> dict:
+    metrics.registry.inc(metrics.COMPUTATIONS, method='compare_strategies')
+    return comparison_from_frame(frames.load_frames([report.pk])[report.pk], start_year, end_year)
+
+
+def compare_strategies(report: Report, start_year: int, end_year: int) -> dict:
+    """
+    Strategy x year matrix of the baseline emission, the delta and the resulting emission,
+    cached for the revision of the report
+    """
+    with timer(EMISSION):
+        return caching.cached(report.pk, COMPARISON_CACHE_NAME, start_year, end_year,
+                              compute=lambda: compute_comparison(report, start_year, end_year))
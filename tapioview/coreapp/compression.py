@@ -0,0 +1,21 @@
+"""
+Compression of the responses.
+"""
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+DEFAULT_COMPRESSION_MIN_SIZE = 1024
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware for the responses of at least settings.COMPRESSION_MIN_SIZE
+    bytes (the streamed exports are always compressed): smaller responses are
+    not worth the compression time.
+    """
+
+    def process_response(self, request, response):
+        min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', DEFAULT_COMPRESSION_MIN_SIZE)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+        return super().process_response(request, response)
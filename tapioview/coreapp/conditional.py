@@ -0,0 +1,101 @@
+"""
+Conditional GET for the viewsets.
+
+The ETag and Last-Modified validators come from the revision and the update
+date of the report (see coreapp.caching), read with one indexed query. A request
+with a matching If-None-Match / If-Modified-Since is answered with 304 before
+the serializers and the emission computation run.
+"""
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.exceptions import APIException
+from coreapp.models import Report
+
+
+class NotModified(APIException):
+    status_code = 304
+
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+def _variant(request) -> str:
+    """
+    The same report gives different payloads depending on the parameters and the format
+    """
+    variant = f'{request.get_full_path()}|{request.META.get("HTTP_ACCEPT", "")}'
+    return hashlib.sha1(variant.encode()).hexdigest()[:16]
+
+
+def report_validators(report_id: int) -> tuple[str, int] | None:
+    """
+    (revision, last modification timestamp) of a report, None if it does not exist
+    """
+    try:
+        report_id = int(report_id)
+    except ValueError:
+        return None
+    row = Report.objects.filter(pk=report_id).values_list('revision', 'updated_at').first()
+    if row is None:
+        return None
+    revision, updated_at = row
+    return str(revision), int(updated_at.timestamp())
+
+
+def reports_validators() -> tuple[str, int] | None:
+    """
+    Validators of the list of all the reports: any write changes the last update date
+    of a report, and a deletion changes their number
+    """
+    row = Report.objects.aggregate(count=Count('id'), updated_at=Max('updated_at'))
+    if row['updated_at'] is None:
+        return None
+    timestamp = row['updated_at'].timestamp()
+    return f'{row["count"]}.{timestamp}', int(timestamp)
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified headers on GET, 304 when the client copy is still valid.
+    The viewsets return the validators of the requested data with get_validators().
+    """
+
+    def get_validators(self) -> tuple[str, int] | None:
+        report_id = self.kwargs.get('report_id')
+        if report_id is None:
+            return None
+        return report_validators(report_id)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.validators = None
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        validators = self.get_validators()
+        if validators is None:
+            return
+        revision, last_modified = validators
+        self.validators = (quote_etag(f'{revision}-{_variant(request)}'), last_modified)
+
+        response = get_conditional_response(request, etag=self.validators[0], last_modified=last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, 'validators', None)
+        if validators and (200 <= response.status_code < 300 or response.status_code == 304):
+            etag, last_modified = validators
+            response.headers['ETag'] = etag
+            response.headers['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Accept', 'Cookie', 'Authorization'])
+        return response
@@ -0,0 +1,73 @@
+"""
+Synthetic reports for the benchmarks and the manual tests.
+
+The generated reports mix sources with and without acquisition year and lifetime,
+strategies with new sources, and modifications changing the value and the
+emission factor. The generation is deterministic for a given seed.
+"""
+import random
+from django.db import transaction
+from coreapp import importers
+from coreapp.models import Report, ReductionStrategy, Source, ReductionModification
+
+DEFAULT_SEED = 0
+DEFAULT_BATCH_SIZE = 5000
+
+FIRST_YEAR = 2000
+LAST_YEAR = 2030
+LIFETIMES = [None, 2, 5, 10, 20]
+# One new source per NEW_SOURCES_RATIO sources in each strategy
+NEW_SOURCES_RATIO = 100
+
+
+def random_source(rng: random.Random, **kwargs) -> Source:
+    acquisition_year = rng.choice([None, rng.randint(FIRST_YEAR, LAST_YEAR)])
+    return Source(description=f'Source {rng.randrange(10**6)}',
+                  value=round(rng.uniform(1, 1000), 2),
+                  emission_factor=round(rng.uniform(0.1, 10), 3),
+                  acquisition_year=acquisition_year,
+                  lifetime=rng.choice(LIFETIMES) if acquisition_year else None,
+                  **kwargs)
+
+
+def random_modifications(rng: random.Random, strategy: ReductionStrategy, source: Source, count: int):
+    """
+    `count` modifications of the source, with increasing start years
+    """
+    start_year = source.acquisition_year or FIRST_YEAR
+    for order in range(count):
+        start_year = rng.randint(start_year, max(start_year, LAST_YEAR))
+        emission_factor_change = rng.choice([None, round(rng.uniform(0.1, 10), 3)])
+        yield ReductionModification(strategy=strategy,
+                                    source=source,
+                                    description=f'Modification {order}',
+                                    order=order,
+                                    modification_start_year=start_year,
+                                    value_modification=round(rng.uniform(-source.value, 0), 2),
+                                    emission_factor_change=emission_factor_change)
+
+
+def generate_report(sources: int = 1000, strategies: int = 3, modifications: int = 1, name: str | None = None,
+                    seed: int = DEFAULT_SEED, batch_size: int = DEFAULT_BATCH_SIZE) -> Report:
+    """
+    A report with `sources` sources and `strategies` strategies, each strategy
+    applying `modifications` modifications to every source of the report.
+    bulk_create does not send the model signals: the stored totals are refreshed at the end.
+    """
+    rng = random.Random(seed)
+    with transaction.atomic():
+        report = Report.objects.create(name=name or f'Generated report ({sources} sources)')
+        report_sources = Source.objects.bulk_create((random_source(rng, report=report) for _ in range(sources)),
+                                                    batch_size=batch_size)
+
+        for index in range(strategies):
+            strategy = ReductionStrategy.objects.create(name=f'Strategy {index + 1}', report=report)
+            Source.objects.bulk_create((random_source(rng, strategy=strategy) for _ in range(sources // NEW_SOURCES_RATIO)),
+                                       batch_size=batch_size)
+            ReductionModification.objects.bulk_create(
+                (modification for source in report_sources
+                 for modification in random_modifications(rng, strategy, source, modifications)),
+                batch_size=batch_size)
+
+        importers.refresh_report(report)
+    return report
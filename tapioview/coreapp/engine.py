@@ -0,0 +1,297 @@
+"""
+Vectorized emission engine.
+
+The sources of a report are loaded once into column arrays and the rules of
+Source.year_emission are applied to a whole range of years with NumPy,
+instead of walking every source again for each year.
+"""
+import numpy as np
+
+SOURCE_COLUMNS = ['value', 'emission_factor', 'lifetime', 'acquisition_year']
+
+# Bound the (years x sources) temporary arrays to a few MB
+CHUNK_SIZE = 16384
+
+NO_START = np.iinfo(np.int64).min
+NO_END = np.iinfo(np.int64).max
+
+
+class SourceColumns:
+    """
+    Column arrays (value, emission_factor, lifetime, acquisition_year) of a set of sources.
+    Empty lifetime and acquisition_year are stored as 0, which the rules treat as "not set".
+    """
+
+    def __init__(self, value, emission_factor, lifetime, acquisition_year):
+        self.value = np.asarray(value, dtype=np.float64)
+        self.emission_factor = np.asarray(emission_factor, dtype=np.float64)
+        self.lifetime = np.asarray(lifetime, dtype=np.int64)
+        self.acquisition_year = np.asarray(acquisition_year, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'SourceColumns':
+        """
+        Build the columns from (value, emission_factor, lifetime, acquisition_year) tuples
+        """
+        rows = list(rows)
+        if not rows:
+            return cls([], [], [], [])
+        value, emission_factor, lifetime, acquisition_year = zip(*rows)
+        return cls(value,
+                   emission_factor,
+                   [item or 0 for item in lifetime],
+                   [item or 0 for item in acquisition_year])
+
+    @classmethod
+    def from_array(cls, array: np.ndarray) -> 'SourceColumns':
+        """
+        Build the columns from a (sources x 4) float array of the SOURCE_COLUMNS, NaN when empty
+        """
+        array = np.nan_to_num(array, nan=0.0)
+        return cls(array[:, 0], array[:, 1], array[:, 2], array[:, 3])
+
+    @classmethod
+    def from_queryset(cls, queryset) -> 'SourceColumns':
+        """
+        Load the columns with a single query, without building model instances
+        """
+        return cls.from_rows(queryset.values_list(*SOURCE_COLUMNS))
+
+    def __len__(self):
+        return len(self.value)
+
+    def take(self, indexes) -> 'SourceColumns':
+        """
+        The columns of the sources at `indexes`
+        """
+        indexes = np.asarray(indexes, dtype=np.int64)
+        return SourceColumns(self.value[indexes], self.emission_factor[indexes],
+                             self.lifetime[indexes], self.acquisition_year[indexes])
+
+    def yearly_emission(self) -> np.ndarray:
+        """
+        Emission of each source for one year of its life
+        """
+        divisor = np.where(self.lifetime > 0, self.lifetime, 1)
+        return self.value * self.emission_factor / divisor
+
+    def first_year(self) -> np.ndarray:
+        """
+        First year the source emits (acquisition_year), NO_START if always present
+        """
+        return np.where(self.acquisition_year > 0, self.acquisition_year, NO_START)
+
+    def last_year(self) -> np.ndarray:
+        """
+        Last year the source emits before being amortized, NO_END if never amortized
+        """
+        return np.where(self.lifetime > 0, self.acquisition_year + self.lifetime, NO_END)
+
+    def year_emissions(self, year: int) -> np.ndarray:
+        """
+        Emission of each source in `year`
+        """
+        alive = (year >= self.first_year()) & (year <= self.last_year())
+        return np.where(alive, self.yearly_emission(), 0.0)
+
+    def years_emission(self, years) -> np.ndarray:
+        """
+        Total emission of all the sources for each year of `years`
+        """
+        return self._years_total(years, self.yearly_emission())
+
+    def years_unmodified_delta(self, years) -> np.ndarray:
+        """
+        Total of Source.year_delta_emission without any modification, for each year of `years`.
+        The modified emission is clamped to 0, so only the negative emissions give a delta
+        """
+        return self._years_total(years, np.minimum(self.yearly_emission(), 0.0))
+
+    def years_delta(self, years, modifications: 'ModificationColumns') -> np.ndarray:
+        """
+        Total of Source.year_delta_emission for each year of `years`, row i of
+        `modifications` holding the modifications of source i. Same rules as
+        ModificationTimeline.source_delta
+        """
+        years = np.asarray(years, dtype=np.int64)
+        totals = np.zeros(len(years), dtype=np.float64)
+        for _, deltas in self._deltas(years, modifications):
+            totals += deltas.sum(axis=0)
+        return totals
+
+    def source_deltas(self, years, modifications: 'ModificationColumns') -> np.ndarray:
+        """
+        Source.year_delta_emission of each source for each year of `years`, as a (sources x years) array
+        """
+        years = np.asarray(years, dtype=np.int64)
+        result = np.zeros((len(self), len(years)), dtype=np.float64)
+        for chunk, deltas in self._deltas(years, modifications):
+            result[chunk] = deltas
+        return result
+
+    def modified_deltas(self, years, value_change: np.ndarray, emission_factor: np.ndarray) -> np.ndarray:
+        """
+        Source.year_delta_emission of each source for each year of `years`, from the
+        (sources x years) value change and last emission factor set (NaN if none) of its
+        modifications, as returned by ModificationColumns.changes
+        """
+        years = np.asarray(years, dtype=np.int64)
+        return self._chunk_deltas(slice(0, len(self)), years, value_change, emission_factor)
+
+    def _deltas(self, years: np.ndarray, modifications: 'ModificationColumns'):
+        """
+        Yield (chunk, (sources x years) deltas) for chunks of the sources
+        """
+        for start in range(0, len(self), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            value_change, emission_factor = modifications.changes(chunk, years, self.lifetime[chunk])
+            yield chunk, self._chunk_deltas(chunk, years, value_change, emission_factor)
+
+    def _chunk_deltas(self, chunk: slice, years: np.ndarray, value_change: np.ndarray, emission_factor: np.ndarray) -> np.ndarray:
+        columns = self.take(np.arange(len(self))[chunk])
+        exists = years[None, :] >= columns.first_year()[:, None]
+        alive = exists & (years[None, :] <= columns.last_year()[:, None])
+        emission = np.where(alive, columns.yearly_emission()[:, None], 0.0)
+        value = np.where(alive, columns.value[:, None], 0.0) # 0 once amortized
+
+        emission_factor = np.where(np.isnan(emission_factor), columns.emission_factor[:, None], emission_factor)
+        divisor = np.where(columns.lifetime > 0, columns.lifetime, 1)
+        modified = np.maximum(emission_factor * (value + value_change), 0.0) / divisor[:, None]
+        return np.where(exists, emission - modified, 0.0)
+
+    def _years_total(self, years, emission: np.ndarray) -> np.ndarray:
+        """
+        Sum of `emission` over the sources alive in each year of `years`
+        """
+        years = np.asarray(years, dtype=np.int64)
+        totals = np.zeros(len(years), dtype=np.float64)
+        first_year = self.first_year()
+        last_year = self.last_year()
+
+        for start in range(0, len(self), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            alive = ((years[:, None] >= first_year[None, chunk]) &
+                     (years[:, None] <= last_year[None, chunk]))
+            totals += np.where(alive, emission[None, chunk], 0.0).sum(axis=1)
+
+        return totals
+
+
+class ModificationColumns:
+    """
+    The modifications of a set of sources, stored ragged: the modifications of source i
+    are the entries offsets[i] to offsets[i + 1] of the flat arrays, sorted as in
+    coreapp.timeline. Each entry holds the start year, the cumulative value change and
+    the last emission factor set after the modification (NaN if none). `factor_ids`
+    holds the id (given to from_arrays) of the modification that set each of these
+    emission factors, -1 if none (None when unknown).
+    A source with many modifications only costs its own entries, the others are not padded.
+    """
+
+    def __init__(self, offsets, start_years, cumulative_values, emission_factors, factor_ids=None):
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.start_years = np.asarray(start_years, dtype=np.int64)
+        self.cumulative_values = np.asarray(cumulative_values, dtype=np.float64)
+        self.emission_factors = np.asarray(emission_factors, dtype=np.float64)
+        self.factor_ids = None if factor_ids is None else np.asarray(factor_ids, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, count: int, rows) -> 'ModificationColumns':
+        """
+        Build the arrays of `count` sources from
+        (source index, modification_start_year, order, value_modification, emission_factor_change)
+        tuples, the source index being the row of the source
+        """
+        rows = list(rows)
+        if not rows:
+            return cls.from_arrays(count, [], [], [], [], [])
+        return cls.from_arrays(count, *zip(*rows))
+
+    @classmethod
+    def from_arrays(cls, count: int, source, start_year, order, value, emission_factor, ids=None) -> 'ModificationColumns':
+        """
+        Same as from_rows, from one array per field (None or NaN when a change is not set).
+        `ids` identifies each modification in factor_ids, its position by default
+        """
+        if len(source) == 0:
+            return cls(np.zeros(count + 1), [], [], [], [])
+        ids = np.arange(len(source)) if ids is None else np.asarray(ids, dtype=np.int64)
+        source = np.asarray(source, dtype=np.int64)
+        start_year = np.asarray(start_year, dtype=np.int64)
+        # The changes not set (or 0) are ignored by the rules
+        value = np.nan_to_num(np.asarray(value, dtype=np.float64), nan=0.0)
+        emission_factor = np.asarray(emission_factor, dtype=np.float64)
+        emission_factor = np.where(emission_factor == 0, np.nan, emission_factor)
+
+        # Sorted per source, then by (modification_start_year, order)
+        sort = np.lexsort((np.asarray(order, dtype=np.int64), start_year, source))
+        source, start_year, value, emission_factor, ids = source[sort], start_year[sort], value[sort], emission_factor[sort], ids[sort]
+        position = np.arange(len(source))
+        group_start = np.searchsorted(source, source) # position of the first modification of the source
+
+        cumulative = np.cumsum(value)
+        cumulative_value = cumulative - (cumulative[group_start] - value[group_start])
+        # Last emission factor set, in the modifications of the same source
+        last_set = np.maximum.accumulate(np.where(np.isnan(emission_factor), -1, position))
+        last_emission_factor = np.where(last_set >= group_start, emission_factor[np.maximum(last_set, 0)], np.nan)
+        last_factor_id = np.where(last_set >= group_start, ids[np.maximum(last_set, 0)], -1)
+
+        offsets = np.searchsorted(source, np.arange(count + 1))
+        return cls(offsets, start_year, cumulative_value, last_emission_factor, last_factor_id)
+
+    def __len__(self):
+        """
+        Number of sources
+        """
+        return len(self.offsets) - 1
+
+    def changes(self, rows: slice, years: np.ndarray, lifetime: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (value change, last emission factor set) of the modifications started in each
+        year, for the sources of `rows`: (sources x years) arrays, as SourceTimeline.changes
+        """
+        return self._changes(rows, years, lifetime, self.emission_factors, np.nan)
+
+    def factor_changes(self, rows: slice, years: np.ndarray, lifetime: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as changes, with the id of the modification that set the emission factor (-1 if none)
+        """
+        factor_ids = self.factor_ids if self.factor_ids is not None else np.full(len(self.start_years), -1)
+        return self._changes(rows, years, lifetime, factor_ids, -1)
+
+    def _changes(self, rows: slice, years: np.ndarray, lifetime: np.ndarray, factors: np.ndarray, missing):
+        offsets = self.offsets[rows.start:min(rows.stop, len(self)) + 1]
+        shape = (len(offsets) - 1, len(years))
+        first, end = offsets[0], offsets[-1]
+        if first == end or len(years) == 0:
+            return np.zeros(shape), np.full(shape, missing, dtype=factors.dtype)
+
+        # The entries of the sources are sorted by (source, start year): the key
+        # source x span + year is sorted too, and one search per (source, year) finds
+        # the last modification started in the year
+        start_years = self.start_years[first:end]
+        base = min(start_years.min(), years.min())
+        span = max(start_years.max(), years.max()) - base + 1
+        counts = np.diff(offsets)
+        keys = np.repeat(np.arange(shape[0]) * span, counts) + (start_years - base)
+        group_start = offsets[:-1] - first
+        found = np.searchsorted(keys, (np.arange(shape[0]) * span)[:, None] + (years - base)[None, :], side='right')
+        count = found - group_start[:, None]
+        last = first + np.maximum(found - 1, 0)
+        value_change = self.cumulative_values[last]
+        factor = factors[last]
+
+        # Once the first modification is amortized, only its emission factor is kept
+        first_start = np.where(counts > 0, start_years[np.minimum(group_start, len(start_years) - 1)], 0)
+        broken = (count > 0) & (lifetime[:, None] > 0) & (first_start[:, None] + lifetime[:, None] < years[None, :])
+        value_change = np.where((count == 0) | broken, 0.0, value_change)
+        factor = np.where(broken, factors[np.minimum(first + group_start, len(factors) - 1)][:, None], factor)
+        factor = np.where(count == 0, missing, factor)
+        return value_change, factor
+
+
+def year_range(start_year: int, end_year: int) -> np.ndarray:
+    """
+    All the years from start_year to end_year, both included
+    """
+    return np.arange(start_year, end_year + 1, dtype=np.int64)
@@ -0,0 +1,142 @@
+"""
+Streaming export of a report.
+
+The sources, strategies and modifications are read with QuerySet.iterator() and
+encoded line by line, so the memory used does not depend on the size of the
+report. With a year, the sources rows contain their year_emission and the
+strategies rows their delta_total_emission, read from the stored totals
+(coreapp.aggregates), or computed by the database for a year outside of the
+stored horizon. The source emissions of a frozen year are read from its snapshot
+(coreapp.snapshots). An emission that cannot be computed (a source without
+emission factor) is exported as null in NDJSON and empty in CSV, NaN not being JSON.
+"""
+import csv
+import json
+import math
+from django.db.models import Prefetch
+from coreapp import aggregates, queries, snapshots
+from coreapp.models import Report, Source, ReductionStrategy, ReductionModification, StrategyYearDelta
+
+CHUNK_SIZE = 2000
+# Number of lines sent to the client at once
+LINES_PER_CHUNK = 500
+
+EXPORT_FIELDS = ['type',
+                 'id',
+                 'report',
+                 'strategy',
+                 'source',
+                 'name',
+                 'description',
+                 'value',
+                 'emission_factor',
+                 'lifetime',
+                 'acquisition_year',
+                 'order',
+                 'modification_start_year',
+                 'value_modification',
+                 'emission_factor_change',
+                 'year_emission',
+                 'delta_total_emission']
+
+
+def finite(value: float | None) -> float | None:
+    """
+    The value, None if NaN or infinite
+    """
+    return value if value is None or math.isfinite(value) else None
+
+
+def source_row(source: Source, year: int | None, frozen_emissions: dict[int, float] | None = None) -> dict:
+    row = {'type': 'source',
+           'id': source.id,
+           'report': source.report_id,
+           'strategy': source.strategy_id,
+           'description': source.description,
+           'value': source.value,
+           'emission_factor': source.emission_factor,
+           'lifetime': source.lifetime,
+           'acquisition_year': source.acquisition_year}
+    if year is not None:
+        if frozen_emissions and source.id in frozen_emissions:
+            row['year_emission'] = finite(frozen_emissions[source.id])
+        else:
+            row['year_emission'] = finite(source.year_emission(year))
+    return row
+
+
+def strategy_row(strategy: ReductionStrategy, year: int | None) -> dict:
+    row = {'type': 'strategy',
+           'id': strategy.id,
+           'report': strategy.report_id,
+           'name': strategy.name}
+    if year is not None:
+        row['delta_total_emission'] = finite(aggregates.strategy_year_delta(strategy, year))
+    return row
+
+
+def modification_row(modification: ReductionModification) -> dict:
+    return {'type': 'modification',
+            'id': modification.id,
+            'strategy': modification.strategy_id,
+            'source': modification.source_id,
+            'description': modification.description,
+            'order': modification.order,
+            'modification_start_year': modification.modification_start_year,
+            'value_modification': modification.value_modification,
+            'emission_factor_change': modification.emission_factor_change}
+
+
+def export_rows(report: Report, year: int | None = None):
+    """
+    Yield the rows of the report: its sources, then each strategy followed by
+    its new sources and its modifications
+    """
+    frozen_emissions = snapshots.source_emissions(report.pk, year)
+    for source in Source.objects.filter(report=report).iterator(chunk_size=CHUNK_SIZE):
+        yield source_row(source, year, frozen_emissions)
+
+    strategies = ReductionStrategy.objects.filter(report=report).select_related('report')
+    if queries.stored_year(year):
+        strategies = strategies.prefetch_related(Prefetch('yearDeltas',
+                                                          queryset=StrategyYearDelta.objects.filter(year=year),
+                                                          to_attr='stored_year_deltas'))
+    for strategy in strategies.iterator(chunk_size=CHUNK_SIZE):
+        yield strategy_row(strategy, year)
+        for source in Source.objects.filter(strategy=strategy).iterator(chunk_size=CHUNK_SIZE):
+            yield source_row(source, year)
+        for modification in ReductionModification.objects.filter(strategy=strategy).iterator(chunk_size=CHUNK_SIZE):
+            yield modification_row(modification)
+
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= LINES_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def ndjson_lines(rows):
+    return _chunked(json.dumps(row, allow_nan=False) + '\n' for row in rows)
+
+
+class _Echo:
+    """
+    File-like object returning what is written, for csv.writer
+    """
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.DictWriter(_Echo(), fieldnames=EXPORT_FIELDS)
+
+    def lines():
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+    return _chunked(lines())
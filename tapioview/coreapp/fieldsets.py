@@ -0,0 +1,105 @@
+"""
+Sparse fieldsets for the serializers.
+
+Query parameters of the GET requests:
+* fields=id,name,sources.value -> only these fields (dotted paths for the nested objects)
+* expand=reductionStrategies.modifications -> only these nested objects are embedded
+* summary=1 -> no nested object, only the header and its computed totals
+
+The same selection is used by the query planning (coreapp.queries), so a field
+that is not requested is neither queried nor serialized.
+"""
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.serializers import BaseSerializer
+
+
+def parse_paths(value: str) -> dict:
+    """
+    'a,b.c,b.d' -> {'a': None, 'b': {'c': None, 'd': None}}, None meaning the whole field
+    """
+    tree = {}
+    for path in value.split(','):
+        names = [name.strip() for name in path.split('.') if name.strip()]
+        node = tree
+        for i, name in enumerate(names):
+            if i == len(names) - 1:
+                node[name] = None
+            elif node.get(name, {}) is None:
+                break # the whole field is already selected
+            else:
+                node = node.setdefault(name, {})
+    return tree
+
+
+class FieldSelection:
+    """
+    Selected fields of one serializer, `fields` and `expand` are trees from parse_paths().
+    fields=None -> all the fields, expand=None -> all the nested objects.
+    """
+
+    def __init__(self, fields: dict | None = None, expand: dict | None = None):
+        self.fields = fields
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request) -> 'FieldSelection':
+        params = request.query_params
+        fields = parse_paths(params['fields']) if params.get('fields') else None
+        expand = None
+        if 'expand' in params:
+            expand = parse_paths(params['expand'])
+        elif params.get('summary') in ['1', 'true']:
+            expand = {}
+        return cls(fields, expand)
+
+    def allows(self, name: str, nested: bool = False) -> bool:
+        if self.fields is not None and name not in self.fields:
+            return False
+        if nested and self.expand is not None and name not in self.expand:
+            # listing a nested field in `fields` also expands it
+            return self.fields is not None and name in self.fields
+        return True
+
+    def child(self, name: str) -> 'FieldSelection':
+        fields = self.fields.get(name) if self.fields is not None else None
+        expand = self.expand.get(name) or {} if self.expand is not None else None
+        return FieldSelection(fields, expand)
+
+
+def request_selection(request) -> FieldSelection | None:
+    """
+    Selection of the root serializer of a GET request, None for writes
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    if not hasattr(request, '_field_selection'):
+        request._field_selection = FieldSelection.from_request(request)
+    return request._field_selection
+
+
+class DynamicFieldsMixin:
+    """
+    Remove the fields not selected by the request (see FieldSelection)
+    """
+
+    def get_field_selection(self) -> FieldSelection | None:
+        selection = request_selection(self.context.get('request'))
+        if selection is None:
+            return None
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.append(node.field_name)
+            node = node.parent
+        for name in reversed(path):
+            selection = selection.child(name)
+        return selection
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selection = self.get_field_selection()
+        if selection is None:
+            return fields
+        return {name: field for name, field in fields.items()
+                if selection.allows(name, nested=isinstance(field, BaseSerializer))}
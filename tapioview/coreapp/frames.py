@@ -0,0 +1,318 @@
+"""
+Compact read model of a report for the emission computations.
+
+A ReportFrame holds what the rules read of a report without any model instance:
+the sources as column arrays (engine.SourceColumns) and, for each strategy, the
+columns of the sources it modifies with their modifications
+(engine.ModificationColumns) and the columns of its new sources. It is built
+from the values_list() rows of load_reports, four queries for any number of
+reports, and answers year_emission, year_delta_emission and their ranges
+without any query.
+
+load_frames reads the frames from the on-disk cache of coreapp.columnstore when
+it is enabled: their arrays are then memory-mapped, shared by the processes.
+
+The rows themselves (ReportData) are float arrays filled while the rows are
+streamed from the database, compact in memory and small to pickle when sent to
+another process (see coreapp.portfolios).
+
+The deltas of a strategy are computed from the baseline of the report:
+
+    delta = unmodified delta of all the sources
+            + sum over the modified sources of (delta - unmodified delta)
+            - emission of the strategy new sources
+
+so the unmodified delta of the sources is computed once for all the strategies.
+"""
+import numpy as np
+from coreapp import caching, columnstore, engine, metrics
+from coreapp.models import ReductionStrategy, Source, ReductionModification
+
+# Cache entries of year_deltas
+YEAR_DELTAS_CACHE_NAME = 'year_deltas'
+
+MODIFICATION_COLUMNS = ['source_id', 'modification_start_year', 'order', 'value_modification', 'emission_factor_change']
+
+# Rows read from the database cursor at once
+FETCH_CHUNK_SIZE = 10000
+
+# Arrays of the columns saved by ReportFrame.to_arrays
+SOURCE_ARRAYS = ['value', 'emission_factor', 'lifetime', 'acquisition_year']
+MODIFICATION_ARRAYS = ['offsets', 'start_years', 'cumulative_values', 'emission_factors']
+# Layout of the saved arrays, the frames saved with another one are loaded again
+FRAME_FORMAT = 2
+
+
+class ReportData:
+    """
+    The rows of a report read by the computations, as float arrays (NaN when a field is empty)
+    """
+    __slots__ = ('id', 'strategies', 'sources', 'modifications', 'new_sources')
+
+    def __init__(self, report_id: int, strategies: list, sources: np.ndarray, modifications: np.ndarray, new_sources: np.ndarray):
+        self.id = report_id
+        self.strategies = strategies # (id, name)
+        self.sources = sources # id, *SOURCE_COLUMNS, sorted by id
+        self.modifications = modifications # strategy id, *MODIFICATION_COLUMNS
+        self.new_sources = new_sources # strategy id, *SOURCE_COLUMNS
+
+    def __len__(self):
+        """
+        Number of rows, a measure of the work of the computations
+        """
+        return len(self.sources) + len(self.modifications) + len(self.new_sources)
+
+
+def fetch_columns(queryset, *fields) -> np.ndarray:
+    """
+    The values of `fields` as a (rows x fields) float array, without keeping the rows in memory
+    """
+    rows = queryset.values_list(*fields).iterator(chunk_size=FETCH_CHUNK_SIZE)
+    return np.fromiter(rows, dtype=np.dtype((np.float64, len(fields))))
+
+
+def group_rows(array: np.ndarray) -> dict[int, np.ndarray]:
+    """
+    {first column: the rows with this value, without the first column}, in the order of the rows
+    """
+    array = array[np.argsort(array[:, 0], kind='stable')]
+    keys, starts = np.unique(array[:, 0], return_index=True)
+    return dict(zip(keys.astype(np.int64).tolist(), np.split(array[:, 1:], starts[1:])))
+
+
+def known_source_rows(source_ids: np.ndarray, ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (mask of the ids found in the sorted source_ids, their rows in source_ids).
+    The modifications of the sources of another report are ignored with it
+    """
+    source_rows = np.searchsorted(source_ids, ids)
+    known = source_rows < len(source_ids)
+    known[known] = source_ids[source_rows[known]] == ids[known]
+    return known, source_rows[known]
+
+
+def load_reports(report_ids, strategy_ids=None) -> dict[int, ReportData]:
+    """
+    Data of the reports, with four queries whatever their number.
+    With `strategy_ids`, only these strategies are loaded
+    """
+    report_ids = list(report_ids)
+    strategies = ReductionStrategy.objects.filter(report_id__in=report_ids)
+    modifications = ReductionModification.objects.filter(strategy__report_id__in=report_ids)
+    new_sources = Source.objects.filter(strategy__report_id__in=report_ids)
+    if strategy_ids is not None:
+        strategies = strategies.filter(pk__in=strategy_ids)
+        modifications = modifications.filter(strategy_id__in=strategy_ids)
+        new_sources = new_sources.filter(strategy_id__in=strategy_ids)
+
+    report_strategies = {}
+    for report_id, *values in strategies.order_by('report_id', 'id').values_list('report_id', 'id', 'name'):
+        report_strategies.setdefault(report_id, []).append(tuple(values))
+    sources = group_rows(fetch_columns(Source.objects.filter(report_id__in=report_ids).order_by('report_id', 'id'),
+                                       'report_id', 'id', *engine.SOURCE_COLUMNS))
+    modifications = group_rows(fetch_columns(modifications.order_by(), 'strategy__report_id', 'strategy_id', *MODIFICATION_COLUMNS))
+    new_sources = group_rows(fetch_columns(new_sources.order_by(), 'strategy__report_id', 'strategy_id', *engine.SOURCE_COLUMNS))
+
+    return {report_id: ReportData(report_id, report_strategies.get(report_id, []),
+                                  sources.get(report_id, np.empty((0, len(engine.SOURCE_COLUMNS) + 1))),
+                                  modifications.get(report_id, np.empty((0, len(MODIFICATION_COLUMNS) + 1))),
+                                  new_sources.get(report_id, np.empty((0, len(engine.SOURCE_COLUMNS) + 1))))
+            for report_id in report_ids}
+
+
+class StrategyFrame:
+    """
+    The columns of a strategy: the report sources it modifies, their modifications, its new sources
+    """
+    __slots__ = ('id', 'name', 'modified', 'modifications', 'new_sources')
+
+    def __init__(self, strategy_id: int, name: str, modified: engine.SourceColumns,
+                 modifications: engine.ModificationColumns, new_sources: engine.SourceColumns):
+        self.id = strategy_id
+        self.name = name
+        self.modified = modified
+        self.modifications = modifications
+        self.new_sources = new_sources
+
+
+class ReportFrame:
+    """
+    The columns of a report and of its strategies (see the module documentation)
+    """
+    __slots__ = ('id', 'source_ids', 'sources', 'strategies')
+
+    def __init__(self, report_id: int, source_ids, sources: engine.SourceColumns, strategies: dict[int, StrategyFrame]):
+        self.id = report_id
+        self.source_ids = np.asarray(source_ids, dtype=np.int64)
+        self.sources = sources
+        self.strategies = strategies
+
+    @classmethod
+    def from_data(cls, data: ReportData) -> 'ReportFrame':
+        source_ids = data.sources[:, 0].astype(np.int64)
+        sources = engine.SourceColumns.from_array(data.sources[:, 1:])
+        modifications = group_rows(data.modifications)
+        new_sources = group_rows(data.new_sources)
+
+        strategies = {}
+        for strategy_id, name in data.strategies:
+            rows = modifications.get(strategy_id, np.empty((0, len(MODIFICATION_COLUMNS))))
+            known, source_rows = known_source_rows(source_ids, rows[:, 0])
+            rows = rows[known]
+            modified, index = np.unique(source_rows, return_inverse=True)
+            strategies[strategy_id] = StrategyFrame(
+                strategy_id, name, sources.take(modified),
+                engine.ModificationColumns.from_arrays(len(modified), index, *rows[:, 1:].T),
+                engine.SourceColumns.from_array(new_sources.get(strategy_id, np.empty((0, len(engine.SOURCE_COLUMNS))))))
+        return cls(data.id, source_ids, sources, strategies)
+
+    @classmethod
+    def load(cls, report_id: int, strategy_ids=None) -> 'ReportFrame':
+        """
+        The frame of a report, with four queries
+        """
+        return cls.from_data(load_reports([report_id], strategy_ids)[report_id])
+
+    def to_arrays(self) -> tuple[dict, dict[str, np.ndarray]]:
+        """
+        (manifest, {name: array}) of the frame, as saved by coreapp.columnstore
+        """
+        arrays = {'source_ids': self.source_ids, **_arrays('sources', self.sources, SOURCE_ARRAYS)}
+        for strategy in self.strategies.values():
+            arrays.update(_arrays(f'strategy-{strategy.id}-modified', strategy.modified, SOURCE_ARRAYS))
+            arrays.update(_arrays(f'strategy-{strategy.id}-modifications', strategy.modifications, MODIFICATION_ARRAYS))
+            arrays.update(_arrays(f'strategy-{strategy.id}-new_sources', strategy.new_sources, SOURCE_ARRAYS))
+        manifest = {'format': FRAME_FORMAT, 'report': self.id, 'strategies': [[strategy.id, strategy.name] for strategy in self.strategies.values()]}
+        return manifest, arrays
+
+    @classmethod
+    def from_arrays(cls, manifest: dict, arrays: dict[str, np.ndarray], strategy_ids=None) -> 'ReportFrame':
+        """
+        The frame of to_arrays, without copying the arrays. With `strategy_ids`, only these strategies
+        """
+        def columns(prefix: str, column_class, names):
+            return column_class(*(arrays[f'{prefix}.{name}'] for name in names))
+
+        strategies = {}
+        for strategy_id, name in manifest['strategies']:
+            if strategy_ids is not None and strategy_id not in strategy_ids:
+                continue
+            prefix = f'strategy-{strategy_id}'
+            strategies[strategy_id] = StrategyFrame(
+                strategy_id, name, columns(f'{prefix}-modified', engine.SourceColumns, SOURCE_ARRAYS),
+                columns(f'{prefix}-modifications', engine.ModificationColumns, MODIFICATION_ARRAYS),
+                columns(f'{prefix}-new_sources', engine.SourceColumns, SOURCE_ARRAYS))
+        return cls(manifest['report'], arrays['source_ids'],
+                   columns('sources', engine.SourceColumns, SOURCE_ARRAYS), strategies)
+
+    def __len__(self):
+        """
+        Number of sources
+        """
+        return len(self.sources)
+
+    # Emission
+
+    def year_emission(self, year: int) -> float:
+        return self.range_emission(year, year)[0]
+
+    def range_emission(self, start_year: int, end_year: int) -> list[float]:
+        return self.sources.years_emission(engine.year_range(start_year, end_year)).tolist()
+
+    def source_emissions(self, year: int) -> dict[int, float]:
+        """
+        {source id: Source.year_emission(year)}
+        """
+        return dict(zip(self.source_ids.tolist(), self.sources.year_emissions(year).tolist()))
+
+    # Delta
+
+    def year_delta_emission(self, strategy_id: int, year: int) -> float:
+        return self.range_delta_emission(strategy_id, year, year)[0]
+
+    def range_delta_emission(self, strategy_id: int, start_year: int, end_year: int) -> list[float]:
+        years = engine.year_range(start_year, end_year)
+        return self._deltas(self.strategies[strategy_id], years, self.sources.years_unmodified_delta(years)).tolist()
+
+    def range_deltas(self, start_year: int, end_year: int) -> dict[int, list[float]]:
+        """
+        {strategy id: range_delta_emission} of all the strategies
+        """
+        years = engine.year_range(start_year, end_year)
+        unmodified_delta = self.sources.years_unmodified_delta(years)
+        return {strategy_id: self._deltas(strategy, years, unmodified_delta).tolist()
+                for strategy_id, strategy in self.strategies.items()}
+
+    def _deltas(self, strategy: StrategyFrame, years: np.ndarray, unmodified_delta: np.ndarray) -> np.ndarray:
+        return (unmodified_delta - strategy.new_sources.years_emission(years)
+                + strategy.modified.years_delta(years, strategy.modifications)
+                - strategy.modified.years_unmodified_delta(years))
+
+
+def _arrays(prefix: str, columns, names) -> dict[str, np.ndarray]:
+    return {f'{prefix}.{name}': getattr(columns, name) for name in names}
+
+
+def load_frames(report_ids, strategy_ids=None) -> dict[int, ReportFrame]:
+    """
+    Frames of the reports, memory-mapped from coreapp.columnstore when published for
+    their current revision. The others are loaded with load_reports, then published
+    if their revision did not change meanwhile.
+    With `strategy_ids`, only these strategies are kept
+    """
+    report_ids = list(report_ids)
+    if columnstore.store_dir() is None:
+        return {report_id: ReportFrame.from_data(data) for report_id, data in load_reports(report_ids, strategy_ids).items()}
+
+    revisions = caching.report_revisions(report_ids)
+    frames = {}
+    for report_id, revision in revisions.items():
+        stored = columnstore.read(report_id, revision)
+        if stored is not None and stored[0].get('format') == FRAME_FORMAT:
+            frames[report_id] = ReportFrame.from_arrays(*stored, strategy_ids=strategy_ids)
+
+    missing = [report_id for report_id in report_ids if report_id not in frames]
+    loaded = load_reports(missing) if missing else {}
+    # A report written while being loaded may have rows of its next revision: it is not published
+    current = caching.report_revisions([report_id for report_id in loaded if report_id in revisions]) if loaded else {}
+    for report_id, data in loaded.items():
+        frame = ReportFrame.from_data(data)
+        if report_id in revisions and current.get(report_id) == revisions[report_id]:
+            columnstore.publish(report_id, revisions[report_id], *frame.to_arrays())
+        if strategy_ids is not None:
+            frame.strategies = {strategy_id: strategy for strategy_id, strategy in frame.strategies.items()
+                                if strategy_id in strategy_ids}
+        frames[report_id] = frame
+    return frames
+
+
+# Computed fields
+
+def compute_year_deltas(report_ids, year: int) -> dict[int, dict[int, float]]:
+    frames = load_frames(report_ids)
+    metrics.registry.inc(metrics.COMPUTATIONS, len(frames), method='ReportFrame.range_deltas')
+    return {report_id: {strategy_id: deltas[0] for strategy_id, deltas in frame.range_deltas(year, year).items()}
+            for report_id, frame in frames.items()}
+
+
+def year_deltas(report_ids, year: int) -> dict[int, dict[int, float]]:
+    """
+    {report id: {strategy id: delta of the year}}, computed with the frames of the
+    reports missing from the computation cache
+    """
+    return caching.cached_many(report_ids, YEAR_DELTAS_CACHE_NAME, year,
+                               compute=lambda missing: compute_year_deltas(missing, year))
+
+
+def annotate_year_deltas(strategies, year: int):
+    """
+    Set the delta of the year of each strategy (`computed_year_delta`, read by
+    aggregates.strategy_year_delta), with one frame loading for all their reports
+    """
+    strategies = [strategy for strategy in strategies if getattr(strategy, 'computed_year', None) != year]
+    if not strategies:
+        return
+    deltas = year_deltas({strategy.report_id for strategy in strategies}, year)
+    for strategy in strategies:
+        strategy.computed_year = year
+        strategy.computed_year_delta = deltas.get(strategy.report_id, {}).get(strategy.pk, 0.0)
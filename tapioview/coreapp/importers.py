@@ -0,0 +1,150 @@
+"""
+Streaming bulk import of sources.
+
+The upload (CSV with a header line, or NDJSON: one JSON object per line) is read
+row by row, validated against the Source fields and constraints, and inserted
+with bulk_create in batches inside one transaction. Only one batch is held in
+memory. Invalid rows are skipped and listed in the error report.
+"""
+import codecs
+import csv
+import json
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from coreapp import aggregates, caching, snapshots
+from coreapp.frames import ReportFrame
+from coreapp.models import Report, ReductionStrategy, Source
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+FORMATS = [CSV, NDJSON]
+
+IMPORTED_FIELDS = ['description', 'value', 'emission_factor', 'lifetime', 'acquisition_year',
+                   'emission_factor_distribution', 'emission_factor_uncertainty']
+
+DEFAULT_BATCH_SIZE = 1000
+# The error report lists the first errors only
+MAX_REPORTED_ERRORS = 1000
+
+
+def guess_format(content_type: str | None, name: str | None) -> str | None:
+    content_type = (content_type or '').split(';')[0].strip()
+    if content_type in ['text/csv', 'application/csv'] or (name or '').endswith('.csv'):
+        return CSV
+    if content_type in ['application/x-ndjson', 'application/jsonl'] or (name or '').endswith(('.ndjson', '.jsonl')):
+        return NDJSON
+    return None
+
+
+def iter_rows(stream, file_format: str):
+    """
+    Yield (line number, dict) from a binary stream
+    """
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    if file_format == CSV:
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row
+
+
+def check_constraints(source: Source):
+    """
+    Same checks as the Source Meta.constraints, without a query per row
+    """
+    if source.report_id is None and source.strategy_id is None:
+        raise ValidationError({'report': 'rep_or_strat_not_empty: a source needs a report or a strategy.'})
+    if source.lifetime is not None and source.acquisition_year is None:
+        raise ValidationError({'acquisition_year': 'if_lifetime_not_empty_acquisition_year_not_empty: '
+                                                   'acquisition_year is required with a lifetime.'})
+    if source.emission_factor_distribution and (source.emission_factor_uncertainty is None or source.emission_factor_uncertainty < 0):
+        raise ValidationError({'emission_factor_uncertainty': 'source_distribution_needs_uncertainty: '
+                                                              'a positive uncertainty is required with a distribution.'})
+
+
+def build_source(row, report: Report | None, strategy: ReductionStrategy | None) -> Source:
+    if not isinstance(row, dict):
+        raise ValidationError('Invalid row.')
+    # Empty CSV cells are empty values
+    values = {field: (None if row.get(field) == '' else row.get(field)) for field in IMPORTED_FIELDS}
+    values['emission_factor_distribution'] = values['emission_factor_distribution'] or ''
+    source = Source(report=report, strategy=strategy, **values)
+    source.full_clean(exclude=['report', 'strategy'], validate_constraints=False)
+    check_constraints(source)
+    return source
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.created = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line_number: int, error: ValidationError):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            messages = error.message_dict if hasattr(error, 'error_dict') else {'row': error.messages}
+            self.errors.append({'line': line_number, 'errors': messages})
+
+    def as_dict(self) -> dict:
+        return {'created': self.created,
+                'error_count': self.error_count,
+                'errors': self.errors}
+
+
+def import_sources(stream, file_format: str, report: Report | None = None, strategy: ReductionStrategy | None = None,
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> ImportResult:
+    """
+    Import the sources of the stream into a report or a strategy.
+    bulk_create does not send the model signals: the stored totals and the revision
+    of the report are refreshed once at the end.
+    """
+    result = ImportResult()
+    batch = []
+    # The rows changing a frozen year are rejected, like the other invalid rows
+    frozen = snapshots.frozen_years([(report or strategy.report).pk])
+    with transaction.atomic():
+        for line_number, row in iter_rows(stream, file_format):
+            try:
+                source = build_source(row, report, strategy)
+                snapshots.check_source(None, source, frozen)
+                batch.append(source)
+            except ValidationError as error:
+                result.add_error(line_number, error)
+                continue
+            if len(batch) >= batch_size:
+                Source.objects.bulk_create(batch)
+                result.created += len(batch)
+                batch = []
+        if batch:
+            Source.objects.bulk_create(batch)
+            result.created += len(batch)
+
+        if result.created:
+            refresh_report(report or strategy.report, strategies=None if report else [strategy])
+    return result
+
+
+def refresh_report(report: Report, strategies=None):
+    """
+    Recompute the stored totals after a bulk write and give the report a new revision.
+    The sources of a report change the delta of all its strategies.
+    """
+    # New revision first, the cached results of the previous one are obsolete
+    caching.bump_revisions([report.pk])
+    # The report is loaded once for all the strategies, without model instances
+    frame = ReportFrame.load(report.pk, strategy_ids=None if strategies is None else [strategy.pk for strategy in strategies])
+    if strategies is None:
+        aggregates.materialize_report(report, frame)
+        strategies = report.reductionStrategies.all()
+    for strategy in strategies:
+        aggregates.materialize_strategy(strategy, frame)
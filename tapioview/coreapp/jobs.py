@@ -0,0 +1,213 @@
+"""
+Background computation jobs.
+
+A ComputationJob is queued by POST /jobs/ and run by the worker processes of
+`manage.py run_workers`, the database being the queue. A worker claims the
+oldest pending job by moving it to `running` with a conditional UPDATE (after
+locking its row with SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it), so that two workers never run the same job. While the job runs,
+a thread of the worker refreshes its heartbeat_at every
+settings.JOB_HEARTBEAT_INTERVAL seconds. The jobs without heartbeat for
+settings.JOB_TIMEOUT seconds (their worker died) are queued again. The result or
+the error is stored only if the job is still running for this worker: a job
+queued again meanwhile is finished by the worker that claimed it next.
+
+Each kind of job runs the same computation as the matching endpoint.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from typing import Callable, NamedTuple
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from coreapp import comparison, exporters, portfolios, uncertainty
+from coreapp.models import ComputationJob, Report
+from coreapp.parameters import parse_monte_carlo, parse_year, parse_year_range
+from coreapp.serializers import serialize_report
+
+logger = logging.getLogger('coreapp.jobs')
+
+DEFAULT_JOB_TIMEOUT = 600
+DEFAULT_HEARTBEAT_INTERVAL = 60.0
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+def report_timeseries(report: Report, start_year: int, end_year: int) -> dict:
+    """
+    Total emission of the report for every year of the range
+    """
+    emissions = report.range_emission(start_year, end_year)
+    return {
+        'id': report.id,
+        'timeseries': [{'year': year, 'total_emission': emission}
+                       for year, emission in zip(range(start_year, end_year + 1), emissions)]
+    }
+
+
+class Kind(NamedTuple):
+    target: str # 'report' or 'portfolio'
+    year_range: bool # needs the `from` and `to` parameters
+    run: Callable # run(target, parameters) -> result
+    check: Callable | None = None # check(parameters), raises a ValidationError
+
+
+KINDS = {
+    ComputationJob.REPORT: Kind('report', False,
+                                lambda report, parameters: serialize_report(report.pk, parse_year(parameters))),
+    ComputationJob.TIMESERIES: Kind('report', True,
+                                    lambda report, parameters: report_timeseries(report, *parse_year_range(parameters))),
+    ComputationJob.COMPARE: Kind('report', True,
+                                 lambda report, parameters: comparison.compare_strategies(report, *parse_year_range(parameters))),
+    ComputationJob.EXPORT: Kind('report', False,
+                                lambda report, parameters: list(exporters.export_rows(report, parse_year(parameters)))),
+    ComputationJob.PORTFOLIO: Kind('portfolio', True,
+                                   lambda portfolio, parameters: portfolios.portfolio_emissions(portfolio, *parse_year_range(parameters))),
+    ComputationJob.UNCERTAINTY: Kind('report', True,
+                                     lambda report, parameters: uncertainty.report_uncertainty(report, *parse_monte_carlo(parameters)),
+                                     parse_monte_carlo),
+}
+
+
+def check_parameters(kind: str, parameters: dict):
+    """
+    Raise a ValidationError if the parameters cannot be used by this kind of job
+    """
+    if KINDS[kind].year_range:
+        parse_year_range(parameters)
+    if KINDS[kind].check is not None:
+        KINDS[kind].check(parameters)
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_next(worker: str) -> ComputationJob | None:
+    """
+    The oldest pending job, now running for `worker`. None when the queue is empty
+    """
+    queue = ComputationJob.objects.filter(status=ComputationJob.PENDING).order_by('id').values_list('pk', flat=True)
+    # Without row locks (SQLite), the conditional update alone decides which worker gets the job:
+    # a transaction reading then writing would deadlock the workers
+    locking = connection.features.has_select_for_update_skip_locked
+    while True:
+        with transaction.atomic() if locking else nullcontext():
+            job_id = (queue.select_for_update(skip_locked=True) if locking else queue).first()
+            if job_id is None:
+                return None
+            now = timezone.now()
+            claimed = (ComputationJob.objects.filter(pk=job_id, status=ComputationJob.PENDING)
+                       .update(status=ComputationJob.RUNNING, worker=worker, started_at=now, heartbeat_at=now))
+        if claimed:
+            return ComputationJob.objects.get(pk=job_id)
+
+
+def running(job: ComputationJob):
+    """
+    The job, while it is still running for its worker
+    """
+    return ComputationJob.objects.filter(pk=job.pk, worker=job.worker, status=ComputationJob.RUNNING)
+
+
+@contextmanager
+def heartbeat(job: ComputationJob, interval: float | None = None):
+    """
+    Refresh the heartbeat_at of the running job every `interval` seconds, from a thread, until the block ends
+    """
+    if interval is None:
+        interval = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', DEFAULT_HEARTBEAT_INTERVAL)
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    running(job).update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    logger.warning('Job %s: heartbeat not stored', job.pk, exc_info=True)
+        finally:
+            connection.close() # the connection of this thread
+
+    thread = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job: ComputationJob) -> bool:
+    """
+    Run the job and store its result, or its error. False if not stored: the job was
+    queued again meanwhile, or the database could not be written (the job is then
+    queued again after JOB_TIMEOUT)
+    """
+    start = time.perf_counter()
+    with heartbeat(job):
+        try:
+            kind = KINDS[job.kind]
+            result = kind.run(getattr(job, kind.target), job.parameters)
+        except Exception as exc:
+            logger.exception('Job %s (%s) failed', job.pk, job.kind)
+            fields = {'status': ComputationJob.FAILED, 'result': None,
+                      'error': ''.join(traceback.format_exception_only(exc)).strip()}
+        else:
+            logger.info('Job %s (%s) done in %.1f s', job.pk, job.kind, time.perf_counter() - start)
+            fields = {'status': ComputationJob.DONE, 'result': result, 'error': ''}
+    try:
+        finished = running(job).update(finished_at=timezone.now(), **fields)
+    except DatabaseError:
+        logger.exception('Job %s (%s): result not stored', job.pk, job.kind)
+        return False
+    if not finished:
+        logger.warning('Job %s (%s) was queued again while running, its result is dropped', job.pk, job.kind)
+    return bool(finished)
+
+
+def requeue_stale(timeout: float | None = None) -> int:
+    """
+    Queue again the running jobs without heartbeat for more than `timeout` seconds (their worker died)
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'JOB_TIMEOUT', DEFAULT_JOB_TIMEOUT)
+    limit = timezone.now() - timedelta(seconds=timeout)
+    stale = Q(heartbeat_at__lt=limit) | Q(heartbeat_at__isnull=True, started_at__lt=limit)
+    return (ComputationJob.objects.filter(stale, status=ComputationJob.RUNNING)
+            .update(status=ComputationJob.PENDING, worker='', started_at=None, heartbeat_at=None))
+
+
+def work(stop=None, poll_interval: float = DEFAULT_POLL_INTERVAL, once: bool = False) -> int:
+    """
+    Run the queued jobs until `stop` (an Event) is set, or until the queue is
+    empty with `once`. Returns the number of jobs run
+    """
+    worker = worker_name()
+    count = 0
+    while stop is None or not stop.is_set():
+        try:
+            job = claim_next(worker)
+            if job is None and not once:
+                requeue_stale()
+        except DatabaseError:
+            # e.g. a database locked by a long write, read again after the poll interval
+            logger.exception('Worker %s could not read the queue', worker)
+        else:
+            if job is not None:
+                run_job(job)
+                count += 1
+                continue
+            if once:
+                break
+        if stop is None:
+            time.sleep(poll_interval)
+        else:
+            stop.wait(poll_interval)
+    return count
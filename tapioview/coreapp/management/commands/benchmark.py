@@ -0,0 +1,45 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from coreapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Time the emission computations and the serializers on generated reports, the reports are rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=benchmarks.DEFAULT_SIZES, help='Numbers of sources')
+        parser.add_argument('--strategies', type=int, default=2, help='Number of strategies of the reports')
+        parser.add_argument('--modifications', type=int, default=1, help='Number of modifications per source in each strategy')
+        parser.add_argument('--repeat', type=int, default=benchmarks.DEFAULT_REPEAT, help='Number of runs of each benchmark')
+        parser.add_argument('--year', type=int, default=benchmarks.DEFAULT_YEAR, help='Year of the computations')
+        parser.add_argument('--output', default='benchmark.json', help='JSON file receiving the results')
+        parser.add_argument('--startup', action='store_true',
+                            help='Time the startup of new processes (manage.py check, WSGI and ASGI imports) instead')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1 or any(size < 1 for size in options['sizes']):
+            raise CommandError('--repeat and --sizes must be positive.')
+
+        if options['startup']:
+            report = benchmarks.run_startup_suite(repeat=options['repeat'], progress=self.stdout.write)
+            for result in report['results']:
+                self.stdout.write(f'{result["settings"]:<32} {result["name"]:<28} {result["median"] * 1000:10.2f} ms')
+            self.write(report, options['output'])
+            return
+
+        report = benchmarks.run_suite(sizes=options['sizes'],
+                                      strategies=options['strategies'],
+                                      modifications=options['modifications'],
+                                      repeat=options['repeat'],
+                                      year=options['year'],
+                                      progress=self.stdout.write)
+        for result in report['results']:
+            memory = f' {result["peak_bytes"] / 2**20:10.1f} MB' if 'peak_bytes' in result else ''
+            self.stdout.write(f'{result["size"]:>8} {result["name"]:<40} {result["median"] * 1000:10.2f} ms{memory}')
+
+        self.write(report, options['output'])
+
+    def write(self, report: dict, path: str):
+        with open(path, 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results written to {path}'))
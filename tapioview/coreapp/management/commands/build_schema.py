@@ -0,0 +1,31 @@
+import os
+import tempfile
+from pathlib import Path
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from coreapp import schema
+
+
+class Command(BaseCommand):
+    help = 'Build the OpenAPI schema served by /api/schema/ (settings.OPENAPI_SCHEMA_FILE)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', help='Output file, settings.OPENAPI_SCHEMA_FILE by default')
+
+    def handle(self, *args, **options):
+        path = Path(options['file']) if options['file'] else schema.schema_file()
+        if path is None:
+            raise CommandError('settings.OPENAPI_SCHEMA_FILE is not set, use --file.')
+
+        # Written next to the file then renamed: the running processes never read a partial schema
+        path.parent.mkdir(parents=True, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        os.close(handle)
+        try:
+            call_command('spectacular', format='openapi-json', file=temporary, fail_on_warn=False, stdout=self.stdout, stderr=self.stderr)
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        self.stdout.write(self.style.SUCCESS(f'Schema written to {path}'))
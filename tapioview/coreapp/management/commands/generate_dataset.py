@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from coreapp import datasets
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic report with its sources, strategies and modifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sources', type=int, default=1000, help='Number of sources of the report')
+        parser.add_argument('--strategies', type=int, default=3, help='Number of strategies of the report')
+        parser.add_argument('--modifications', type=int, default=1, help='Number of modifications per source in each strategy')
+        parser.add_argument('--reports', type=int, default=1, help='Number of reports to generate')
+        parser.add_argument('--name', help='Name of the report')
+        parser.add_argument('--seed', type=int, default=datasets.DEFAULT_SEED, help='Seed of the random generator')
+        parser.add_argument('--batch-size', type=int, default=datasets.DEFAULT_BATCH_SIZE, help='Number of rows inserted per query')
+
+    def handle(self, *args, **options):
+        for option in ['sources', 'strategies', 'modifications', 'reports']:
+            if options[option] < 0:
+                raise CommandError(f'--{option} cannot be negative.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        for index in range(options['reports']):
+            report = datasets.generate_report(sources=options['sources'],
+                                              strategies=options['strategies'],
+                                              modifications=options['modifications'],
+                                              name=options['name'],
+                                              seed=options['seed'] + index,
+                                              batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Report {report.pk} generated'))
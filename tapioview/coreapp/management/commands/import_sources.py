@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from coreapp import importers
+from coreapp.models import Report, ReductionStrategy
+
+
+class Command(BaseCommand):
+    help = 'Import the sources of a CSV (with a header line) or NDJSON file into a report or a strategy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--report', type=int, help='Id of the report receiving the sources')
+        target.add_argument('--strategy', type=int, help='Id of the strategy receiving the sources')
+        parser.add_argument('--type', choices=importers.FORMATS, help='Format of the file, guessed from its extension if missing')
+        parser.add_argument('--batch-size', type=int, default=importers.DEFAULT_BATCH_SIZE, help='Number of sources inserted per query')
+
+    def handle(self, *args, **options):
+        report = strategy = None
+        try:
+            if options['report'] is not None:
+                report = Report.objects.get(pk=options['report'])
+            else:
+                strategy = ReductionStrategy.objects.get(pk=options['strategy'])
+        except (Report.DoesNotExist, ReductionStrategy.DoesNotExist):
+            raise CommandError('Unknown report or strategy.')
+
+        file_format = options['type'] or importers.guess_format(None, options['path'])
+        if file_format is None:
+            raise CommandError('Unknown format, use --type.')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        with open(options['path'], 'rb') as stream:
+            result = importers.import_sources(stream, file_format, report=report, strategy=strategy,
+                                              batch_size=options['batch_size'])
+
+        for error in result.errors:
+            self.stderr.write(f'Line {error["line"]}: {error["errors"]}')
+        if result.error_count > len(result.errors):
+            self.stderr.write(f'... {result.error_count - len(result.errors)} more errors')
+        self.stdout.write(self.style.SUCCESS(f'{result.created} sources imported, {result.error_count} rows rejected'))
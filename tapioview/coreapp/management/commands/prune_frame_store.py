@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+from coreapp import columnstore
+
+
+class Command(BaseCommand):
+    help = 'Remove the outdated report columns of the on-disk cache (settings.FRAME_STORE_DIR)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=float, default=None,
+                            help='Seconds after which a revision is removed (settings.FRAME_STORE_MAX_AGE by default)')
+
+    def handle(self, *args, **options):
+        if columnstore.store_dir() is None:
+            raise CommandError('settings.FRAME_STORE_DIR is not set.')
+        removed = columnstore.prune(options['max_age'])
+        self.stdout.write(self.style.SUCCESS(f'{removed} revisions removed'))
@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+import signal
+import threading
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from coreapp import jobs
+
+
+def run_worker(stop, poll_interval: float, once: bool):
+    """
+    Entry point of a worker process
+    """
+    # Interrupted by the parent, after its current job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup() # the process may be spawned rather than forked
+    connections.close_all()
+    jobs.work(stop, poll_interval, once)
+
+
+class Command(BaseCommand):
+    help = 'Run the queued computation jobs in worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes, 1 to run the jobs in this process')
+        parser.add_argument('--poll-interval', type=float, default=jobs.DEFAULT_POLL_INTERVAL,
+                            help='Seconds between two reads of an empty queue')
+        parser.add_argument('--once', action='store_true', help='Stop when the queue is empty')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive.')
+        if options['poll_interval'] <= 0:
+            raise CommandError('--poll-interval must be positive.')
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f'{requeued} stale jobs queued again')
+
+        # Set by SIGINT and SIGTERM: the workers stop after their current job
+        interrupted = threading.Event()
+        handlers = {signum: signal.signal(signum, lambda *args: interrupted.set()) for signum in [signal.SIGINT, signal.SIGTERM]}
+        try:
+            self.run(interrupted, options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def run(self, interrupted, options):
+        if options['workers'] == 1:
+            count = jobs.work(interrupted, options['poll_interval'], options['once'])
+            self.stdout.write(self.style.SUCCESS(f'{count} jobs run'))
+            return
+
+        # Not set by the signal handler itself: a multiprocessing Event cannot be set while this process waits on it
+        stop = multiprocessing.Event()
+        # The connections are not shared with the worker processes
+        connections.close_all()
+        processes = [self.start_worker(stop, options) for _ in range(options['workers'])]
+        self.stdout.write(f'{len(processes)} workers started')
+        while any(process.is_alive() for process in processes):
+            interrupted.wait(options['poll_interval'])
+            if interrupted.is_set():
+                stop.set()
+            if options['once'] or stop.is_set():
+                continue
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    self.stderr.write(f'Worker {process.pid} exited with code {process.exitcode}, restarted')
+                    processes[i] = self.start_worker(stop, options)
+
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS('Workers stopped'))
+
+    def start_worker(self, stop, options) -> multiprocessing.Process:
+        # Not a daemon: a worker can start the process pool of coreapp.portfolios
+        process = multiprocessing.Process(target=run_worker, args=(stop, options['poll_interval'], options['once']))
+        process.start()
+        return process
@@ -0,0 +1,313 @@
+"""
+Metrics in the Prometheus text format, served by /metrics to the staff users and
+to the bearer of settings.METRICS_TOKEN (the Prometheus scraper).
+
+Each process counts in memory: request latency and response size histograms per
+viewset and action (MetricsMiddleware), emission computations and computation
+cache hits (coreapp.caching). The response sizes are the sizes sent, compressed
+by coreapp.compression when the client accepts it. With several worker processes,
+set settings.METRICS_DIR: every process then publishes its counts to its own file
+of this directory (at most once per FLUSH_INTERVAL seconds, written to a temporary
+file then renamed), and /metrics adds up the files of all the processes. A file is
+named after the host, the PID and the start of its process: a new process reusing
+the PID of an exited one does not overwrite its counts. So that the totals never
+decrease without the directory growing with every restart of a worker, /metrics
+folds the files of the exited processes of its host into EXITED_FILE (under a
+lock of the directory, the names of the folded files recorded so that a file is
+never counted twice). The directory is emptied when the service is restarted.
+"""
+import hmac
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+try:
+    import fcntl
+except ImportError: # Windows: the files of the exited processes are kept
+    fcntl = None
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+REQUEST_DURATION = 'tapioview_request_duration_seconds'
+RESPONSE_SIZE = 'tapioview_response_size_bytes'
+COMPUTATIONS = 'tapioview_emission_computations_total'
+CACHE_REQUESTS = 'tapioview_computation_cache_requests_total'
+FRAME_STORE_REQUESTS = 'tapioview_frame_store_requests_total'
+
+# name: (type, help, buckets)
+METRICS = {
+    REQUEST_DURATION: ('histogram', 'Duration of the requests per viewset and action.', LATENCY_BUCKETS),
+    RESPONSE_SIZE: ('histogram', 'Size of the responses sent (compressed or not) per viewset and action.', SIZE_BUCKETS),
+    COMPUTATIONS: ('counter', 'Emission computations per method.', None),
+    CACHE_REQUESTS: ('counter', 'Computation cache lookups per result (hit or miss).', None),
+    FRAME_STORE_REQUESTS: ('counter', 'Reads of the on-disk report columns per result (hit or miss).', None),
+}
+
+FLUSH_INTERVAL = 1.0
+FILE_PREFIX = 'metrics_'
+EXITED_FILE = f'{FILE_PREFIX}exited.json'
+LOCK_FILE = '.metrics.lock'
+
+
+class Registry:
+    """
+    Counters and histograms of this process, keyed by (name, sorted labels)
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0.0
+        self.pid = None
+        self.started = 0
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # one count per bucket, then +Inf, then the sum
+                histogram = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[len(buckets)] += 1
+            histogram[-1] += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                    'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()]}
+
+    def file_name(self) -> str:
+        """
+        File of this process in METRICS_DIR, named after its host, its PID and its start
+        """
+        pid = os.getpid()
+        if self.pid != pid:
+            self.pid, self.started = pid, time.time_ns()
+        return f'{FILE_PREFIX}{socket.gethostname()}_{pid}_{self.started}.json'
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+def metrics_dir() -> Path | None:
+    path = getattr(settings, 'METRICS_DIR', None)
+    return Path(path) if path else None
+
+
+def flush(force: bool = False):
+    """
+    Publish the counts of this process to its file of METRICS_DIR
+    """
+    directory = metrics_dir()
+    now = time.monotonic()
+    if directory is None or (not force and now - registry.flushed_at < FLUSH_INTERVAL):
+        return
+    registry.flushed_at = now
+    directory.mkdir(parents=True, exist_ok=True)
+    _write(directory / registry.file_name(), registry.snapshot())
+
+
+def _write(path: Path, snapshot: dict):
+    handle, temporary = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    with os.fdopen(handle, 'w') as output:
+        json.dump(snapshot, output)
+    os.replace(temporary, path)
+
+
+def _read(path: Path) -> dict | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None # removed or being replaced
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # another user
+    return True
+
+
+def exited_files(directory: Path) -> list[Path]:
+    """
+    Files of the exited processes of this host: PID not running, or reused by a process started later
+    """
+    host = socket.gethostname()
+    latest = {}
+    for path in directory.glob(f'{FILE_PREFIX}*.json'):
+        parts = path.stem[len(FILE_PREFIX):].rsplit('_', 2)
+        if len(parts) != 3 or parts[0] != host or not (parts[1].isdigit() and parts[2].isdigit()) or int(parts[1]) <= 0:
+            continue
+        latest.setdefault(int(parts[1]), []).append((int(parts[2]), path))
+    exited = []
+    for pid, files in latest.items():
+        files.sort()
+        exited.extend(path for _, path in (files if not _alive(pid) else files[:-1]))
+    return exited
+
+
+def fold_exited(directory: Path):
+    """
+    Add up the files of the exited processes into EXITED_FILE, then remove them
+    """
+    if fcntl is None or not directory.is_dir():
+        return
+    with open(directory / LOCK_FILE, 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return # folded by another process
+        exited = exited_files(directory)
+        if not exited:
+            return
+        path = directory / EXITED_FILE
+        total = _read(path) or {'counters': [], 'histograms': [], 'folded': []}
+        # A file folded but not removed yet (interrupted) is not added again
+        snapshots = [total] + [snapshot for file in exited if file.name not in total['folded'] and (snapshot := _read(file))]
+        present = {file.name for file in exited}
+        _write(path, {**to_snapshot(merge(snapshots)), 'folded': sorted(present)})
+        for file in exited:
+            file.unlink(missing_ok=True)
+
+
+def collect() -> dict:
+    """
+    Counts of all the processes: {(name, labels): value or histogram values}
+    """
+    directory = metrics_dir()
+    if directory is None:
+        return merge([registry.snapshot()])
+    flush(force=True)
+    fold_exited(directory)
+    snapshots = {path.name: _read(path) for path in directory.glob(f'{FILE_PREFIX}*.json')}
+    snapshots = {name: snapshot for name, snapshot in snapshots.items() if snapshot is not None}
+    # The files already folded into EXITED_FILE, if their removal was interrupted
+    folded = set(snapshots.get(EXITED_FILE, {}).get('folded', []))
+    return merge(snapshot for name, snapshot in snapshots.items() if name not in folded)
+
+
+def merge(snapshots) -> dict:
+    """
+    {(name, labels): value or histogram values} of the snapshots added up
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            merged[key] = merged.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            current = merged.setdefault(key, [0] * len(values))
+            merged[key] = [a + b for a, b in zip(current, values)]
+    return merged
+
+
+def to_snapshot(merged: dict) -> dict:
+    return {'counters': [[name, list(labels), value] for (name, labels), value in merged.items() if not isinstance(value, list)],
+            'histograms': [[name, list(labels), value] for (name, labels), value in merged.items() if isinstance(value, list)]}
+
+
+def _labels(labels, **extra) -> str:
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+
+def render(merged: dict) -> str:
+    lines = []
+    for name, (metric_type, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for (metric, labels), value in sorted(merged.items()):
+            if metric != name:
+                continue
+            if metric_type == 'counter':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            cumulative += value[len(buckets)]
+            lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def authorized(request) -> bool:
+    """
+    A staff user, or the bearer of settings.METRICS_TOKEN
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return request.user.is_active and request.user.is_staff
+
+
+def metrics_view(request):
+    if not authorized(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render(collect()), content_type=CONTENT_TYPE)
+
+
+def route_labels(request) -> dict:
+    """
+    viewset and action of the request (the view name outside of the viewsets)
+    """
+    match = request.resolver_match
+    if match is None:
+        return {'viewset': '', 'action': ''}
+    view = getattr(match.func, 'cls', None) or match.func
+    actions = getattr(match.func, 'actions', None) or {}
+    return {'viewset': getattr(view, '__name__', type(view).__name__),
+            'action': actions.get(request.method.lower(), request.method.lower())}
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        labels = route_labels(request)
+        registry.observe(REQUEST_DURATION, duration, **labels)
+        if not response.streaming:
+            registry.observe(RESPONSE_SIZE, len(response.content), **labels)
+        flush()
+        return response
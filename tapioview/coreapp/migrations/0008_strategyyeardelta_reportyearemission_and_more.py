@@ -0,0 +1,46 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0007_rename_value_ratio_reductionmodification_value_modification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StrategyYearDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('delta_total_emission', models.FloatField()),
+                ('strategy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='yearDeltas', to='coreapp.reductionstrategy')),
+            ],
+            options={
+                'ordering': ['strategy', 'year'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportYearEmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('total_emission', models.FloatField()),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='yearEmissions', to='coreapp.report')),
+            ],
+            options={
+                'ordering': ['report', 'year'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='strategyyeardelta',
+            constraint=models.UniqueConstraint(fields=('strategy', 'year'), name='unique_strategy_year'),
+        ),
+        migrations.AddConstraint(
+            model_name='reportyearemission',
+            constraint=models.UniqueConstraint(fields=('report', 'year'), name='unique_report_year'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.1 on 2026-10-18 10:38
+
+import coreapp.caching
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0008_strategyyeardelta_reportyearemission_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='revision',
+            field=models.BigIntegerField(default=coreapp.caching.new_revision, editable=False),
+        ),
+    ]
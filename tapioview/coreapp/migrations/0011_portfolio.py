@@ -0,0 +1,24 @@
+# Generated by Django 4.2.1 on 2026-10-18 11:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0010_report_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Portfolio',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200)),
+                ('reports', models.ManyToManyField(blank=True, related_name='portfolios', to='coreapp.report')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
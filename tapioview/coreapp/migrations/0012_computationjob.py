@@ -0,0 +1,35 @@
+# Generated by Django 4.2.1 on 2026-10-18 11:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0011_portfolio'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComputationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('report', 'Report with its computed totals'), ('timeseries', 'Report emission per year'), ('compare', 'Comparison of the strategies'), ('export', 'Export of the report'), ('portfolio', 'Portfolio emissions')], max_length=20)),
+                ('parameters', models.JSONField(blank=True, default=dict)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('result', models.JSONField(blank=True, editable=False, null=True)),
+                ('error', models.TextField(blank=True, default='', editable=False)),
+                ('worker', models.CharField(blank=True, default='', editable=False, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('portfolio', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='coreapp.portfolio')),
+                ('report', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='coreapp.report')),
+            ],
+            options={
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['status', 'id'], name='job_queue')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.1 on 2026-10-18 11:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0012_computationjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportyearemission',
+            name='frozen',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='strategyyeardelta',
+            name='frozen',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='ReportSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('total_emission', models.FloatField()),
+                ('source_ids', models.BinaryField()),
+                ('source_values', models.BinaryField()),
+                ('strategy_deltas', models.JSONField(default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='coreapp.report')),
+            ],
+            options={
+                'ordering': ['report', 'year'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='reportsnapshot',
+            constraint=models.UniqueConstraint(fields=('report', 'year'), name='unique_report_snapshot'),
+        ),
+    ]
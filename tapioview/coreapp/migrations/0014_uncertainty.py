@@ -0,0 +1,46 @@
+# Generated by Django 4.2.1 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0013_reportsnapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reductionmodification',
+            name='emission_factor_change_distribution',
+            field=models.CharField(blank=True, choices=[('normal', 'Normal'), ('lognormal', 'Lognormal'), ('uniform', 'Uniform'), ('triangular', 'Triangular')], default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='reductionmodification',
+            name='emission_factor_change_uncertainty',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='emission_factor_distribution',
+            field=models.CharField(blank=True, choices=[('normal', 'Normal'), ('lognormal', 'Lognormal'), ('uniform', 'Uniform'), ('triangular', 'Triangular')], default='', max_length=12),
+        ),
+        migrations.AddField(
+            model_name='source',
+            name='emission_factor_uncertainty',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='computationjob',
+            name='kind',
+            field=models.CharField(choices=[('report', 'Report with its computed totals'), ('timeseries', 'Report emission per year'), ('compare', 'Comparison of the strategies'), ('export', 'Export of the report'), ('portfolio', 'Portfolio emissions'), ('uncertainty', 'Monte Carlo percentiles')], max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='reductionmodification',
+            constraint=models.CheckConstraint(check=models.Q(('emission_factor_change_distribution', ''), ('emission_factor_change_uncertainty__gte', 0), _connector='OR'), name='modification_distribution_needs_uncertainty'),
+        ),
+        migrations.AddConstraint(
+            model_name='source',
+            constraint=models.CheckConstraint(check=models.Q(('emission_factor_distribution', ''), ('emission_factor_uncertainty__gte', 0), _connector='OR'), name='source_distribution_needs_uncertainty'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.1 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coreapp', '0014_uncertainty'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='computationjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,25 +1,140 @@
+import numpy as np
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, F, FilteredRelation, FloatField, OuterRef, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, FirstValue, Greatest, RowNumber
 from django.db.models.constraints import CheckConstraint
 from django.core.exceptions import ValidationError
+from coreapp import engine
+from coreapp.caching import cached_computation, new_revision
+from coreapp.timeline import ModificationTimeline
+
+
+# Distributions of an uncertain emission factor, around its value and spread by its relative
+# uncertainty u (see coreapp.uncertainty): normal (standard deviation u), lognormal (standard
+# deviation u of the log, same mean), uniform and triangular (from -u to +u)
+NORMAL = 'normal'
+LOGNORMAL = 'lognormal'
+UNIFORM = 'uniform'
+TRIANGULAR = 'triangular'
+DISTRIBUTIONS = [(NORMAL, 'Normal'), (LOGNORMAL, 'Lognormal'), (UNIFORM, 'Uniform'), (TRIANGULAR, 'Triangular')]
+
+
+def year_emission_expression(year: int) -> Case:
+    """
+    Source.year_emission as a SQL expression
+    """
+    return Case(
+        When(acquisition_year__gt=year, then=Value(0.0)), # source doesn't exist at this time
+        When(Q(lifetime__gt=0) & Q(acquisition_year__lt=Value(year) - F('lifetime')), then=Value(0.0)), # already amortized
+        When(lifetime__gt=0, then=F('value') * F('emission_factor') / F('lifetime')),
+        default=F('value') * F('emission_factor'),
+        output_field=FloatField()
+    )
+
+
+def _is_set(name: str) -> Q:
+    """
+    SQL version of `if value:` for a nullable number
+    """
+    return Q(**{f'{name}__gt': 0}) | Q(**{f'{name}__lt': 0})
+
+
+def year_delta_expression(year: int) -> Case:
+    """
+    Source.year_delta_emission as a SQL expression of the window annotations
+    of SourceQuerySet.with_year_delta
+    """
+    # Once the first modification is amortized, only its emission factor is kept
+    broken = Q(lifetime__gt=0) & Q(first_start_year__lt=Value(year) - F('lifetime'))
+    value = Case(
+        When(Q(lifetime__gt=0) & Q(acquisition_year__lt=Value(year) - F('lifetime')), then=Value(0.0)), # already amortized
+        default=F('value'),
+        output_field=FloatField()
+    )
+    value_change = Case(
+        When(broken, then=Value(0.0)),
+        default=Coalesce(F('cumulative_value'), Value(0.0)),
+        output_field=FloatField()
+    )
+    emission_factor = Case(
+        When(broken & _is_set('first_emission_factor'), then=F('first_emission_factor')),
+        When(broken, then=F('emission_factor')),
+        When(_is_set('last_emission_factor'), then=F('last_emission_factor')),
+        default=F('emission_factor'),
+        output_field=FloatField()
+    )
+    divisor = Case(When(lifetime__gt=0, then=F('lifetime')), default=Value(1))
+    emission_modified = Greatest(emission_factor * (value + value_change), Value(0.0)) / divisor
+    return Case(
+        When(acquisition_year__gt=year, then=Value(0.0)), # source doesn't exist at this time
+        default=year_emission_expression(year) - emission_modified,
+        output_field=FloatField()
+    )
+
+
+class ReportQuerySet(models.QuerySet):
+
+    def with_year_emission(self, year: int) -> 'ReportQuerySet':
+        """
+        Annotate each report with its total emission of `year` (`computed_year_emission`),
+        computed by the database in the same query
+        """
+        totals = (Source.objects.filter(report=OuterRef('pk'))
+                  .with_year_emission(year)
+                  .values('report')
+                  .annotate(total=Sum('year_emission_value'))
+                  .values('total'))
+        return self.annotate(computed_year=Value(year),
+                             computed_year_emission=Coalesce(Subquery(totals), Value(0.0), output_field=FloatField()))
+
 
 class Report(models.Model):
     """
     The Report is the sum of all the emissions. It should be done once a year
     """
     name = models.CharField(max_length=200)
+    revision = models.BigIntegerField(default=new_revision, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ReportQuerySet.as_manager()
 
     def __str__(self):
         return self.name
     
+    @cached_computation('pk')
     def year_emission(self, year: int) -> float:
+        if 'sources' not in getattr(self, '_prefetched_objects_cache', {}):
+            # Summed by the database, without loading the sources
+            return self.sources.all().total_year_emission(year)
         sources_sum = sum(source.year_emission(year) 
                           for source in self.sources.all())
         return sources_sum
+
+    @cached_computation('pk')
+    def range_emission(self, start_year: int, end_year: int) -> list[float]:
+        """
+        Same as year_emission for every year from start_year to end_year (included),
+        the sources are loaded once and all the years are computed in one pass
+        """
+        columns = engine.SourceColumns.from_queryset(self.sources.all())
+        return columns.years_emission(engine.year_range(start_year, end_year)).tolist()
     
     class Meta:
         ordering = ['id']
 
+class Portfolio(models.Model):
+    """
+    A Portfolio is a named set of reports, e.g. the companies of a group
+    """
+    name = models.CharField(max_length=200)
+    reports = models.ManyToManyField(Report, related_name='portfolios', blank=True)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['id']
+
 class ReductionStrategy(models.Model):
     """
     A ReductionStrategy is the set of all reduction modifications imagined for a given report
@@ -30,26 +145,114 @@ class ReductionStrategy(models.Model):
     def __str__(self):
         return  f'Report {self.report.id}: {self.name}'
     
+    @cached_computation('report_id')
     def year_delta_emission(self, year: int) -> float:
         """
         Delta = (Total GCG without strategy) - (Total GCG with strategy)
         Positive value -> diminution of GHG generation
         """
-        # sum of the modifications
-        total_delta = sum(source.year_delta_emission(year) 
-                          for source in self.report.sources.all())
+        if 'modifications' in getattr(self, '_prefetched_objects_cache', {}):
+            return self.range_delta_emission(year, year)[0]
+        # Computed by the database, without loading the sources and the modifications
+        total_delta = Source.objects.filter(report_id=self.report_id).total_year_delta(self.pk, year)
+        return total_delta - self.sourcesStrategy.all().total_year_emission(year)
 
-        # sum of the new sources
-        total_new_sources = sum(source.year_emission(year) 
-                                for source in self.sourcesStrategy.all())
-        
-        return total_delta - total_new_sources
+    @cached_computation('report_id')
+    def range_delta_emission(self, start_year: int, end_year: int) -> list[float]:
+        """
+        Same as year_delta_emission for every year from start_year to end_year (included),
+        the modifications index and the sources are loaded once
+        """
+        timeline = self.modification_timeline()
+        sources = list(self.report.sources.all())
+        new_sources = list(self.sourcesStrategy.all())
+
+        deltas = []
+        for year in range(start_year, end_year + 1):
+            # sum of the modifications
+            total_delta = sum(timeline.source_delta(source, year) 
+                              for source in sources)
+
+            # sum of the new sources
+            total_new_sources = sum(source.year_emission(year) 
+                                    for source in new_sources)
+            deltas.append(total_delta - total_new_sources)
+        return deltas
+
+    def modification_timeline(self) -> ModificationTimeline:
+        """
+        Index of the modifications of this strategy, loaded with one query
+        (or read from the prefetched modifications)
+        """
+        return ModificationTimeline(self.modifications.all())
     
     class Meta:
         ordering = ['id']
         
 
 
+class SourceQuerySet(models.QuerySet):
+
+    def with_year_emission(self, year: int) -> 'SourceQuerySet':
+        """
+        Annotate each source with its emission of `year` (`year_emission_value`)
+        """
+        return self.annotate(year_emission_value=year_emission_expression(year))
+
+    def total_year_emission(self, year: int) -> float:
+        """
+        Sum of the emissions of `year`, in one query
+        """
+        return self.aggregate(total=Coalesce(Sum(year_emission_expression(year)), Value(0.0)))['total']
+
+    def report_year_emissions(self, year: int) -> dict[int, float]:
+        """
+        {report id: total emission of `year`} of the reports of these sources, in one query
+        """
+        rows = (self.filter(report__isnull=False)
+                .values('report')
+                .annotate(total=Sum(year_emission_expression(year)))
+                .values_list('report', 'total'))
+        return dict(rows)
+
+    def with_year_delta(self, strategy_id: int, year: int) -> 'SourceQuerySet':
+        """
+        Annotate each source with Source.year_delta_emission(year, strategy) (`year_delta_value`).
+        The modifications of the strategy started in `year` are joined to their source, and
+        window functions partitioned by source give the running sum of the value changes,
+        the last emission factor set and the first modification; one row per source is kept.
+        """
+        modifications = Q(sourceModifications__strategy_id=strategy_id,
+                          sourceModifications__modification_start_year__lte=year)
+        source = [F('id')]
+        first = [F('strategy_modifications__modification_start_year').asc(),
+                 F('strategy_modifications__order').asc(),
+                 F('strategy_modifications__id').asc()]
+        # Modifications with an emission factor first, then the last one
+        last_emission_factor = [Case(When(_is_set('strategy_modifications__emission_factor_change'), then=Value(1)),
+                                     default=Value(0)).desc(),
+                                F('strategy_modifications__modification_start_year').desc(),
+                                F('strategy_modifications__order').desc(),
+                                F('strategy_modifications__id').desc()]
+        return (self.annotate(strategy_modifications=FilteredRelation('sourceModifications', condition=modifications))
+                .annotate(cumulative_value=Window(Sum('strategy_modifications__value_modification'), partition_by=source),
+                          first_start_year=Window(FirstValue('strategy_modifications__modification_start_year'),
+                                                  partition_by=source, order_by=first),
+                          first_emission_factor=Window(FirstValue('strategy_modifications__emission_factor_change'),
+                                                       partition_by=source, order_by=first),
+                          last_emission_factor=Window(FirstValue('strategy_modifications__emission_factor_change'),
+                                                      partition_by=source, order_by=last_emission_factor),
+                          modification_rank=Window(RowNumber(), partition_by=source, order_by=first))
+                .filter(modification_rank=1))
+
+    def total_year_delta(self, strategy_id: int, year: int) -> float:
+        """
+        Sum of Source.year_delta_emission(year, strategy), in one query
+        """
+        return self.with_year_delta(strategy_id, year).aggregate(
+            total=Coalesce(Sum(year_delta_expression(year)), Value(0.0)))['total']
+
+
 class Source(models.Model):
     """
     An Emission is every source that generates GreenHouse gases (GHG).
@@ -62,6 +265,10 @@ class Source(models.Model):
     emission_factor = models.FloatField()
     lifetime = models.PositiveIntegerField(blank=True, null=True)
     acquisition_year = models.PositiveSmallIntegerField(blank=True,null=True)
+    emission_factor_distribution = models.CharField(max_length=12, choices=DISTRIBUTIONS, blank=True, default='')
+    emission_factor_uncertainty = models.FloatField(blank=True, null=True)
+
+    objects = SourceQuerySet.as_manager()
 
     def total_emission(self) -> float:
         """
@@ -81,39 +288,20 @@ class Source(models.Model):
         
         return emission
     
-    def year_delta_emission(self, year: int) -> float:
+    def year_delta_emission(self, year: int, strategy: 'ReductionStrategy|None' = None) -> float:
         """
         Rules to calculate the delta:
         * the value changes are added together if it is during the lifetime of the change 
         * the emission factor = the last emission factor set
         * Positive value when modifications reduce emissions
         * Cannot have a positive value if the initial source is already amortized (it makes no sense to "improve" something that is already zero)
+        Only the modifications of `strategy` are applied when it is given.
         """
-        if self.acquisition_year and self.acquisition_year > year : 
-            return 0 # source doesn't exist at this time
-        
-        cumul_value = self.value
-        if self.lifetime and self.acquisition_year + self.lifetime < year:
-            cumul_value = 0 # already amortized
-        cumul_emission_factor = self.emission_factor
-        
-        for emission in self.sourceModifications.filter(modification_start_year__lte=year).order_by('order'):
-            if emission.emission_factor_change:
-                cumul_emission_factor = emission.emission_factor_change
-            
-            if self.lifetime and emission.modification_start_year + self.lifetime < year:
-                break # already amortized         
-            if emission.value_modification:
-                cumul_value += emission.value_modification
-
-
-        total_emission = self.year_emission(year)
-
-        emission_modified = max(cumul_emission_factor * cumul_value,0)
-        if self.lifetime:
-            emission_modified = emission_modified / self.lifetime
-        
-        return total_emission - emission_modified
+        if strategy:
+            timeline = strategy.modification_timeline()
+        else:
+            timeline = ModificationTimeline(self.sourceModifications.all())
+        return timeline.source_delta(self, year)
 
     
     def __str__(self):
@@ -129,6 +317,10 @@ class Source(models.Model):
             CheckConstraint(
                 check=Q(lifetime__isnull=True) | Q(acquisition_year__isnull=False),
                 name='if_lifetime_not_empty_acquisition_year_not_empty'
+            ),
+            CheckConstraint(
+                check=Q(emission_factor_distribution='') | Q(emission_factor_uncertainty__gte=0),
+                name='source_distribution_needs_uncertainty'
             )
         ]
     
@@ -145,6 +337,8 @@ class ReductionModification(models.Model):
     description = models.CharField(max_length=250, blank=True, null=True)
     value_modification = models.FloatField(blank=True, null=True)
     emission_factor_change = models.FloatField(blank=True, null=True)
+    emission_factor_change_distribution = models.CharField(max_length=12, choices=DISTRIBUTIONS, blank=True, default='')
+    emission_factor_change_uncertainty = models.FloatField(blank=True, null=True)
     order = models.PositiveSmallIntegerField()
     modification_start_year = models.PositiveSmallIntegerField()
     
@@ -183,4 +377,118 @@ class ReductionModification(models.Model):
             return 0
         return max_order + 1
     class Meta:
-        ordering = ['id']
\ No newline at end of file
+        ordering = ['id']
+        constraints = [
+            CheckConstraint(
+                check=Q(emission_factor_change_distribution='') | Q(emission_factor_change_uncertainty__gte=0),
+                name='modification_distribution_needs_uncertainty'
+            )
+        ]
+
+
+class ReportYearEmission(models.Model):
+    """
+    Stored Report.year_emission for one year, kept up to date by coreapp.signals
+    (unless the year is frozen, see ReportSnapshot)
+    """
+    report = models.ForeignKey(Report, related_name='yearEmissions', on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    total_emission = models.FloatField()
+    frozen = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['report', 'year']
+        constraints = [
+            models.UniqueConstraint(fields=['report', 'year'], name='unique_report_year')
+        ]
+
+
+class StrategyYearDelta(models.Model):
+    """
+    Stored ReductionStrategy.year_delta_emission for one year, kept up to date by coreapp.signals
+    (unless the year is frozen, see ReportSnapshot)
+    """
+    strategy = models.ForeignKey(ReductionStrategy, related_name='yearDeltas', on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    delta_total_emission = models.FloatField()
+    frozen = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['strategy', 'year']
+        constraints = [
+            models.UniqueConstraint(fields=['strategy', 'year'], name='unique_strategy_year')
+        ]
+
+
+class ReportSnapshot(models.Model):
+    """
+    The computed totals of a closed year of a report, never recomputed (see coreapp.snapshots).
+    The source emissions are two packed arrays: the ids (int64) and the emissions (float64)
+    """
+    report = models.ForeignKey(Report, related_name='snapshots', on_delete=models.CASCADE)
+    year = models.PositiveSmallIntegerField()
+    total_emission = models.FloatField()
+    source_ids = models.BinaryField()
+    source_values = models.BinaryField()
+    strategy_deltas = models.JSONField(default=dict) # {strategy id: delta_total_emission}
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Report {self.report_id}: {self.year}'
+
+    def source_emissions(self) -> dict[int, float]:
+        """
+        {source id: year_emission}
+        """
+        ids = np.frombuffer(self.source_ids, dtype=np.int64)
+        values = np.frombuffer(self.source_values, dtype=np.float64)
+        return dict(zip(ids.tolist(), values.tolist()))
+
+    class Meta:
+        ordering = ['report', 'year']
+        constraints = [
+            models.UniqueConstraint(fields=['report', 'year'], name='unique_report_snapshot')
+        ]
+
+
+class ComputationJob(models.Model):
+    """
+    A heavy computation run in the background by the `run_workers` processes (see coreapp.jobs)
+    """
+    REPORT = 'report'
+    TIMESERIES = 'timeseries'
+    COMPARE = 'compare'
+    EXPORT = 'export'
+    PORTFOLIO = 'portfolio'
+    UNCERTAINTY = 'uncertainty'
+    KINDS = [(REPORT, 'Report with its computed totals'), (TIMESERIES, 'Report emission per year'),
+             (COMPARE, 'Comparison of the strategies'), (EXPORT, 'Export of the report'),
+             (PORTFOLIO, 'Portfolio emissions'), (UNCERTAINTY, 'Monte Carlo percentiles')]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    report = models.ForeignKey(Report, related_name='jobs', on_delete=models.CASCADE, blank=True, null=True)
+    portfolio = models.ForeignKey(Portfolio, related_name='jobs', on_delete=models.CASCADE, blank=True, null=True)
+    parameters = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    result = models.JSONField(blank=True, null=True, editable=False)
+    error = models.TextField(blank=True, default='', editable=False)
+    worker = models.CharField(max_length=100, blank=True, default='', editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True, editable=False)
+    heartbeat_at = models.DateTimeField(blank=True, null=True, editable=False) # refreshed while running
+    finished_at = models.DateTimeField(blank=True, null=True, editable=False)
+
+    def __str__(self):
+        return f'Job {self.id}: {self.kind} ({self.status})'
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['status', 'id'], name='job_queue')
+        ]
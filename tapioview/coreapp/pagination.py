@@ -0,0 +1,14 @@
+"""
+Pagination of the large lists (sources, modifications).
+
+The cursor pagination filters on the primary key instead of using an offset
+and does not count the rows: the cost of a page does not depend on its position
+nor on the size of the list.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,76 @@
+"""
+Parameters of the computations, read from the query string of a request or
+from the parameters of a ComputationJob.
+"""
+from rest_framework.exceptions import ValidationError
+
+# Upper bound of the number of years computed in one range request
+MAX_RANGE_YEARS = 500
+
+
+def parse_year(parameters) -> int | None:
+    """
+    The optional `year` parameter, None when missing or invalid (as in the serializers)
+    """
+    try:
+        return int(parameters['year'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_year_range(parameters) -> tuple[int, int]:
+    """
+    Read and validate the `from` and `to` parameters
+    """
+    try:
+        start_year = int(parameters['from'])
+        end_year = int(parameters['to'])
+    except KeyError:
+        raise ValidationError('The `from` and `to` parameters are required.')
+    except (TypeError, ValueError):
+        raise ValidationError('The `from` and `to` parameters must be integers.')
+
+    if start_year > end_year:
+        raise ValidationError('`from` must be lower than or equal to `to`.')
+    if end_year - start_year >= MAX_RANGE_YEARS:
+        raise ValidationError(f'The range cannot exceed {MAX_RANGE_YEARS} years.')
+    return start_year, end_year
+
+
+# Monte Carlo draws (coreapp.uncertainty): the values of all the draws are kept for
+# the percentiles, so the draws x years of a request are bounded
+DEFAULT_DRAWS = 1000
+MAX_DRAWS = 100000
+MAX_DRAW_YEARS = 2000000
+DEFAULT_PERCENTILES = [5.0, 50.0, 95.0]
+MAX_PERCENTILES = 20
+
+
+def parse_monte_carlo(parameters) -> tuple[int, int, int, list[float], int]:
+    """
+    Read and validate the year range and the `draws`, `percentiles` (comma separated)
+    and `seed` parameters: (start year, end year, draws, percentiles, seed)
+    """
+    start_year, end_year = parse_year_range(parameters)
+    try:
+        draws = int(parameters.get('draws', DEFAULT_DRAWS))
+        seed = int(parameters.get('seed', 0))
+    except (TypeError, ValueError):
+        raise ValidationError('The `draws` and `seed` parameters must be integers.')
+    if not 1 <= draws <= MAX_DRAWS:
+        raise ValidationError(f'`draws` must be between 1 and {MAX_DRAWS}.')
+    if draws * (end_year - start_year + 1) > MAX_DRAW_YEARS:
+        raise ValidationError(f'The draws times the years of the range cannot exceed {MAX_DRAW_YEARS}.')
+    if seed < 0:
+        raise ValidationError('`seed` must be positive.')
+
+    percentiles = parameters.get('percentiles')
+    if percentiles is None:
+        return start_year, end_year, draws, DEFAULT_PERCENTILES, seed
+    try:
+        percentiles = [float(percentile) for percentile in str(percentiles).split(',')]
+    except ValueError:
+        raise ValidationError('`percentiles` must be comma separated numbers.')
+    if not 1 <= len(percentiles) <= MAX_PERCENTILES or not all(0 <= percentile <= 100 for percentile in percentiles):
+        raise ValidationError(f'`percentiles` must be 1 to {MAX_PERCENTILES} numbers between 0 and 100.')
+    return start_year, end_year, draws, percentiles, seed
@@ -0,0 +1,37 @@
+"""
+Pools of worker processes for the computations split across processes
+(coreapp.portfolios, coreapp.uncertainty).
+
+A computation runs in this process under a minimum of work, the pool start
+costing more than it saves. The workers only compute: they receive arrays or
+plain data, never model instances, and do not query the database.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.conf import settings
+
+
+def pool_workers(tasks: int, work: int, min_work_setting: str, default_min_work: int, workers_setting: str) -> int:
+    """
+    Number of worker processes for `tasks` tasks of `work` in total, 1 to compute in this process.
+    The settings are the minimum work of a pool and its number of workers (None for one per CPU)
+    """
+    if work < getattr(settings, min_work_setting, default_min_work):
+        return 1
+    workers = getattr(settings, workers_setting, None) or os.cpu_count() or 1
+    return max(1, min(workers, tasks))
+
+
+def _init_worker(initializer, initargs: tuple):
+    # django.setup() is needed for the models when the workers are not forked
+    django.setup()
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def process_pool(workers: int, initializer=None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    Pool of `workers` processes, each calling initializer(*initargs) once Django is set up
+    """
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(initializer, initargs))
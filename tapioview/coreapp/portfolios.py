@@ -0,0 +1,79 @@
+"""
+Emissions and strategy deltas of a portfolio of reports.
+
+The aggregation is built from the comparison of each report
+(coreapp.comparison), read from the computation cache when the report did not
+change. The missing comparisons are loaded together with four queries, then
+computed in this process, or split across a pool of worker processes when
+there are at least settings.PORTFOLIO_POOL_MIN_ROWS rows: the workers receive
+the compact ReportData of the reports (tuples, no model instances, see
+coreapp.frames) and send back the comparisons.
+"""
+from itertools import repeat
+from coreapp import caching, comparison, frames, metrics, pools
+from coreapp.instrumentation import EMISSION, timer
+from coreapp.models import Portfolio
+
+DEFAULT_POOL_MIN_ROWS = 200000
+
+
+def compute_comparisons(report_ids, start_year: int, end_year: int) -> dict[int, dict]:
+    """
+    Comparison of each report
+    """
+    reports = frames.load_reports(report_ids)
+    metrics.registry.inc(metrics.COMPUTATIONS, len(reports), method='compare_strategies')
+
+    workers = pools.pool_workers(len(reports), sum(map(len, reports.values())),
+                                 'PORTFOLIO_POOL_MIN_ROWS', DEFAULT_POOL_MIN_ROWS, 'PORTFOLIO_WORKERS')
+    if workers == 1:
+        results = [comparison.comparison_from_data(data, start_year, end_year) for data in reports.values()]
+    else:
+        with pools.process_pool(workers) as pool:
+            results = list(pool.map(comparison.comparison_from_data, reports.values(),
+                                    repeat(start_year), repeat(end_year),
+                                    chunksize=max(1, len(reports) // (workers * 4))))
+    return {result['id']: result for result in results}
+
+
+def portfolio_emissions(portfolio: Portfolio, start_year: int, end_year: int) -> dict:
+    """
+    For every year of the range: the total emission of the portfolio, of each of its
+    reports, and the delta of the strategies summed per strategy name over the reports
+    (a report without the strategy keeps its baseline emission). The strategies of a
+    report with the same name are alternatives, never added up: the second one is in
+    the group "name (2)", and so on
+    """
+    reports = list(portfolio.reports.values_list('id', 'name'))
+    with timer(EMISSION):
+        comparisons = caching.cached_many([report_id for report_id, _ in reports],
+                                          comparison.COMPARISON_CACHE_NAME, start_year, end_year,
+                                          compute=lambda report_ids: compute_comparisons(report_ids, start_year, end_year))
+
+    years = list(range(start_year, end_year + 1))
+    total = [0.0] * len(years)
+    report_rows = []
+    strategies = {}
+    for report_id, name in reports:
+        report_comparison = comparisons[report_id]
+        for i, cell in enumerate(report_comparison['years']):
+            total[i] += cell['total_emission']
+        occurrences = {}
+        for strategy in report_comparison['strategies']:
+            occurrences[strategy['name']] = occurrence = occurrences.get(strategy['name'], 0) + 1
+            group_name = strategy['name'] if occurrence == 1 else f"{strategy['name']} ({occurrence})"
+            group = strategies.setdefault(group_name, {'name': group_name, 'reports': [], 'delta': [0.0] * len(years)})
+            group['reports'].append(report_id)
+            for i, cell in enumerate(strategy['years']):
+                group['delta'][i] += cell['delta_total_emission']
+        report_rows.append({'id': report_id, 'name': name, 'years': report_comparison['years']})
+
+    return {'id': portfolio.id,
+            'name': portfolio.name,
+            'years': [{'year': year, 'total_emission': emission} for year, emission in zip(years, total)],
+            'strategies': [{'name': group['name'],
+                            'reports': group['reports'],
+                            'years': [{'year': year, 'delta_total_emission': delta, 'total_emission': total[i] - delta}
+                                      for i, (year, delta) in enumerate(zip(years, group['delta']))]}
+                           for group in strategies.values()],
+            'reports': report_rows}
@@ -0,0 +1,124 @@
+"""
+Query planning for the viewsets.
+
+Each function returns the queryset of a viewset with the whole serialized tree
+prefetched, so that the number of SQL queries of a request is fixed and does not
+depend on the number of sources, strategies or modifications.
+The computed fields (total_emission, delta_total_emission) only read these
+prefetched caches, or the prefetched rows of the aggregate tables (coreapp.aggregates).
+Outside of the stored horizon, the report totals are computed by the database and
+the strategy deltas with the frames of the reports (coreapp.frames), loaded once
+for all the serialized strategies.
+With a sparse fieldset (coreapp.fieldsets), only the requested fields are prefetched.
+"""
+from django.db.models import Prefetch, QuerySet
+from coreapp import aggregates
+from coreapp.fieldsets import FieldSelection
+from coreapp.models import Portfolio, Report, Source, ReductionStrategy, ReductionModification, ReportYearEmission, StrategyYearDelta
+
+
+def stored_year(year: int | None) -> bool:
+    """
+    True if the totals of this year are read from the aggregate tables
+    """
+    return year is not None and year in aggregates.horizon_years()
+
+
+def computed_year(year: int | None) -> bool:
+    """
+    True if the totals of this year are computed from the sources
+    """
+    return year is not None and not stored_year(year)
+
+
+def strategy_prefetches(year: int | None = None, selection: FieldSelection | None = None) -> list:
+    """
+    Prefetch the strategy sources and modifications (2 queries)
+    and the stored delta of the year (1 query)
+    """
+    selection = selection or FieldSelection()
+    prefetches = []
+    if selection.allows('sources', nested=True):
+        prefetches.append('sourcesStrategy')
+    if selection.allows('modifications', nested=True):
+        prefetches.append('modifications')
+    if stored_year(year) and selection.allows('delta_total_emission'):
+        prefetches.append(Prefetch('yearDeltas',
+                                   queryset=StrategyYearDelta.objects.filter(year=year),
+                                   to_attr='stored_year_deltas'))
+    return prefetches
+
+
+def report_queryset(nested: bool = True, year: int | None = None, selection: FieldSelection | None = None) -> QuerySet:
+    """
+    Reports with their sources and strategies.
+    With nested=False, only the reports (for the actions loading the sources by themselves).
+
+    Queries: 1 report + 1 sources + 1 strategies + 2 strategy_prefetches = 5
+    + 2 stored totals when the year is in the aggregate tables horizon
+    (+1 count when paginated)
+    Outside of the horizon, the report totals are a subquery of the reports query,
+    and the deltas are computed by the serializers (4 queries of coreapp.frames).
+    With ?summary=1: 1 report + 1 stored total
+    """
+    if not nested:
+        return Report.objects.all()
+    selection = selection or FieldSelection()
+    with_strategies = selection.allows('reductionStrategies', nested=True)
+    strategies = selection.child('reductionStrategies')
+    prefetches = []
+    if selection.allows('sources', nested=True):
+        prefetches.append('sources')
+    if with_strategies:
+        prefetches.append(Prefetch('reductionStrategies',
+                                   queryset=ReductionStrategy.objects.prefetch_related(*strategy_prefetches(year, strategies))))
+    queryset = Report.objects.all()
+    if stored_year(year) and selection.allows('total_emission'):
+        prefetches.append(Prefetch('yearEmissions',
+                                   queryset=ReportYearEmission.objects.filter(year=year),
+                                   to_attr='stored_year_emissions'))
+    elif computed_year(year) and selection.allows('total_emission'):
+        queryset = queryset.with_year_emission(year)
+    return queryset.prefetch_related(*prefetches)
+
+
+def strategy_queryset(report_id: int, year: int | None = None, selection: FieldSelection | None = None) -> QuerySet:
+    """
+    Strategies of a report, with the stored delta of the year.
+
+    Queries: 1 strategies (with report) + 2 strategy_prefetches
+    + 1 stored delta = 4 (+1 count when paginated)
+    Outside of the horizon, the deltas are computed by the serializers (4 queries of coreapp.frames).
+    """
+    selection = selection or FieldSelection()
+    queryset = ReductionStrategy.objects.filter(report_id=report_id).select_related('report')
+    return queryset.prefetch_related(*strategy_prefetches(year, selection))
+
+
+def source_queryset(report_id: int | None = None, strategy_id: int | None = None) -> QuerySet:
+    """
+    Sources of a report or of a strategy.
+
+    Queries: 1 sources (cursor pagination, no count)
+    """
+    if strategy_id is not None:
+        return Source.objects.filter(strategy_id=strategy_id)
+    return Source.objects.filter(report_id=report_id)
+
+
+def modification_queryset(strategy_id: int) -> QuerySet:
+    """
+    Modifications of a strategy.
+
+    Queries: 1 modifications (cursor pagination, no count)
+    """
+    return ReductionModification.objects.filter(strategy_id=strategy_id)
+
+
+def portfolio_queryset() -> QuerySet:
+    """
+    Portfolios with the ids of their reports.
+
+    Queries: 1 count, 1 portfolios, 1 report ids
+    """
+    return Portfolio.objects.prefetch_related(Prefetch('reports', queryset=Report.objects.only('id')))
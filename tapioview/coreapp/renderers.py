@@ -0,0 +1,88 @@
+"""
+Renderers of the API.
+
+ORJSONRenderer is the default JSON renderer: the same JSON as DRF's JSONRenderer
+(compact, UTF-8, dates and decimals converted by DRF's encoder), produced by
+orjson. One difference: orjson writes NaN and the infinities as null, where the
+strict JSONRenderer (STRICT_JSON) raises ValueError. Finding them would take a
+walk of the data slower than the json encoding itself, so a non-finite value
+from a computation is returned as null instead of failing the request.
+MessagePackRenderer is negotiated with `Accept: application/msgpack`
+when msgpack is installed.
+
+The streamed responses are built by the views (StreamingHttpResponse), the
+streaming renderers are only used by DRF to negotiate the format (Accept header
+or ?format=).
+"""
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_encoder = JSONEncoder()
+
+
+def encode_default(obj):
+    """
+    Types unknown to orjson and msgpack (Decimal, lazy strings, querysets...), converted by DRF's encoder
+    """
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer producing the same JSON with orjson, but NaN and the infinities
+    written as null. The indented output of the browsable API and the values orjson
+    refuses (integers over 64 bits) are rendered by JSONRenderer.
+    """
+    # Datetimes and times are formatted by DRF (milliseconds, Z suffix)
+    options = orjson.OPT_PASSTHROUGH_DATETIME
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            content = orjson.dumps(data, default=encode_default, option=self.options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Escaped by JSONRenderer, as they end the lines of JavaScript
+        if b'\xe2\x80' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return content
+
+
+class StreamingRenderer(BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Errors are returned as plain text
+        return str(data).encode(self.charset)
+
+
+class NDJSONRenderer(StreamingRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+
+class CSVRenderer(StreamingRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=encode_default, use_bin_type=True, datetime=False)
@@ -0,0 +1,108 @@
+"""
+OpenAPI schema built ahead, served from a file.
+
+drf-spectacular builds the schema on every request by introspecting all the
+viewsets and serializers. With settings.OPENAPI_SCHEMA_FILE, the schema is built
+once (`manage.py build_schema`, e.g. when building the image), read once per
+process and served as is, with its hash as ETag. The Swagger and Redoc pages link
+it with its hash in the URL (?v=): this URL never changes content, so it is cached
+for a year by the browsers and the proxies, and a new build gives a new URL.
+Without the setting, or while the file is not built yet (a warning is logged,
+and `manage.py check --deploy` reports it), the schema is generated on request.
+"""
+import hashlib
+import logging
+from functools import lru_cache
+from pathlib import Path
+from django.conf import settings
+from django.core import checks
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
+
+CONTENT_TYPE = 'application/vnd.oai.openapi+json'
+# The versioned schema URL, then the schema without version and the pages linking it
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MAX_AGE = 300
+
+logger = logging.getLogger(__name__)
+
+
+def schema_file() -> Path | None:
+    path = getattr(settings, 'OPENAPI_SCHEMA_FILE', None)
+    return Path(path) if path else None
+
+
+@lru_cache(maxsize=4)
+def _read(path: Path, modified: int) -> tuple[bytes, str]:
+    content = path.read_bytes()
+    return content, hashlib.sha256(content).hexdigest()[:16]
+
+
+def built_schema() -> tuple[bytes, str] | None:
+    """
+    (content, version) of the built schema, None if the schema is generated on request.
+    Read again only when the file is rebuilt
+    """
+    path = schema_file()
+    if path is None:
+        return None
+    try:
+        return _read(path, path.stat().st_mtime_ns)
+    except FileNotFoundError:
+        logger.warning('OPENAPI_SCHEMA_FILE %s not built (manage.py build_schema), the schema is generated', path)
+        return None
+
+
+@checks.register(checks.Tags.compatibility, deploy=True)
+def check_schema_file(app_configs, **kwargs):
+    path = schema_file()
+    if path is None or path.is_file():
+        return []
+    return [checks.Warning(f'OPENAPI_SCHEMA_FILE {path} does not exist, the schema is generated on each request.',
+                           hint='Build it with manage.py build_schema.', id='coreapp.W001')]
+
+
+class SchemaView(SpectacularAPIView):
+    def get(self, request, *args, **kwargs):
+        schema = built_schema()
+        if schema is None:
+            return super().get(request, *args, **kwargs)
+        content, version = schema
+
+        etag = quote_etag(version)
+        response = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type=CONTENT_TYPE)
+        response.headers['ETag'] = etag
+        if request.GET.get('v') == version:
+            patch_cache_control(response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=MAX_AGE)
+        return response
+
+
+class VersionedSchemaUrlMixin:
+    """
+    The pages link the versioned schema URL, and are cached for MAX_AGE
+    """
+
+    def _get_schema_url(self, request):
+        url = super()._get_schema_url(request)
+        schema = built_schema()
+        if schema is None:
+            return url
+        return f'{url}{"&" if "?" in url else "?"}v={schema[1]}'
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code == 200 and built_schema() is not None:
+            patch_cache_control(response, public=True, max_age=MAX_AGE)
+        return response
+
+
+class SwaggerView(VersionedSchemaUrlMixin, SpectacularSwaggerView):
+    pass
+
+
+class RedocView(VersionedSchemaUrlMixin, SpectacularRedocView):
+    pass
@@ -1,8 +1,58 @@
+from django.db import models
 from rest_framework import serializers
-from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
+from coreapp import aggregates, frames, queries
+from coreapp.fieldsets import DynamicFieldsMixin
+from coreapp.instrumentation import TimedSerializerMixin
+from coreapp.models import ComputationJob, Portfolio, Report, ReportSnapshot, Source, ReductionStrategy, ReductionModification
 
 
-class SourceSerializer(serializers.ModelSerializer):
+def context_year(serializer) -> str|None:
+    """
+    The `year` of the serializer context when serialized outside of a request (see serialize_report),
+    the year query parameter of the request otherwise
+    """
+    if 'year' in serializer.context:
+        year = serializer.context['year']
+        return str(year) if year is not None else None
+    return serializer.context['request'].query_params.get('year')
+
+
+def computed_year(serializer) -> int | None:
+    """
+    The year of the request when its totals are computed (outside of the stored horizon)
+    """
+    year_param:str|None = context_year(serializer)
+    try:
+        year = int(year_param) if year_param else None
+    except ValueError:
+        return None
+    return year if queries.computed_year(year) else None
+
+
+def validate_uncertainty(serializer, attrs: dict, distribution_field: str, uncertainty_field: str):
+    """
+    A distribution of the emission factor needs its uncertainty (Meta.constraints of the model)
+    """
+    instance = serializer.instance
+    distribution = attrs.get(distribution_field, getattr(instance, distribution_field, ''))
+    uncertainty = attrs.get(uncertainty_field, getattr(instance, uncertainty_field, None))
+    if distribution and (uncertainty is None or uncertainty < 0):
+        raise serializers.ValidationError({uncertainty_field: 'A positive uncertainty is required with a distribution.'})
+
+
+class ComputedDeltasListSerializer(serializers.ListSerializer):
+    """
+    Compute the deltas of a year outside of the stored horizon for all the serialized
+    objects at once (see annotate_year_deltas), then serialize them one by one
+    """
+
+    def to_representation(self, data):
+        items = data.all() if isinstance(data, models.Manager) else data
+        self.child.annotate_year_deltas(items)
+        return super().to_representation(items)
+
+
+class SourceSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Source
@@ -10,26 +60,37 @@ class SourceSerializer(serializers.ModelSerializer):
                   'description',
                   'value',
                   'emission_factor',
+                  'emission_factor_distribution',
+                  'emission_factor_uncertainty',
                   'total_emission',
                   'lifetime',
                   'acquisition_year',
                   'report']
+
+    def validate(self, attrs):
+        validate_uncertainty(self, attrs, 'emission_factor_distribution', 'emission_factor_uncertainty')
+        return attrs
         
     def to_representation(self, instance: Source):
         representation = super().to_representation(instance)
         # Perform any necessary modification to the total_emission field value here
-        year_param:str|None = self.context['request'].query_params.get('year')
-        if year_param:
+        year_param:str|None = context_year(self)
+        if year_param and 'total_emission' in representation:
             try:
                 year = int(year_param)
-                representation['total_emission'] = instance.year_emission(year)
+                # Read from the snapshot of a frozen year (see SourceViewSet)
+                frozen_emissions = self.context.get('frozen_emissions') or {}
+                if instance.id in frozen_emissions:
+                    representation['total_emission'] = frozen_emissions[instance.id]
+                else:
+                    representation['total_emission'] = instance.year_emission(year)
             except ValueError:
                 # Handle the case when the 'year' value is not a valid integer
                 pass
         return representation
         
 
-class ReductionModificationSerializer(serializers.ModelSerializer):
+class ReductionModificationSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ReductionModification
         fields = ['id',
@@ -39,11 +100,18 @@ class ReductionModificationSerializer(serializers.ModelSerializer):
                   'order',
                   'modification_start_year',
                   'value_modification',
-                  'emission_factor_change']
+                  'emission_factor_change',
+                  'emission_factor_change_distribution',
+                  'emission_factor_change_uncertainty']
         read_only_fields = ['order']
 
-class ReductionStrategySerializer(serializers.ModelSerializer):
+    def validate(self, attrs):
+        validate_uncertainty(self, attrs, 'emission_factor_change_distribution', 'emission_factor_change_uncertainty')
+        return attrs
+
+class ReductionStrategySerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     sources = SourceSerializer(
+        source='sourcesStrategy',
         many=True,
         read_only=True,
     )
@@ -56,28 +124,41 @@ class ReductionStrategySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ReductionStrategy
+        list_serializer_class = ComputedDeltasListSerializer
         fields = ['id',
                   'report',
                   'name',
                   'delta_total_emission',
                   'sources',
                   'modifications']
-    
+
+    def annotate_year_deltas(self, strategies):
+        """
+        Compute the deltas of the strategies with the frames of their reports (coreapp.frames)
+        """
+        year = computed_year(self)
+        if year is not None and 'delta_total_emission' in self.fields:
+            frames.annotate_year_deltas(strategies, year)
+
+    def to_representation(self, instance: ReductionStrategy):
+        if self.parent is None:
+            self.annotate_year_deltas([instance])
+        return super().to_representation(instance)
 
     def get_delta_total_emission(self, obj: ReductionStrategy) -> float|None:
-        year_param:str|None = self.context['request'].query_params.get('year')
+        year_param:str|None = context_year(self)
         delta_total_emission:float|None = None
         if not year_param:
             return None # In the case where there is no year parameter, the calculation of the delta is meaningless
         try:
             year = int(year_param)
-            delta_total_emission = obj.year_delta_emission(year)
+            delta_total_emission = aggregates.strategy_year_delta(obj, year)
         except ValueError:
             # Handle the case when the 'year' value is not a valid integer
             pass
         return delta_total_emission
 
-class ReportSerializer(serializers.ModelSerializer):
+class ReportSerializer(TimedSerializerMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     sources = SourceSerializer(
         many=True,
         read_only=True,
@@ -91,22 +172,105 @@ class ReportSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Report
+        list_serializer_class = ComputedDeltasListSerializer
         fields = ['id',
                   'name',
                   'total_emission',
                   'sources',
                   'reductionStrategies']
-    
+
+    def annotate_year_deltas(self, reports):
+        """
+        Compute the deltas of the strategies of all the reports at once
+        """
+        if 'reductionStrategies' in self.fields:
+            self.fields['reductionStrategies'].child.annotate_year_deltas(
+                [strategy for report in reports for strategy in report.reductionStrategies.all()])
+
+    def to_representation(self, instance: Report):
+        if self.parent is None:
+            self.annotate_year_deltas([instance])
+        return super().to_representation(instance)
 
     def get_total_emission(self, obj: Report) -> float|None:
-        year_param:str|None = self.context['request'].query_params.get('year')
+        year_param:str|None = context_year(self)
         total_emission:float|None = None
         if not year_param:
             return None
         try:
             year = int(year_param)
-            total_emission = obj.year_emission(year)
+            total_emission = aggregates.report_year_emission(obj, year)
         except ValueError:
             # Handle the case when the 'year' value is not a valid integer
             pass
-        return total_emission
\ No newline at end of file
+        return total_emission
+
+
+class PortfolioSerializer(serializers.ModelSerializer):
+    reports = serializers.PrimaryKeyRelatedField(many=True, queryset=Report.objects.all(), required=False)
+
+    class Meta:
+        model = Portfolio
+        fields = ['id',
+                  'name',
+                  'reports']
+
+
+class ReportSnapshotSerializer(serializers.ModelSerializer):
+    sources = serializers.SerializerMethodField()
+    strategies = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportSnapshot
+        fields = ['report',
+                  'year',
+                  'created_at',
+                  'total_emission',
+                  'sources',
+                  'strategies']
+
+    def get_sources(self, obj: ReportSnapshot) -> list[dict]:
+        return [{'id': source_id, 'year_emission': emission} for source_id, emission in obj.source_emissions().items()]
+
+    def get_strategies(self, obj: ReportSnapshot) -> list[dict]:
+        return [{'id': int(strategy_id), 'delta_total_emission': delta} for strategy_id, delta in obj.strategy_deltas.items()]
+
+
+class ComputationJobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = ComputationJob
+        fields = ['id',
+                  'kind',
+                  'report',
+                  'portfolio',
+                  'parameters',
+                  'status',
+                  'error',
+                  'worker',
+                  'created_at',
+                  'started_at',
+                  'heartbeat_at',
+                  'finished_at']
+        read_only_fields = ['status']
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        # The portfolio jobs run on a portfolio, the others on a report
+        target = 'portfolio' if attrs['kind'] == ComputationJob.PORTFOLIO else 'report'
+        other = 'report' if target == 'portfolio' else 'portfolio'
+        if attrs.get(target) is None:
+            raise serializers.ValidationError({target: 'This field is required for this kind of job.'})
+        if attrs.get(other) is not None:
+            raise serializers.ValidationError({other: 'This field must be empty for this kind of job.'})
+        if not isinstance(attrs.get('parameters', {}), dict):
+            raise serializers.ValidationError({'parameters': 'Expected an object.'})
+        return attrs
+
+
+def serialize_report(report_id: int, year: int | None) -> dict:
+    """
+    The nested report as returned by /reports/{id}/?year=, outside of a request
+    """
+    report = queries.report_queryset(year=year).get(pk=report_id)
+    return ReportSerializer(report, context={'request': None, 'year': year}).data
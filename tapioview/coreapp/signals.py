@@ -0,0 +1,251 @@
+"""
+Keep the report revisions (coreapp.caching) and the materialized per-year
+totals (coreapp.aggregates) up to date, and reject the changes of a frozen
+year (coreapp.snapshots).
+
+The contributions of the changed object are computed before (pre_*) and after
+(post_*) the write, and only the difference is applied to the stored rows.
+Deletions cascading from a parent are handled by the parent: the rows of a
+deleted report or strategy are deleted with it, and a deleted source removes
+its whole contribution, modifications included.
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+from coreapp import aggregates, caching, snapshots
+from coreapp.models import Report, ReductionStrategy, Source, ReductionModification
+
+
+def _origin_model(origin):
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+
+def _pending(origin) -> dict:
+    """
+    State shared by all the signals of one delete() call
+    """
+    if not hasattr(origin, '_signals_pending'):
+        origin._signals_pending = {}
+    return origin._signals_pending
+
+
+# Previous rows
+# Connected first: the row before the change, `instance._previous`, is read once for the handlers below
+
+@receiver(pre_save, sender=ReductionStrategy)
+@receiver(pre_save, sender=Source)
+@receiver(pre_save, sender=ReductionModification)
+def previous_loading(sender, instance, **kwargs):
+    rows = sender.objects.select_related('source') if sender is ReductionModification else sender.objects
+    instance._previous = rows.filter(pk=instance.pk).first() if instance.pk else None
+
+
+# Frozen years (coreapp.snapshots)
+# Connected before the others: nothing is computed for a rejected change
+
+@receiver(pre_save, sender=Source)
+def source_frozen_check(sender, instance, raw, **kwargs):
+    if not raw:
+        snapshots.check_source(instance._previous, instance)
+
+
+@receiver(pre_delete, sender=Source)
+def source_deletion_frozen_check(sender, instance, origin, **kwargs):
+    if issubclass(_origin_model(origin), Source):
+        snapshots.check_source(instance, None) # the deleted report or strategy takes its sources with it
+
+
+@receiver(pre_save, sender=ReductionModification)
+def modification_frozen_check(sender, instance, raw, **kwargs):
+    if not raw:
+        snapshots.check_modification(instance._previous, instance)
+
+
+@receiver(pre_delete, sender=ReductionModification)
+def modification_deletion_frozen_check(sender, instance, origin, **kwargs):
+    if issubclass(_origin_model(origin), ReductionModification):
+        snapshots.check_modification(instance, None)
+
+
+# Revisions (coreapp.caching)
+
+def _report_ids(sources) -> set:
+    """
+    Reports of (report_id, strategy_id) pairs
+    """
+    report_ids = {report_id for report_id, strategy_id in sources if report_id}
+    strategy_ids = {strategy_id for report_id, strategy_id in sources if strategy_id}
+    if strategy_ids:
+        report_ids.update(ReductionStrategy.objects.filter(pk__in=strategy_ids).values_list('report_id', flat=True))
+    return report_ids
+
+
+@receiver(pre_save, sender=Report)
+def report_revision_saving(sender, instance, raw, **kwargs):
+    if instance.pk and not raw:
+        instance.revision = caching.new_revision()
+
+
+@receiver(pre_save, sender=ReductionStrategy)
+def strategy_revision_saving(sender, instance, **kwargs):
+    instance._revision_report_ids = {instance.report_id}
+    if instance._previous:
+        instance._revision_report_ids.add(instance._previous.report_id)
+
+
+@receiver(post_save, sender=ReductionStrategy)
+def strategy_revision_saved(sender, instance, **kwargs):
+    caching.bump_revisions(instance._revision_report_ids)
+
+
+@receiver(pre_save, sender=Source)
+def source_revision_saving(sender, instance, **kwargs):
+    sources = [(instance.report_id, instance.strategy_id)]
+    if instance._previous:
+        sources.append((instance._previous.report_id, instance._previous.strategy_id))
+    instance._revision_report_ids = _report_ids(sources)
+
+
+@receiver(post_save, sender=Source)
+def source_revision_saved(sender, instance, **kwargs):
+    caching.bump_revisions(instance._revision_report_ids)
+
+
+@receiver(pre_save, sender=ReductionModification)
+def modification_revision_saving(sender, instance, **kwargs):
+    sources = [(None, instance.strategy_id)]
+    if instance._previous:
+        sources.append((instance._previous.source.report_id, instance._previous.strategy_id))
+    instance._revision_report_ids = _report_ids(sources)
+
+
+@receiver(post_save, sender=ReductionModification)
+def modification_revision_saved(sender, instance, **kwargs):
+    caching.bump_revisions(instance._revision_report_ids)
+
+
+@receiver(post_delete, sender=Source)
+@receiver(post_delete, sender=ReductionStrategy)
+@receiver(post_delete, sender=ReductionModification)
+def revision_deleted(sender, instance, origin, **kwargs):
+    if issubclass(_origin_model(origin), Report):
+        return # the report is deleted
+    if sender is ReductionStrategy:
+        report_ids = {instance.report_id}
+    elif sender is Source:
+        report_ids = _report_ids([(instance.report_id, instance.strategy_id)])
+    else:
+        report_ids = _report_ids([(None, instance.strategy_id)])
+    # A delete() call bumps each report only once
+    bumped = _pending(origin).setdefault('revision_bumped', set())
+    caching.bump_revisions(report_ids - bumped)
+    bumped.update(report_ids)
+
+
+# Materialized totals (coreapp.aggregates)
+
+# Report
+
+@receiver(post_save, sender=Report)
+def report_saved(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        aggregates.materialize_report(instance)
+
+
+# ReductionStrategy
+
+@receiver(pre_save, sender=ReductionStrategy)
+def strategy_saving(sender, instance, raw, **kwargs):
+    instance._previous_report_id = instance._previous.report_id if instance._previous and not raw else None
+
+
+@receiver(post_save, sender=ReductionStrategy)
+def strategy_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created or instance._previous_report_id != instance.report_id:
+        aggregates.materialize_strategy(instance)
+
+
+# Source
+
+@receiver(pre_save, sender=Source)
+def source_saving(sender, instance, raw, **kwargs):
+    # Only the years from the first acquisition year before or after the change are updated
+    instance._aggregates_years = None
+    previous = instance._previous
+    if raw or not snapshots.changed(previous, instance, snapshots.COMPUTED_SOURCE_FIELDS):
+        return
+    instance._aggregates_before = {}
+    if previous:
+        instance._aggregates_years = aggregates.source_years(previous, instance)
+        instance._aggregates_before = aggregates.source_contributions(previous, instance._aggregates_years)
+    else:
+        instance._aggregates_years = aggregates.source_years(instance)
+
+
+@receiver(post_save, sender=Source)
+def source_saved(sender, instance, raw, **kwargs):
+    if instance._aggregates_years is not None:
+        aggregates.apply_contributions(instance._aggregates_before,
+                                       aggregates.source_contributions(instance, instance._aggregates_years))
+
+
+@receiver(pre_delete, sender=Source)
+def source_deleting(sender, instance, origin, **kwargs):
+    if issubclass(_origin_model(origin), Report):
+        return # the rows are deleted with the report
+    _pending(origin)[('source', instance.pk)] = aggregates.source_contributions(instance, aggregates.source_years(instance))
+
+
+@receiver(post_delete, sender=Source)
+def source_deleted(sender, instance, origin, **kwargs):
+    before = _pending(origin).pop(('source', instance.pk), None)
+    if before is not None:
+        aggregates.apply_contributions(before, {})
+
+
+# ReductionModification
+
+@receiver(pre_save, sender=ReductionModification)
+def modification_saving(sender, instance, raw, **kwargs):
+    instance._aggregates_pairs = set()
+    previous = instance._previous
+    if raw or not snapshots.changed(previous, instance, snapshots.COMPUTED_MODIFICATION_FIELDS):
+        return
+    instance._aggregates_pairs.add((instance.strategy_id, instance.source_id))
+    if previous:
+        instance._aggregates_pairs.add((previous.strategy_id, previous.source_id))
+    instance._aggregates_before = aggregates.modification_contributions(instance._aggregates_pairs)
+
+
+@receiver(post_save, sender=ReductionModification)
+def modification_saved(sender, instance, raw, **kwargs):
+    if instance._aggregates_pairs:
+        aggregates.apply_contributions(instance._aggregates_before,
+                                       aggregates.modification_contributions(instance._aggregates_pairs))
+
+
+@receiver(pre_delete, sender=ReductionModification)
+def modification_deleting(sender, instance, origin, **kwargs):
+    if not issubclass(_origin_model(origin), ReductionModification):
+        return # handled by the deleted source, strategy or report
+    # Several modifications of the same source can be deleted at once:
+    # the difference is applied once, after the last one
+    pair = (instance.strategy_id, instance.source_id)
+    pending = _pending(origin)
+    if pair in pending:
+        pending[pair][0] += 1
+    else:
+        pending[pair] = [1, aggregates.modification_contributions([pair])]
+
+
+@receiver(post_delete, sender=ReductionModification)
+def modification_deleted(sender, instance, origin, **kwargs):
+    pair = (instance.strategy_id, instance.source_id)
+    pending = _pending(origin)
+    if pair not in pending:
+        return
+    pending[pair][0] -= 1
+    if pending[pair][0] == 0:
+        aggregates.apply_contributions(pending.pop(pair)[1], aggregates.modification_contributions([pair]))
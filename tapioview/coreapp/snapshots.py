@@ -0,0 +1,156 @@
+"""
+Frozen years of a report.
+
+Once a fiscal year is closed, freeze_report stores a ReportSnapshot of the year:
+the total emission of the report, the emission of each of its sources and the
+delta of each strategy. The stored rows of the year (coreapp.aggregates) are set
+to the snapshot values and marked frozen: the signals and the materializations
+leave them as they are, so the totals of the year are a single row read, and the
+source emissions are read from the snapshot instead of being recomputed.
+
+While a year is frozen, the sources existing in this year and the modifications
+started in or before it cannot be created, changed or deleted: coreapp.signals
+raises FrozenYearError. unfreeze_report deletes the snapshot and recomputes the
+rows from the sources, the year can then be frozen again.
+"""
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from coreapp import caching
+from coreapp.models import (Report, ReductionStrategy, Source, ReductionModification, ReportSnapshot,
+                            ReportYearEmission, StrategyYearDelta)
+
+# Fields of a source used by the computations
+COMPUTED_SOURCE_FIELDS = ['report_id', 'strategy_id', 'value', 'emission_factor', 'lifetime', 'acquisition_year']
+COMPUTED_MODIFICATION_FIELDS = ['strategy_id', 'source_id', 'value_modification', 'emission_factor_change',
+                                'modification_start_year']
+
+
+class FrozenYearError(ValidationError):
+    """
+    A change of the sources or modifications of a frozen year
+    """
+
+
+# Freeze
+
+def freeze_report(report: Report, year: int) -> ReportSnapshot:
+    """
+    Compute the totals of the year from the sources and store them as a snapshot
+    """
+    with transaction.atomic():
+        sources = list(Source.objects.filter(report=report).with_year_emission(year)
+                       .order_by('id').values_list('id', 'year_emission_value'))
+        ids = np.array([source_id for source_id, _ in sources], dtype=np.int64)
+        values = np.array([value for _, value in sources], dtype=np.float64)
+        deltas = {strategy.pk: strategy.year_delta_emission(year)
+                  for strategy in ReductionStrategy.objects.filter(report=report)}
+        snapshot = ReportSnapshot.objects.create(report=report, year=year, total_emission=float(values.sum()),
+                                                 source_ids=ids.tobytes(), source_values=values.tobytes(),
+                                                 strategy_deltas={str(strategy_id): delta for strategy_id, delta in deltas.items()})
+
+        ReportYearEmission.objects.update_or_create(report=report, year=year,
+                                                    defaults={'total_emission': snapshot.total_emission, 'frozen': True})
+        for strategy_id, delta in deltas.items():
+            StrategyYearDelta.objects.update_or_create(strategy_id=strategy_id, year=year,
+                                                       defaults={'delta_total_emission': delta, 'frozen': True})
+    # The responses of the report now depend on the snapshot
+    caching.bump_revisions([report.pk])
+    return snapshot
+
+
+def unfreeze_report(report: Report, year: int) -> bool:
+    """
+    Delete the snapshot of the year and recompute its rows. False if the year was not frozen
+    """
+    with transaction.atomic():
+        deleted, _ = ReportSnapshot.objects.filter(report=report, year=year).delete()
+        if not deleted:
+            return False
+        caching.bump_revisions([report.pk])
+        ReportYearEmission.objects.filter(report=report, year=year).update(
+            total_emission=report.year_emission(year), frozen=False)
+        for strategy in ReductionStrategy.objects.filter(report=report):
+            StrategyYearDelta.objects.filter(strategy=strategy, year=year).update(
+                delta_total_emission=strategy.year_delta_emission(year), frozen=False)
+    return True
+
+
+# Reads
+
+def source_emissions(report_id: int, year: int | None) -> dict[int, float] | None:
+    """
+    {source id: year_emission} of the snapshot of the year, None if the year is not frozen
+    """
+    if year is None:
+        return None
+    snapshot = (ReportSnapshot.objects.filter(report_id=report_id, year=year)
+                .only('source_ids', 'source_values').first())
+    return snapshot.source_emissions() if snapshot else None
+
+
+def frozen_years(report_ids) -> dict[int, list[int]]:
+    """
+    {report id: frozen years} of the reports with a frozen year, in one query
+    """
+    years = {}
+    for report_id, year in ReportSnapshot.objects.filter(report_id__in=report_ids).values_list('report_id', 'year'):
+        years.setdefault(report_id, []).append(year)
+    return years
+
+
+# Checks
+
+def changed(before, after, fields: list[str]) -> bool:
+    """
+    Whether a change (None when created or deleted) changes the fields
+    """
+    return before is None or after is None or any(getattr(before, field) != getattr(after, field) for field in fields)
+
+
+def _strategy_reports(strategy_ids) -> dict[int, int]:
+    strategy_ids = {strategy_id for strategy_id in strategy_ids if strategy_id}
+    if not strategy_ids:
+        return {}
+    return dict(ReductionStrategy.objects.filter(pk__in=strategy_ids).values_list('id', 'report_id'))
+
+
+def check_source(before: Source | None, after: Source | None, frozen: dict[int, list[int]] | None = None):
+    """
+    Raise FrozenYearError if the change of a source (None when created or deleted) can change
+    a frozen year of its report: the source exists in this year before or after the change.
+    `frozen` (see frozen_years) saves a query per source
+    """
+    if not changed(before, after, COMPUTED_SOURCE_FIELDS):
+        return
+    states = [source for source in [before, after] if source is not None]
+    # The report of a new source of a strategy, read from the strategy when it is loaded
+    strategy_reports = {source.strategy_id: source.strategy.report_id for source in states
+                        if not source.report_id and Source.strategy.is_cached(source)}
+    strategy_reports.update(_strategy_reports(source.strategy_id for source in states
+                                              if not source.report_id and source.strategy_id not in strategy_reports))
+    report_ids = {source.report_id or strategy_reports.get(source.strategy_id) for source in states} - {None}
+    if frozen is None:
+        frozen = frozen_years(report_ids)
+    for report_id in report_ids:
+        for year in frozen.get(report_id, []):
+            if any(not source.acquisition_year or source.acquisition_year <= year for source in states):
+                raise FrozenYearError(f'The year {year} of the report {report_id} is frozen: '
+                                      f'the sources acquired in or before {year} cannot be changed.')
+
+
+def check_modification(before: ReductionModification | None, after: ReductionModification | None):
+    """
+    Raise FrozenYearError if the change of a modification (None when created or deleted)
+    can change a frozen year of its report: the modification starts in or before this year
+    """
+    if not changed(before, after, COMPUTED_MODIFICATION_FIELDS):
+        return
+    states = [modification for modification in [before, after] if modification is not None]
+    strategy_reports = _strategy_reports(modification.strategy_id for modification in states)
+    for report_id, years in frozen_years(set(strategy_reports.values())).items():
+        for year in years:
+            if any(modification.modification_start_year <= year for modification in states
+                   if strategy_reports.get(modification.strategy_id) == report_id):
+                raise FrozenYearError(f'The year {year} of the report {report_id} is frozen: '
+                                      f'the modifications started in or before {year} cannot be changed.')
@@ -0,0 +1,117 @@
+from django.test import TestCase, override_settings
+from coreapp import aggregates
+from coreapp.models import Report, Source, ReductionStrategy, ReductionModification, ReportYearEmission, StrategyYearDelta
+# from django.test import tag
+
+
+@override_settings(EMISSION_YEARS_HORIZON=(1998, 2012))
+class AggregatesTest(TestCase):
+
+    def setUp(self):
+        self.report = Report.objects.create(name='Report 1')
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        self.source1 = Source.objects.create(report=self.report, value=10, emission_factor=10)
+        self.source2 = Source.objects.create(report=self.report, value=10, emission_factor=10, lifetime=5, acquisition_year=2000)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source1, value_modification=-2, modification_start_year=2002)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source2, emission_factor_change=5, modification_start_year=2003)
+
+    def assertStoredEqualsComputed(self):
+        for report in Report.objects.all():
+            rows = ReportYearEmission.objects.filter(report=report)
+            self.assertEqual(rows.count(), len(aggregates.horizon_years()))
+            for row in rows:
+                self.assertAlmostEqual(row.total_emission, report.year_emission(row.year))
+        for strategy in ReductionStrategy.objects.all():
+            rows = StrategyYearDelta.objects.filter(strategy=strategy)
+            self.assertEqual(rows.count(), len(aggregates.horizon_years()))
+            for row in rows:
+                self.assertAlmostEqual(row.delta_total_emission, strategy.year_delta_emission(row.year))
+
+    def test_created(self):
+        self.assertStoredEqualsComputed()
+        self.assertEqual(aggregates.report_year_emission(self.report, 2004), 100+100/5)
+        self.assertEqual(aggregates.strategy_year_delta(self.strategy, 2004), 20+(100/5-50/5))
+
+    def test_source_updated(self):
+        self.source1.value = 3
+        self.source1.save()
+        self.assertStoredEqualsComputed()
+
+        self.source2.acquisition_year = 2005
+        self.source2.lifetime = 2
+        self.source2.save()
+        self.assertStoredEqualsComputed()
+
+        # Moved to another report and to a strategy
+        report2 = Report.objects.create(name='Report 2')
+        self.source1.report = report2
+        self.source1.save()
+        self.assertStoredEqualsComputed()
+
+        self.source1.report = None
+        self.source1.strategy = self.strategy
+        self.source1.save()
+        self.assertStoredEqualsComputed()
+
+    def test_source_updated_narrowly(self):
+        strategy2 = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        # Without a computed field, nothing is computed
+        self.source2.description = 'Renamed'
+        with self.assertNumQueries(3): # previous row, save, revision
+            self.source2.save()
+
+        # A negative source changes the delta of the strategies without its modifications
+        self.source2.value = -10
+        self.source2.acquisition_year = 2004
+        self.source2.save()
+        self.assertStoredEqualsComputed()
+        self.assertAlmostEqual(aggregates.strategy_year_delta(strategy2, 2006), -100/5)
+        self.source2.value = 4
+        self.source2.save()
+        self.assertStoredEqualsComputed()
+        self.assertEqual(aggregates.strategy_year_delta(strategy2, 2006), 0)
+
+    def test_modification_updated(self):
+        strategy2 = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        modification = ReductionModification.objects.create(strategy=strategy2, source=self.source1, value_modification=4, modification_start_year=2006)
+        self.assertStoredEqualsComputed()
+
+        modification.emission_factor_change = 2
+        modification.save()
+        self.assertStoredEqualsComputed()
+
+        modification.strategy = self.strategy
+        modification.save()
+        self.assertStoredEqualsComputed()
+
+    def test_deleted(self):
+        Source.objects.create(strategy=self.strategy, value=1, emission_factor=3)
+        self.assertStoredEqualsComputed()
+
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source1, value_modification=1, modification_start_year=2004)
+        ReductionModification.objects.filter(source=self.source1).delete()
+        self.assertStoredEqualsComputed()
+
+        # The modifications are deleted with their source
+        self.source2.delete()
+        self.assertStoredEqualsComputed()
+
+        Source.objects.all().delete()
+        self.assertStoredEqualsComputed()
+
+        self.strategy.delete()
+        self.assertStoredEqualsComputed()
+
+        self.report.delete()
+        self.assertEqual(ReportYearEmission.objects.count(), 0)
+
+    def test_materialized_on_read(self):
+        ReportYearEmission.objects.all().delete()
+        StrategyYearDelta.objects.all().delete()
+
+        self.assertAlmostEqual(aggregates.report_year_emission(self.report, 2004), self.report.year_emission(2004))
+        self.assertAlmostEqual(aggregates.strategy_year_delta(self.strategy, 2004), self.strategy.year_delta_emission(2004))
+        self.assertStoredEqualsComputed()
+
+        # Outside of the horizon
+        self.assertEqual(aggregates.report_year_emission(self.report, 2020), self.report.year_emission(2020))
@@ -0,0 +1,113 @@
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from coreapp import attribution, engine, frames
+from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class AttributionTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+        self.report = Report.objects.create(name='Report 1')
+        source = Source.objects.create(report=self.report, value=10, emission_factor=2, lifetime=5, acquisition_year=2016)
+        other = Source.objects.create(report=self.report, value=3, emission_factor=1)
+        negative = Source.objects.create(report=self.report, value=-2, emission_factor=3)
+        Source.objects.create(report=self.report, value=7, emission_factor=1) # not modified
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        self.modifications = [
+            ReductionModification.objects.create(strategy=self.strategy, source=source, value_modification=-4, modification_start_year=2018),
+            ReductionModification.objects.create(strategy=self.strategy, source=source, emission_factor_change=1, modification_start_year=2020),
+            ReductionModification.objects.create(strategy=self.strategy, source=source, value_modification=-20, modification_start_year=2020),
+            ReductionModification.objects.create(strategy=self.strategy, source=other, value_modification=-1, modification_start_year=2017),
+            ReductionModification.objects.create(strategy=self.strategy, source=negative, emission_factor_change=1, modification_start_year=2019),
+        ]
+        Source.objects.create(strategy=self.strategy, value=1, emission_factor=1, acquisition_year=2019)
+
+    def deltas(self) -> list[float]:
+        return frames.ReportFrame.load(self.report.pk).range_delta_emission(self.strategy.pk, 2015, 2025)
+
+    def test_attribution(self):
+        result = attribution.compute_attribution(self.strategy, 2015, 2025)
+        delta = self.deltas()
+        self.assertEqual([year['delta_total_emission'] for year in result['years']], delta)
+        rows = {row['id']: row for row in result['modifications']}
+        self.assertEqual(set(rows), {modification.pk for modification in self.modifications})
+
+        # The marginal contributions add up to the delta, but the negative emissions and the new sources
+        frame = frames.ReportFrame.load(self.report.pk)
+        years = engine.year_range(2015, 2025)
+        expected = (frame.sources.years_unmodified_delta(years)
+                    - frame.strategies[self.strategy.pk].new_sources.years_emission(years)).tolist()
+        for i, year in enumerate(result['years']):
+            self.assertAlmostEqual(year['unattributed'], expected[i])
+            self.assertAlmostEqual(year['unattributed'] + sum(row['years'][i]['marginal'] for row in rows.values()), delta[i])
+
+        # Leave-one-out: the delta lost without the modification
+        for modification in self.modifications:
+            with transaction.atomic():
+                ReductionModification.objects.filter(pk=modification.pk).delete()
+                without = self.deltas()
+                transaction.set_rollback(True)
+            for i, year in enumerate(rows[modification.pk]['years']):
+                self.assertAlmostEqual(year['leave_one_out'], delta[i] - without[i])
+
+        # Marginal: the first modification of a source against the source without modification
+        first = rows[self.modifications[0].pk]
+        with transaction.atomic():
+            ReductionModification.objects.filter(pk__in=[self.modifications[1].pk, self.modifications[2].pk]).delete()
+            with_first = self.deltas()
+            ReductionModification.objects.filter(pk=self.modifications[0].pk).delete()
+            unmodified = self.deltas()
+            transaction.set_rollback(True)
+        for i, year in enumerate(first['years']):
+            self.assertAlmostEqual(year['marginal'], with_first[i] - unmodified[i])
+
+        # Ranked by marginal contribution over the range
+        totals = [row['marginal_total'] for row in result['modifications']]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+        self.assertEqual([row['rank'] for row in result['modifications']], list(range(1, 6)))
+        self.assertAlmostEqual(result['modifications'][-1]['cumulative_marginal_total'], sum(totals))
+
+    def test_variant_changes(self):
+        # Skewed sources, each variant against the engine evaluating it alone
+        rng = np.random.default_rng(3)
+        sizes = [1, 2, 40, 3]
+        group_start = np.repeat(np.cumsum([0] + sizes[:-1]), sizes)
+        count = len(group_start)
+        start_year = np.concatenate([np.sort(rng.integers(2000, 2030, size)) for size in sizes])
+        value = rng.choice([np.nan, -1.0, 2.0], count)
+        emission_factor = rng.choice([np.nan, 0.0, 0.5, 3.0], count)
+        lifetime = np.repeat(rng.choice([0, 3, 10], len(sizes)), sizes)
+        years = engine.year_range(1998, 2040)
+        prefix, without = attribution.variant_changes(group_start, start_year, value, emission_factor, lifetime, years)
+
+        for i in range(count):
+            end = group_start[i] + sizes[list(np.unique(group_start)).index(group_start[i])]
+            for members, changes in [(np.arange(group_start[i], i + 1), prefix),
+                                     (np.setdiff1d(np.arange(group_start[i], end), [i]), without)]:
+                modifications = engine.ModificationColumns.from_arrays(1, np.zeros(len(members)), start_year[members],
+                                                                       np.arange(len(members)), value[members], emission_factor[members])
+                value_change, factor = modifications.changes(slice(0, 1), years, lifetime[i:i + 1])
+                np.testing.assert_allclose(changes[0][i], value_change[0])
+                np.testing.assert_allclose(changes[1][i], factor[0])
+
+    def test_attribution_view(self):
+        url = f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/attribution/'
+        response = self.client.get(f'{url}?from=2015&to=2025')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['modifications']), 5)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_400_BAD_REQUEST)
+
+        empty = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{empty.pk}/attribution/?from=2015&to=2016')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['modifications'], [])
+        # The negative source: -2 x 3
+        self.assertEqual([year['unattributed'] for year in response.data['years']], [-6, -6])
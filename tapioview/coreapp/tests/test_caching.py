@@ -0,0 +1,80 @@
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from coreapp import caching
+from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
+# from django.test import tag
+
+
+class CachingTest(TestCase):
+
+    def setUp(self):
+        self.report = Report.objects.create(name='Report 1')
+        self.source = Source.objects.create(report=self.report, value=10, emission_factor=10)
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+
+    def test_cached_computation(self):
+        self.assertEqual(self.report.year_emission(2020), 100)
+
+        # Second read served from the cache, with the revision query only
+        stats = caching.cache_stats()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.report.year_emission(2020), 100)
+        self.assertEqual(caching.cache_stats()['hits'], stats['hits'] + 1)
+
+        # Other arguments are other entries
+        self.assertEqual(self.report.year_emission(2021), 100)
+        self.assertEqual(caching.cache_stats()['misses'], stats['misses'] + 1)
+
+    def test_revision_changed_by_another_process(self):
+        self.assertEqual(self.report.year_emission(2020), 100)
+        # A write of another process: only the database is changed, not the cache of this one
+        Source.objects.filter(pk=self.source.pk).update(value=20)
+        Report.objects.filter(pk=self.report.pk).update(revision=caching.new_revision())
+        self.assertEqual(self.report.year_emission(2020), 200)
+
+    def test_revision_bumped(self):
+        revision = caching.report_revision(self.report.pk)
+        self.assertEqual(self.report.year_emission(2020), 100)
+        self.assertEqual(self.strategy.year_delta_emission(2020), 0)
+
+        # Source
+        Source.objects.create(report=self.report, value=1, emission_factor=10)
+        self.assertNotEqual(caching.report_revision(self.report.pk), revision)
+        self.assertEqual(self.report.year_emission(2020), 110)
+
+        self.source.value = 20
+        self.source.save()
+        self.assertEqual(self.report.year_emission(2020), 210)
+
+        # Modification
+        revision = caching.report_revision(self.report.pk)
+        modification = ReductionModification.objects.create(strategy=self.strategy, source=self.source, emission_factor_change=5, modification_start_year=2020)
+        self.assertNotEqual(caching.report_revision(self.report.pk), revision)
+        self.assertEqual(self.strategy.year_delta_emission(2020), 100)
+
+        modification.delete()
+        self.assertEqual(self.strategy.year_delta_emission(2020), 0)
+
+        # Strategy source
+        Source.objects.create(strategy=self.strategy, value=1, emission_factor=10)
+        self.assertEqual(self.strategy.year_delta_emission(2020), -10)
+
+        Source.objects.filter(strategy=self.strategy).delete()
+        self.assertEqual(self.strategy.year_delta_emission(2020), 0)
+
+    def test_reused_report_id(self):
+        self.assertEqual(self.report.year_emission(2020), 100)
+        report_id = self.report.pk
+        self.report.delete()
+
+        report = Report.objects.create(pk=report_id, name='Report 2')
+        self.assertEqual(report.year_emission(2020), 0)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': '/tmp/tapioview_test_cache'}})
+    def test_file_based_cache(self):
+        caches['default'].clear()
+        self.assertEqual(self.report.year_emission(2020), 100)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.report.year_emission(2020), 100)
+        caches['default'].clear()
@@ -0,0 +1,106 @@
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from coreapp import caching, columnstore, comparison, frames
+from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
+# from django.test import tag
+
+
+class ColumnStoreTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(FRAME_STORE_DIR=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.report = Report.objects.create(name='Report 1')
+        self.source = Source.objects.create(report=self.report, value=10, emission_factor=2, lifetime=5, acquisition_year=2016)
+        Source.objects.create(report=self.report, value=3, emission_factor=1)
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, value_modification=-4, modification_start_year=2018)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, emission_factor_change=1, modification_start_year=2020)
+        self.other_strategy = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        Source.objects.create(strategy=self.other_strategy, value=1, emission_factor=1, acquisition_year=2019)
+
+    def revision_dirs(self) -> list[str]:
+        return sorted(path.name for path in (self.directory / str(self.report.pk)).iterdir())
+
+    def assert_same_frame(self, frame: frames.ReportFrame):
+        expected = frames.ReportFrame.load(self.report.pk)
+        self.assertEqual(frame.range_emission(2010, 2030), expected.range_emission(2010, 2030))
+        self.assertEqual(frame.range_deltas(2010, 2030), expected.range_deltas(2010, 2030))
+        self.assertEqual(frame.source_emissions(2020), expected.source_emissions(2020))
+
+    def test_publish_and_map(self):
+        frame = frames.load_frames([self.report.pk])[self.report.pk]
+        self.assert_same_frame(frame)
+        self.assertEqual(self.revision_dirs(), [str(caching.report_revision(self.report.pk))])
+
+        # Then read from the files, with the revision query only
+        with self.assertNumQueries(1):
+            frame = frames.load_frames([self.report.pk])[self.report.pk]
+        self.assertFalse(frame.sources.value.flags.writeable)
+        self.assert_same_frame(frame)
+        frame = frames.load_frames([self.report.pk], strategy_ids=[self.strategy.pk])[self.report.pk]
+        self.assertEqual(list(frame.strategies), [self.strategy.pk])
+
+        # The comparison reads the same frame
+        with self.settings(FRAME_STORE_DIR=None):
+            expected = comparison.compute_comparison(self.report, 2015, 2025)
+        self.assertEqual(comparison.compute_comparison(self.report, 2015, 2025), expected)
+
+    def test_new_revision(self):
+        frames.load_frames([self.report.pk])
+        old_revision = caching.report_revision(self.report.pk)
+
+        self.source.value = 20
+        self.source.save()
+        frame = frames.load_frames([self.report.pk])[self.report.pk]
+        self.assertAlmostEqual(frame.year_emission(2020), 11.0)
+        # The previous revision is kept until pruned: a slow process may publish an older one last
+        self.assertNotEqual(caching.report_revision(self.report.pk), old_revision)
+        self.assertEqual(sorted(self.revision_dirs()), sorted([str(old_revision), str(caching.report_revision(self.report.pk))]))
+        self.assertEqual(columnstore.prune(), 1)
+        self.assertEqual(self.revision_dirs(), [str(caching.report_revision(self.report.pk))])
+
+        # A revision published by another process is kept
+        revision = caching.report_revision(self.report.pk)
+        self.assertFalse(columnstore.publish(self.report.pk, revision, *frame.to_arrays()))
+        self.assert_same_frame(frames.load_frames([self.report.pk])[self.report.pk])
+
+    def test_changed_while_loading(self):
+        # A write between the revision read and the load: the rows are not published under the old revision
+        load_reports = frames.load_reports
+
+        def load_and_write(report_ids):
+            data = load_reports(report_ids)
+            self.source.value = 30
+            self.source.save()
+            return data
+
+        with mock.patch('coreapp.frames.load_reports', load_and_write):
+            frames.load_frames([self.report.pk])
+        self.assertFalse((self.directory / str(self.report.pk)).exists())
+        frame = frames.load_frames([self.report.pk])[self.report.pk]
+        self.assertAlmostEqual(frame.year_emission(2020), 15.0)
+        self.assertEqual(self.revision_dirs(), [str(caching.report_revision(self.report.pk))])
+
+    def test_prune(self):
+        frames.load_frames([self.report.pk])
+        self.assertEqual(columnstore.prune(), 0)
+        self.assertEqual(len(self.revision_dirs()), 1)
+        self.assertEqual(columnstore.prune(max_age=0), 1)
+        self.assertEqual(self.revision_dirs(), [])
+
+        frames.load_frames([self.report.pk])
+        report_id = self.report.pk
+        self.report.delete()
+        output = StringIO()
+        call_command('prune_frame_store', stdout=output)
+        self.assertIn('1 revisions removed', output.getvalue())
+        self.assertFalse((self.directory / str(report_id)).exists())
@@ -0,0 +1,57 @@
+import json
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from coreapp import aggregates
+from coreapp.models import Report, ReductionStrategy, ReductionModification
+# from django.test import tag
+
+
+class ImportSourcesCommandTest(TestCase):
+
+    def test_import_sources(self):
+        report = Report.objects.create(name='Report 1')
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as upload:
+            upload.write(b'{"value": 1, "emission_factor": 10}\n{"value": 2, "emission_factor": 10, "lifetime": 2}\n')
+            upload.flush()
+
+            output = StringIO()
+            call_command('import_sources', upload.name, report=report.pk, stdout=output, stderr=StringIO())
+            self.assertIn('1 sources imported, 1 rows rejected', output.getvalue())
+            self.assertEqual(report.year_emission(2020), 10)
+
+            with self.assertRaises(CommandError):
+                call_command('import_sources', upload.name, report=0, stdout=StringIO())
+
+
+class GenerateDatasetCommandTest(TestCase):
+
+    def test_generate_dataset(self):
+        output = StringIO()
+        call_command('generate_dataset', sources=200, strategies=2, modifications=2, stdout=output)
+        report = Report.objects.get()
+        self.assertIn(f'Report {report.pk} generated', output.getvalue())
+        self.assertEqual(report.sources.count(), 200)
+        self.assertEqual(ReductionModification.objects.filter(strategy__report=report).count(), 800)
+
+        # The stored totals are refreshed after the bulk inserts
+        strategy = report.reductionStrategies.first()
+        self.assertEqual(strategy.sourcesStrategy.count(), 2)
+        self.assertAlmostEqual(aggregates.report_year_emission(report, 2020), Report.year_emission.__wrapped__(report, 2020))
+        self.assertAlmostEqual(aggregates.strategy_year_delta(strategy, 2020),
+                               ReductionStrategy.range_delta_emission.__wrapped__(strategy, 2020, 2020)[0])
+
+
+class BenchmarkCommandTest(TestCase):
+
+    def test_benchmark(self):
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark', sizes=[50], repeat=1, output=output.name, stdout=StringIO())
+            results = json.load(output)
+
+        self.assertEqual(results['parameters']['sizes'], [50])
+        self.assertIn('Report.year_emission', [result['name'] for result in results['results']])
+        # The generated reports are rolled back
+        self.assertFalse(Report.objects.exists())
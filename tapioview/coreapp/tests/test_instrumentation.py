@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from coreapp.models import Report, Source, ReductionStrategy
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class ServerTimingTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.report = Report.objects.create(name='Report 1')
+        Source.objects.create(report=self.report, value=1, emission_factor=10)
+        ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing(self):
+        response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/compare/?from=2020&to=2030')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        metrics = {metric.split(';')[0]: metric for metric in response.headers['Server-Timing'].split(', ')}
+        self.assertEqual(set(metrics), {'db', 'emission', 'serialize', 'total'})
+        self.assertRegex(metrics['db'], r'^db;dur=[0-9.]+;desc="[1-9][0-9]* queries"$')
+        self.assertRegex(metrics['emission'], r'^emission;dur=[0-9.]+$')
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0)
+    def test_slow_request_logged(self):
+        with self.assertLogs('coreapp.performance', 'WARNING') as logs:
+            self.client.get(f'/reports/{self.report.pk}/?year=2020')
+        self.assertIn(f'GET /reports/{self.report.pk}/?year=2020', logs.output[0])
+        self.assertIn('queries', logs.output[0])
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=None)
+    def test_slow_request_disabled(self):
+        with self.assertNoLogs('coreapp.performance'):
+            self.client.get(f'/reports/{self.report.pk}/?year=2020')
@@ -0,0 +1,167 @@
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from coreapp import jobs
+from coreapp.models import ComputationJob, Portfolio, Report, Source, ReductionStrategy, ReductionModification
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class ComputationJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+        self.report = Report.objects.create(name='Report 1')
+        source = Source.objects.create(report=self.report, value=10, emission_factor=2, lifetime=5, acquisition_year=2016)
+        Source.objects.create(report=self.report, value=3, emission_factor=1)
+        strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=-4, modification_start_year=2018)
+        self.portfolio = Portfolio.objects.create(name='Group')
+        self.portfolio.reports.add(self.report)
+
+    def run_workers(self) -> str:
+        output = StringIO()
+        call_command('run_workers', '--workers', '1', '--once', stdout=output)
+        return output.getvalue()
+
+    def submit(self, kind: str, **data) -> dict:
+        response = self.client.post('/jobs/', {'kind': kind, **data}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        self.assertEqual(response.data['status'], ComputationJob.PENDING)
+        return response.data
+
+    def test_jobs(self):
+        submitted = {
+            ComputationJob.REPORT: (self.submit(ComputationJob.REPORT, report=self.report.pk, parameters={'year': 2020}),
+                                    f'/reports/{self.report.pk}/?year=2020'),
+            ComputationJob.TIMESERIES: (self.submit(ComputationJob.TIMESERIES, report=self.report.pk,
+                                                    parameters={'from': 2015, 'to': 2025}),
+                                        f'/reports/{self.report.pk}/timeseries/?from=2015&to=2025'),
+            ComputationJob.COMPARE: (self.submit(ComputationJob.COMPARE, report=self.report.pk,
+                                                 parameters={'from': 2015, 'to': 2025}),
+                                     f'/reports/{self.report.pk}/reductionStrategies/compare/?from=2015&to=2025'),
+            ComputationJob.PORTFOLIO: (self.submit(ComputationJob.PORTFOLIO, portfolio=self.portfolio.pk,
+                                                   parameters={'from': 2015, 'to': 2025}),
+                                       f'/portfolios/{self.portfolio.pk}/emissions/?from=2015&to=2025'),
+        }
+        export = self.submit(ComputationJob.EXPORT, report=self.report.pk, parameters={'year': 2020})
+
+        response = self.client.get(f'/jobs/{export["id"]}/result/')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data, {'status': ComputationJob.PENDING})
+
+        self.assertIn('5 jobs run', self.run_workers())
+
+        # Same results as the endpoints
+        for kind, (job, url) in submitted.items():
+            with self.subTest(kind=kind):
+                response = self.client.get(f'/jobs/{job["id"]}/')
+                self.assertEqual(response.data['status'], ComputationJob.DONE)
+                self.assertIsNotNone(response.data['finished_at'])
+                self.assertNotIn('result', response.data)
+                response = self.client.get(f'/jobs/{job["id"]}/result/')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response.json(), self.client.get(url).json())
+
+        response = self.client.get(f'/jobs/{export["id"]}/result/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = b''.join(self.client.get(f'/reports/{self.report.pk}/export/?year=2020').streaming_content).splitlines()
+        self.assertEqual(len(response.json()), len(lines))
+
+    def test_failed_job(self):
+        job = ComputationJob.objects.create(kind=ComputationJob.TIMESERIES, report=self.report, parameters={'from': 'x'})
+        with self.assertLogs('coreapp.jobs', level='ERROR'):
+            self.run_workers()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComputationJob.FAILED)
+
+        response = self.client.get(f'/jobs/{job.pk}/result/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('ValidationError', response.data['error'])
+
+    def test_invalid_jobs(self):
+        invalid = [
+            {'kind': 'unknown', 'report': self.report.pk},
+            {'kind': ComputationJob.COMPARE},
+            {'kind': ComputationJob.COMPARE, 'report': self.report.pk, 'parameters': {'from': 2025, 'to': 2015}},
+            {'kind': ComputationJob.COMPARE, 'report': self.report.pk, 'parameters': [2015, 2025]},
+            {'kind': ComputationJob.PORTFOLIO, 'report': self.report.pk, 'parameters': {'from': 2015, 'to': 2025}},
+            {'kind': ComputationJob.PORTFOLIO, 'portfolio': self.portfolio.pk, 'report': self.report.pk,
+             'parameters': {'from': 2015, 'to': 2025}},
+        ]
+        for data in invalid:
+            with self.subTest(data=data):
+                response = self.client.post('/jobs/', data, format='json')
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(ComputationJob.objects.exists())
+
+        self.client.logout()
+        response = self.client.post('/jobs/', {'kind': ComputationJob.REPORT, 'report': self.report.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_claim(self):
+        first = ComputationJob.objects.create(kind=ComputationJob.REPORT, report=self.report)
+        second = ComputationJob.objects.create(kind=ComputationJob.REPORT, report=self.report)
+
+        # Oldest first, never twice
+        self.assertEqual(jobs.claim_next('worker 1').pk, first.pk)
+        claimed = jobs.claim_next('worker 2')
+        self.assertEqual(claimed.pk, second.pk)
+        self.assertEqual(claimed.status, ComputationJob.RUNNING)
+        self.assertEqual(claimed.worker, 'worker 2')
+        self.assertIsNone(jobs.claim_next('worker 3'))
+
+        # The jobs of a dead worker (without heartbeat) are queued again, not the long ones still beating
+        past = timezone.now() - timedelta(hours=2)
+        ComputationJob.objects.filter(pk=first.pk).update(started_at=past, heartbeat_at=past)
+        ComputationJob.objects.filter(pk=second.pk).update(started_at=past)
+        self.assertEqual(jobs.requeue_stale(3600), 1)
+        self.assertEqual(jobs.claim_next('worker 3').pk, first.pk)
+
+    def test_requeued_job(self):
+        ComputationJob.objects.create(kind=ComputationJob.REPORT, report=self.report, parameters={'year': 2020})
+        lost = jobs.claim_next('worker 1')
+        past = timezone.now() - timedelta(hours=2)
+        ComputationJob.objects.filter(pk=lost.pk).update(heartbeat_at=past)
+        self.assertEqual(jobs.requeue_stale(3600), 1)
+        claimed = jobs.claim_next('worker 2')
+
+        # The first worker finishing late does not overwrite the job of the second one
+        with self.assertLogs('coreapp.jobs', level='WARNING'):
+            self.assertFalse(jobs.run_job(lost))
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, ComputationJob.RUNNING)
+        self.assertEqual(claimed.worker, 'worker 2')
+        self.assertTrue(jobs.run_job(claimed))
+        claimed.refresh_from_db()
+        self.assertEqual(claimed.status, ComputationJob.DONE)
+
+    def test_database_error(self):
+        job = ComputationJob.objects.create(kind=ComputationJob.REPORT, report=self.report, parameters={'year': 2020})
+        # The result cannot be stored: the worker goes on, the job stays running until queued again
+        with mock.patch.object(jobs, 'running', side_effect=DatabaseError('database is locked')), \
+                self.assertLogs('coreapp.jobs', level='ERROR'):
+            self.assertIn('1 jobs run', self.run_workers())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ComputationJob.RUNNING)
+
+
+class HeartbeatTest(TransactionTestCase):
+    def test_heartbeat(self):
+        report = Report.objects.create(name='Report 1')
+        ComputationJob.objects.create(kind=ComputationJob.REPORT, report=report)
+        job = jobs.claim_next('worker 1')
+        claimed_at = job.heartbeat_at
+        with jobs.heartbeat(job, interval=0.01):
+            time.sleep(0.2)
+        job.refresh_from_db()
+        self.assertGreater(job.heartbeat_at, claimed_at)
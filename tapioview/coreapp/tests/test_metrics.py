@@ -0,0 +1,116 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from coreapp import metrics
+from coreapp.models import Report, Source
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.registry.clear()
+        self.client = APIClient()
+        self.report = Report.objects.create(name='Report 1')
+        Source.objects.create(report=self.report, value=1, emission_factor=10)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+        self.staff = User.objects.create_user(username='staff', password='testpassword', is_staff=True)
+
+    def get_metrics(self) -> dict:
+        self.client.force_login(self.staff)
+        response = self.client.get('/metrics')
+        self.client.logout()
+        self.client.force_authenticate(self.user)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = [line for line in response.content.decode().splitlines() if not line.startswith('#')]
+        return dict(line.rsplit(' ', 1) for line in lines)
+
+    def test_metrics(self):
+        self.client.get(f'/reports/{self.report.pk}/?year=2020')
+        self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2020&to=2030')
+        self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2020&to=2030')
+
+        values = self.get_metrics()
+        labels = 'action="timeseries",viewset="ReportViewSet"'
+        self.assertEqual(values[f'tapioview_request_duration_seconds_count{{{labels}}}'], '2')
+        self.assertEqual(values[f'tapioview_request_duration_seconds_bucket{{{labels},le="+Inf"}}'], '2')
+        self.assertEqual(values[f'tapioview_response_size_bytes_count{{{labels}}}'], '2')
+        self.assertIn('tapioview_request_duration_seconds_count{action="retrieve",viewset="ReportViewSet"}', values)
+        computations = 'tapioview_emission_computations_total{method="Report.range_emission"}'
+        hits = 'tapioview_computation_cache_requests_total{result="hit"}'
+        self.assertIn(computations, values)
+
+        # A cache hit, without computation
+        self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2020&to=2030')
+        after = self.get_metrics()
+        self.assertEqual(after[computations], values[computations])
+        self.assertEqual(float(after[hits]), float(values[hits]) + 1)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics_authorization(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.logout()
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer other').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, status.HTTP_200_OK)
+
+    def test_metrics_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # Counts published by another worker process
+            other = {'counters': [[metrics.COMPUTATIONS, [['method', 'Report.year_emission']], 5]],
+                     'histograms': [[metrics.REQUEST_DURATION, [['action', 'list'], ['viewset', 'ReportViewSet']],
+                                     [1] + [0] * len(metrics.LATENCY_BUCKETS) + [0.001]]]}
+            Path(directory, f'{metrics.FILE_PREFIX}{socket.gethostname()}_{os.getppid()}_0.json').write_text(json.dumps(other))
+
+            self.client.get('/reports/')
+            values = self.get_metrics()
+            # A process reusing the PID of this one writes to another file
+            file_name = metrics.registry.file_name()
+            metrics.registry.pid = None
+            self.assertNotEqual(metrics.registry.file_name(), file_name)
+
+        labels = 'action="list",viewset="ReportViewSet"'
+        self.assertEqual(values[f'tapioview_request_duration_seconds_count{{{labels}}}'], '2')
+        self.assertEqual(values['tapioview_emission_computations_total{method="Report.year_emission"}'], '5')
+
+    def test_exited_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            snapshot = {'counters': [[metrics.COMPUTATIONS, [['method', 'Report.year_emission']], 5]],
+                        'histograms': [[metrics.REQUEST_DURATION, [['action', 'list'], ['viewset', 'ReportViewSet']],
+                                        [1] + [0] * len(metrics.LATENCY_BUCKETS) + [0.001]]]}
+            exited = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'], capture_output=True, text=True)
+            host = socket.gethostname()
+            names = [f'{metrics.FILE_PREFIX}{host}_{int(exited.stdout)}_0.json', # exited
+                     f'{metrics.FILE_PREFIX}{host}_{os.getpid()}_0.json', # same PID, started before this process
+                     f'{metrics.FILE_PREFIX}{host}_{os.getppid()}_0.json', # running
+                     f'{metrics.FILE_PREFIX}other-host_{int(exited.stdout)}_0.json'] # not checked from this host
+            for name in names:
+                Path(directory, name).write_text(json.dumps(snapshot))
+
+            self.client.get('/reports/')
+            first = self.get_metrics()
+            # Folded into one file, the totals unchanged
+            remaining = sorted(path.name for path in Path(directory).glob('*.json'))
+            self.assertEqual(remaining, sorted([metrics.EXITED_FILE, metrics.registry.file_name(), *names[2:]]))
+            second = self.get_metrics()
+            self.assertEqual(first['tapioview_emission_computations_total{method="Report.year_emission"}'], '20')
+            self.assertEqual(second['tapioview_emission_computations_total{method="Report.year_emission"}'], '20')
+            labels = 'action="list",viewset="ReportViewSet"'
+            self.assertEqual(first[f'tapioview_request_duration_seconds_count{{{labels}}}'], '5')
+
+            # A fold interrupted before the removal of the files does not count them twice
+            Path(directory, names[0]).write_text(json.dumps(snapshot))
+            exited_file = Path(directory, metrics.EXITED_FILE)
+            exited_file.write_text(json.dumps({**json.loads(exited_file.read_text()), 'folded': [names[0]]}))
+            self.assertEqual(self.get_metrics()['tapioview_emission_computations_total{method="Report.year_emission"}'], '20')
+            self.assertFalse(Path(directory, names[0]).exists())
@@ -1,4 +1,7 @@
+import random
 from django.test import TestCase
+from coreapp import comparison, datasets, engine, frames
+from coreapp.timeline import ModificationTimeline
 from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
 # from django.test import tag
 
@@ -16,6 +19,50 @@ class ReportModelTest(TestCase):
         # Two sources
         Source.objects.create(report=report, value=1, emission_factor=10)
         self.assertEqual(report.year_emission(2020),20)
+
+    def test_range_emission_report(self):
+        # No source
+        report = Report.objects.create(name='Report 1')
+        self.assertEqual(report.range_emission(2020, 2021),[0, 0])
+
+        # Same result as year_emission for each year
+        Source.objects.create(report=report, value=1, emission_factor=10)
+        Source.objects.create(report=report, value=2, emission_factor=8, acquisition_year=2002)
+        Source.objects.create(report=report, value=3, emission_factor=7, lifetime=5, acquisition_year=2000)
+        Source.objects.create(report=report, value=-1, emission_factor=3, lifetime=3, acquisition_year=2004)
+        strategy = ReductionStrategy.objects.create(report=report)
+        Source.objects.create(strategy=strategy, value=100, emission_factor=100)
+
+        emissions = report.range_emission(1995, 2010)
+        self.assertEqual(len(emissions), 16)
+        for year, emission in zip(range(1995, 2011), emissions):
+            self.assertAlmostEqual(emission, report.year_emission(year))
+
+
+    def test_sql_year_emission_report(self):
+        reports = [Report.objects.create(name='Report 1'), Report.objects.create(name='Report 2'), Report.objects.create(name='Empty')]
+        sources = [
+            Source.objects.create(report=reports[0], value=1, emission_factor=10),
+            Source.objects.create(report=reports[0], value=2, emission_factor=8, acquisition_year=2002),
+            Source.objects.create(report=reports[0], value=3, emission_factor=7, lifetime=5, acquisition_year=2000),
+            Source.objects.create(report=reports[1], value=-1, emission_factor=3, lifetime=3, acquisition_year=2004),
+            Source.objects.create(report=reports[1], value=7, emission_factor=0.5, lifetime=0, acquisition_year=2006),
+        ]
+        strategy = ReductionStrategy.objects.create(report=reports[0])
+        Source.objects.create(strategy=strategy, value=100, emission_factor=100)
+
+        # Same results as the Python implementation
+        for year in range(1995, 2015):
+            annotated = dict(Source.objects.with_year_emission(year).values_list('id', 'year_emission_value'))
+            for source in sources:
+                self.assertAlmostEqual(annotated[source.id], source.year_emission(year))
+
+            totals = Source.objects.report_year_emissions(year)
+            for report in Report.objects.with_year_emission(year):
+                expected = sum(source.year_emission(year) for source in report.sources.all())
+                self.assertAlmostEqual(report.computed_year_emission, expected)
+                self.assertAlmostEqual(totals.get(report.id, 0), expected)
+                self.assertAlmostEqual(report.sources.all().total_year_emission(year), expected)
         
 
 class SourceModelTest(TestCase):
@@ -96,6 +143,112 @@ class ReductionStrategyModelTest(TestCase):
         Source.objects.create(strategy=strategy, value=10, emission_factor=10)
         self.assertEqual(strategy.year_delta_emission(2020),0)
 
+    def test_year_delta_emission_other_strategy(self):
+        report = Report.objects.create(name='Report 1')
+        source = Source.objects.create(report=report, value=10, emission_factor=10)
+        strategy1 = ReductionStrategy.objects.create(report=report)
+        strategy2 = ReductionStrategy.objects.create(report=report)
+        ReductionModification.objects.create(strategy=strategy1, source=source, emission_factor_change=5,modification_start_year=2020)
+        ReductionModification.objects.create(strategy=strategy2, source=source, value_modification=-2,modification_start_year=2020)
+
+        # Only the modifications of the evaluated strategy are applied
+        self.assertEqual(strategy1.year_delta_emission(2020),50)
+        self.assertEqual(strategy2.year_delta_emission(2020),20)
+        self.assertEqual(source.year_delta_emission(2020, strategy1),50)
+        self.assertEqual(source.year_delta_emission(2020, strategy2),20)
+
+
+    def delta_parity_report(self) -> Report:
+        """
+        A generated report, with the edge cases of the delta rules
+        """
+        report = datasets.generate_report(sources=60, strategies=2, modifications=3, seed=1)
+        # Falsy changes are ignored by the rules
+        source = report.sources.filter(acquisition_year__isnull=True).first()
+        strategy = report.reductionStrategies.first()
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=0,
+                                             emission_factor_change=0, modification_start_year=2030)
+        # Increases of an amortized source are ignored after the lifetime of the first modification
+        source = Source.objects.create(report=report, value=4, emission_factor=2, lifetime=3, acquisition_year=2001)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=2,
+                                             emission_factor_change=3, modification_start_year=2002)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=5,
+                                             emission_factor_change=7, modification_start_year=2004)
+        return report
+
+    def test_sql_year_delta_emission_strategy(self):
+        report = self.delta_parity_report()
+
+        # Same results as the Python implementation
+        for strategy in report.reductionStrategies.all():
+            deltas = strategy.range_delta_emission(1998, 2036)
+            for year, delta in zip(range(1998, 2037), deltas):
+                if year % 2 == 0:
+                    sql_delta = ReductionStrategy.objects.get(pk=strategy.pk).year_delta_emission(year)
+                    self.assertAlmostEqual(sql_delta, delta, places=6)
+
+    def test_vectorized_year_delta_emission_strategy(self):
+        report = self.delta_parity_report()
+        data = frames.load_reports([report.pk])[report.pk]
+        result = comparison.comparison_from_data(data, 1998, 2036)
+
+        # Same results as the Python implementation
+        for strategy, strategy_result in zip(report.reductionStrategies.all(), result['strategies']):
+            deltas = strategy.range_delta_emission(1998, 2036)
+            for delta, cell in zip(deltas, strategy_result['years']):
+                self.assertAlmostEqual(cell['delta_total_emission'], delta, places=6)
+
+
+    def test_report_frame(self):
+        report = self.delta_parity_report()
+        frame = frames.ReportFrame.load(report.pk)
+
+        # Same results as the model instances
+        self.assertEqual(len(frame), report.sources.count())
+        for year, emission in zip(range(1998, 2037), frame.range_emission(1998, 2036)):
+            self.assertAlmostEqual(emission, report.year_emission(year), places=6)
+        self.assertAlmostEqual(frame.year_emission(2020), report.year_emission(2020), places=6)
+        self.assertEqual(frame.source_emissions(2020), {source.pk: source.year_emission(2020) for source in report.sources.all()})
+        for strategy in report.reductionStrategies.all():
+            deltas = strategy.range_delta_emission(1998, 2036)
+            for delta, frame_delta in zip(deltas, frame.range_delta_emission(strategy.pk, 1998, 2036)):
+                self.assertAlmostEqual(frame_delta, delta, places=6)
+            self.assertAlmostEqual(frame.year_delta_emission(strategy.pk, 2030), strategy.year_delta_emission(2030), places=6)
+        # Only some of the strategies
+        strategy = report.reductionStrategies.last()
+        self.assertEqual(list(frames.ReportFrame.load(report.pk, strategy_ids=[strategy.pk]).strategies), [strategy.pk])
+
+    def test_skewed_modifications(self):
+        # Most sources with one modification, one with hundreds: the modifications are not padded
+        rng = random.Random(1)
+        sources = []
+        for i in range(60):
+            acquisition_year = rng.choice([None, 2000, 2010])
+            sources.append(Source(id=i + 1, value=rng.choice([-3, 5, 10]), emission_factor=rng.choice([1, 2.5]),
+                                  lifetime=rng.choice([None, 4, 10]) if acquisition_year else None, acquisition_year=acquisition_year))
+        modifications = [ReductionModification(source_id=source.id, order=0, modification_start_year=rng.randint(1995, 2030),
+                                               value_modification=rng.choice([None, -2, 1]),
+                                               emission_factor_change=rng.choice([None, 0.5]))
+                         for source in sources[1:]]
+        modifications += [ReductionModification(source_id=sources[0].id, order=i, modification_start_year=rng.randint(1995, 2030),
+                                                value_modification=rng.choice([None, -0.1, 0.2]),
+                                                emission_factor_change=rng.choice([None, None, 0.5, 3]))
+                          for i in range(400)]
+
+        columns = engine.SourceColumns.from_rows((source.value, source.emission_factor, source.lifetime, source.acquisition_year)
+                                                 for source in sources)
+        modification_columns = engine.ModificationColumns.from_rows(len(sources), (
+            (modification.source_id - 1, modification.modification_start_year, modification.order,
+             modification.value_modification, modification.emission_factor_change) for modification in modifications))
+        self.assertEqual(len(modification_columns.start_years), len(modifications))
+
+        years = engine.year_range(1995, 2035)
+        deltas = columns.source_deltas(years, modification_columns)
+        timeline = ModificationTimeline(modifications)
+        for source, source_deltas in zip(sources, deltas.tolist()):
+            for year, delta in zip(years.tolist(), source_deltas):
+                self.assertAlmostEqual(delta, timeline.source_delta(source, year), places=6)
+
 
 class ReductionModificationModelTest(TestCase):
 
@@ -159,6 +312,26 @@ class ReductionModificationModelTest(TestCase):
         self.assertEqual(source.year_delta_emission(2030),0)
 
 
+    def test_year_delta_emission_timeline(self):
+        report = Report.objects.create(name='Report 1')
+        strategy = ReductionStrategy.objects.create(report=report)
+        source = Source.objects.create(report=report, value=10, emission_factor=10, lifetime=5, acquisition_year=2000)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=2, modification_start_year=2002)
+        ReductionModification.objects.create(strategy=strategy, source=source, emission_factor_change=8, modification_start_year=2004)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=1, emission_factor_change=6, modification_start_year=2006)
+
+        expected_deltas = {
+            2001: 0, # no modification yet
+            2002: 100/5-((10+2)*10/5),
+            2004: 100/5-((10+2)*8/5),
+            2005: 100/5-((10+2)*8/5),
+            2006: 0-((0+2+1)*6/5), # source amortized, modifications still running
+            2007: 0-((0+2+1)*6/5),
+            2008: 0, # first modification amortized
+        }
+        for year, delta in expected_deltas.items():
+            self.assertAlmostEqual(strategy.year_delta_emission(year), delta)
+
     def test_multiple_modification_order(self):
         report = Report.objects.create(name='Report 1')
         strategy = ReductionStrategy.objects.create(report=report)
@@ -28,6 +28,12 @@ class ReportViewTest(TestCase):
 
         response = self.client.get(f'/reports/{self.report.pk}/')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2020&to=2030')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        response = self.client.get(f'/reports/{self.report.pk}/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         
 
 class SourceViewTest(TestCase):
@@ -62,6 +68,9 @@ class SourceViewTest(TestCase):
         response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/sources/{self.source3.pk}/')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+        response = self.client.post(f'/reports/{self.report.pk}/sources/import/', b'value,emission_factor\n1,1\n', content_type='text/csv')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
         
 
 class ReductionStrategyViewTest(TestCase):
@@ -93,6 +102,9 @@ class ReductionStrategyViewTest(TestCase):
         response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/')
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
 
+        response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/compare/?from=2020&to=2030')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class ReductionModificationViewTest(TestCase):
     def setUp(self):
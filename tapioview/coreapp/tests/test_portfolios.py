@@ -0,0 +1,106 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from coreapp import caching, datasets, pools, portfolios
+from coreapp.models import Portfolio, Report, Source, ReductionStrategy, ReductionModification
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class PortfolioTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+        self.report1 = Report.objects.create(name='Company 1')
+        source = Source.objects.create(report=self.report1, value=10, emission_factor=2, lifetime=5, acquisition_year=2016)
+        Source.objects.create(report=self.report1, value=3, emission_factor=1)
+        strategy = ReductionStrategy.objects.create(name='Electrification', report=self.report1)
+        ReductionModification.objects.create(strategy=strategy, source=source, value_modification=-4, modification_start_year=2018)
+
+        self.report2 = Report.objects.create(name='Company 2')
+        source = Source.objects.create(report=self.report2, value=7, emission_factor=3, acquisition_year=2019)
+        strategy = ReductionStrategy.objects.create(name='Electrification', report=self.report2)
+        ReductionModification.objects.create(strategy=strategy, source=source, emission_factor_change=1, modification_start_year=2021)
+        strategy = ReductionStrategy.objects.create(name='Sobriety', report=self.report2)
+        Source.objects.create(strategy=strategy, value=1, emission_factor=1, acquisition_year=2022)
+
+        self.empty_report = Report.objects.create(name='Company 3')
+        self.portfolio = Portfolio.objects.create(name='Group')
+        self.portfolio.reports.add(self.report1, self.report2, self.empty_report)
+
+    def assert_emissions(self, data: dict):
+        reports = [self.report1, self.report2, self.empty_report]
+        self.assertEqual([report['id'] for report in data['reports']], [report.pk for report in reports])
+        self.assertEqual([strategy['name'] for strategy in data['strategies']], ['Electrification', 'Sobriety'])
+        self.assertEqual(data['strategies'][0]['reports'], [self.report1.pk, self.report2.pk])
+
+        for i, year in enumerate(range(2015, 2026)):
+            total = sum(report.year_emission(year) for report in reports)
+            self.assertEqual(data['years'][i]['year'], year)
+            self.assertAlmostEqual(data['years'][i]['total_emission'], total)
+            for report, report_data in zip(reports, data['reports']):
+                self.assertAlmostEqual(report_data['years'][i]['total_emission'], report.year_emission(year))
+
+            for strategy_data in data['strategies']:
+                delta = sum(strategy.year_delta_emission(year)
+                            for strategy in ReductionStrategy.objects.filter(name=strategy_data['name']))
+                self.assertAlmostEqual(strategy_data['years'][i]['delta_total_emission'], delta)
+                self.assertAlmostEqual(strategy_data['years'][i]['total_emission'], total - delta)
+
+    def test_same_name_strategies(self):
+        # Two alternative strategies of the same name in one report are not added up
+        source = self.report1.sources.first()
+        first = ReductionStrategy.objects.get(report=self.report1, name='Electrification')
+        other = ReductionStrategy.objects.create(name='Electrification', report=self.report1)
+        ReductionModification.objects.create(strategy=other, source=source, value_modification=-8, modification_start_year=2017)
+        data = portfolios.portfolio_emissions(self.portfolio, 2015, 2025)
+
+        groups = {strategy['name']: strategy for strategy in data['strategies']}
+        self.assertEqual(groups['Electrification']['reports'], [self.report1.pk, self.report2.pk])
+        self.assertEqual(groups['Electrification (2)']['reports'], [self.report1.pk])
+        electrification = ReductionStrategy.objects.get(report=self.report2, name='Electrification')
+        for i, year in enumerate(range(2015, 2026)):
+            self.assertAlmostEqual(groups['Electrification']['years'][i]['delta_total_emission'],
+                                   first.year_delta_emission(year) + electrification.year_delta_emission(year))
+            self.assertAlmostEqual(groups['Electrification (2)']['years'][i]['delta_total_emission'], other.year_delta_emission(year))
+
+    def test_portfolio_crud(self):
+        response = self.client.post('/portfolios/', {'name': 'Other group', 'reports': [self.report1.pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['reports'], [self.report1.pk])
+
+        response = self.client.get(f'/portfolios/{self.portfolio.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['reports'], [self.report1.pk, self.report2.pk, self.empty_report.pk])
+
+    def test_portfolio_emissions(self):
+        response = self.client.get(f'/portfolios/{self.portfolio.pk}/emissions/?from=2015&to=2025')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assert_emissions(response.data)
+
+        # The comparisons of the reports are cached: the portfolio, its reports and their revisions
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/portfolios/{self.portfolio.pk}/emissions/?from=2015&to=2025')
+        self.assert_emissions(response.data)
+
+        response = self.client.get(f'/portfolios/{self.portfolio.pk}/emissions/?from=2025&to=2015')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.client.logout()
+        response = self.client.get(f'/portfolios/{self.portfolio.pk}/emissions/?from=2015&to=2025')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(PORTFOLIO_POOL_MIN_ROWS=0, PORTFOLIO_WORKERS=2)
+    def test_portfolio_emissions_pool(self):
+        self.assertEqual(pools.pool_workers(3, 0, 'PORTFOLIO_POOL_MIN_ROWS', portfolios.DEFAULT_POOL_MIN_ROWS, 'PORTFOLIO_WORKERS'), 2)
+        self.assert_emissions(portfolios.portfolio_emissions(self.portfolio, 2015, 2025))
+
+    def test_generated_portfolio(self):
+        for seed in range(3):
+            self.portfolio.reports.add(datasets.generate_report(sources=40, strategies=2, seed=seed))
+        serial = portfolios.portfolio_emissions(self.portfolio, 2000, 2030)
+
+        caching.get_cache().clear()
+        with override_settings(PORTFOLIO_POOL_MIN_ROWS=0, PORTFOLIO_WORKERS=2):
+            self.assertEqual(portfolios.portfolio_emissions(self.portfolio, 2000, 2030), serial)
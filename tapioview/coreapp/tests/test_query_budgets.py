@@ -0,0 +1,157 @@
+from collections import Counter
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from coreapp import caching, snapshots
+from coreapp.models import ComputationJob, Portfolio, Report, Source, ReductionStrategy, ReductionModification
+from coreapp.urls import router
+from rest_framework.test import APIClient
+# from django.test import tag
+
+# Number of report sources of the seeded reports, the query counts must not change with it
+SIZES = [3, 30]
+STRATEGIES = 2
+# Frozen year of the seeded reports
+FROZEN_YEAR = 2015
+
+# Per route name: (method, query string, maximum number of queries, allowed duplicated queries)
+BUDGETS = {
+    'api-root': ('get', '', 0, 0),
+    'report-list': ('get', 'year=2020', 9, 0),
+    'report-detail': ('get', 'year=2020', 8, 0),
+    'report-timeseries': ('get', 'from=2015&to=2025', 4, 0),
+    # The revision (conditional GET, computation cache), the report, then the strategies, the report sources, the modifications and the new sources
+    'report-uncertainty': ('get', 'from=2015&to=2025&draws=100', 7, 0),
+    # The sources and modifications are streamed strategy by strategy: 5 + 2 per strategy
+    # (+1 frozen source emissions)
+    'report-export': ('get', 'year=2020', 10, 0),
+    'report-snapshot': ('get', f'year={FROZEN_YEAR}', 3, 0),
+    # +1 frozen source emissions
+    'source-list': ('get', 'year=2020', 3, 0),
+    'source-detail': ('get', 'year=2020', 3, 0),
+    # The stored totals of the report and of each strategy are rewritten, but the frozen year
+    'source-bulk-import': ('post', 'type=ndjson', 27, 0),
+    'sourceAdded-list': ('get', 'year=2020', 2, 0),
+    'sourceAdded-detail': ('get', 'year=2020', 2, 0),
+    'sourceAdded-bulk-import': ('post', 'type=ndjson', 16, 0),
+    'reductionStrategy-list': ('get', 'year=2020', 6, 0),
+    'reductionStrategy-detail': ('get', 'year=2020', 5, 0),
+    'reductionStrategy-compare': ('get', 'from=2015&to=2025', 7, 0),
+    'reductionStrategy-attribution': ('get', 'from=2015&to=2025', 8, 0),
+    'modification-list': ('get', '', 2, 0),
+    'modification-detail': ('get', '', 2, 0),
+    'portfolio-list': ('get', '', 3, 0),
+    'portfolio-detail': ('get', '', 2, 0),
+    'portfolio-emissions': ('get', 'from=2015&to=2025', 7, 0),
+    'job-list': ('get', '', 1, 0),
+    'job-detail': ('get', '', 1, 0),
+    'job-result': ('get', '', 1, 0),
+}
+
+IMPORTED_SOURCES = b'{"value": 1, "emission_factor": 10, "acquisition_year": 2020}\n{"value": 2, "emission_factor": 5, "lifetime": 4, "acquisition_year": 2018}\n'
+
+
+def seed_report(size: int) -> dict:
+    """
+    A report with `size` sources, STRATEGIES strategies modifying every source and
+    `size` new sources per strategy, frozen for FROZEN_YEAR. Returns the url kwargs of its objects
+    """
+    report = Report.objects.create(name=f'Report {size}')
+    sources = [Source.objects.create(report=report, value=i + 1, emission_factor=2,
+                                     lifetime=[None, 5][i % 2], acquisition_year=[None, 2016][i % 2])
+               for i in range(size)]
+    for index in range(STRATEGIES):
+        strategy = ReductionStrategy.objects.create(name=f'Strategy {index}', report=report)
+        added = [Source.objects.create(strategy=strategy, value=1, emission_factor=1, acquisition_year=2019)
+                 for _ in range(size)]
+        modifications = [ReductionModification.objects.create(strategy=strategy, source=source, value_modification=-0.5,
+                                                              emission_factor_change=1.5, modification_start_year=2018)
+                         for source in sources]
+    snapshots.freeze_report(report, FROZEN_YEAR)
+    portfolio = Portfolio.objects.create(name=f'Portfolio {size}')
+    portfolio.reports.add(report, Report.objects.create(name=f'Report {size} without sources'))
+    job = ComputationJob.objects.create(kind=ComputationJob.COMPARE, report=report, parameters={'from': 2015, 'to': 2025},
+                                        status=ComputationJob.DONE, result={'id': report.pk, 'strategies': []})
+    return {'report': report.pk,
+            'portfolio': portfolio.pk,
+            'job': job.pk,
+            'source': sources[0].pk,
+            'strategy': strategy.pk,
+            'sourceAdded': added[0].pk,
+            'modification': modifications[0].pk}
+
+
+def route_kwargs(name: str, objects: dict) -> dict:
+    """
+    Url kwargs of a route of coreapp.urls for the seeded objects
+    """
+    basename = name.split('-')[0]
+    kwargs = {'report_id': objects['report'], 'strategy_id': objects['strategy']}
+    detail = {'report': 'report', 'source': 'source', 'sourceAdded': 'sourceAdded',
+              'reductionStrategy': 'strategy', 'modification': 'modification', 'portfolio': 'portfolio', 'job': 'job'}
+    if basename in detail:
+        kwargs['pk'] = objects[detail[basename]]
+    return kwargs
+
+
+def route_names() -> list[str]:
+    return sorted({url.name for url in router.urls if url.name})
+
+
+class QueryBudgetTest(TestCase):
+    """
+    For each route: the number of queries of a request must stay the same when the
+    report grows, within the budget of the route and without duplicated queries
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+    def request(self, name: str, objects: dict) -> list[str]:
+        method, query_string, _, _ = BUDGETS[name]
+        pattern = next(url for url in router.urls if url.name == name and 'format' not in url.pattern.regex.groupindex)
+        kwargs = {key: value for key, value in route_kwargs(name, objects).items() if key in pattern.pattern.regex.groupindex}
+        url = f'{reverse(name, kwargs=kwargs)}?{query_string}'
+
+        # Cold computation cache, as in the first request after a write
+        caching.get_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'post':
+                response = self.client.post(url, IMPORTED_SOURCES, content_type='application/x-ndjson')
+            else:
+                response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 300, f'{url}: {response.status_code}')
+        return [query['sql'] for query in queries]
+
+    def format_queries(self, queries: list[str]) -> str:
+        return '\n'.join(f'  {i + 1}. {sql}' for i, sql in enumerate(queries))
+
+    def test_every_route_has_a_budget(self):
+        self.assertEqual([name for name in route_names() if name not in BUDGETS], [])
+
+    def test_query_budgets(self):
+        seeded = [(size, seed_report(size)) for size in SIZES]
+        for name in route_names():
+            with self.subTest(route=name):
+                _, _, budget, allowed_duplicates = BUDGETS[name]
+                counts = []
+                for size, objects in seeded:
+                    queries = self.request(name, objects)
+                    counts.append(len(queries))
+
+                    self.assertLessEqual(len(queries), budget,
+                                         f'{name} with {size} sources: {len(queries)} queries for a budget of {budget}\n'
+                                         f'{self.format_queries(queries)}')
+                    duplicates = {sql: count for sql, count in Counter(queries).items() if count > 1}
+                    self.assertLessEqual(sum(count - 1 for count in duplicates.values()), allowed_duplicates,
+                                         f'{name} with {size} sources: duplicated queries\n'
+                                         f'{self.format_queries(list(duplicates))}')
+                    if len(counts) > 1 and counts[-1] != counts[0]:
+                        self.fail(f'{name}: {counts} queries for {SIZES[:len(counts)]} sources\n'
+                                  f'{self.format_queries(queries)}')
@@ -0,0 +1,103 @@
+import datetime
+import gzip
+import io
+import json
+import unittest
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils.translation import gettext_lazy
+from coreapp.models import Report, Source
+from coreapp.parsers import MessagePackParser, ORJSONParser
+from coreapp.renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+DATA = {
+    'id': 1,
+    'name': 'Rapport été \u2028 "quoted"',
+    'total_emission': 1234.5678,
+    'small': 1e-07,
+    'decimal': Decimal('1.50'),
+    'lazy': gettext_lazy('Report'),
+    'created_at': datetime.datetime(2023, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+    'date': datetime.date(2023, 5, 1),
+    'sources': [{'id': 2, 'lifetime': None, 'value': True}],
+    'pair': (1, 2),
+}
+
+
+class RenderersTest(TestCase):
+
+    def test_orjson_renderer(self):
+        self.assertEqual(json.loads(ORJSONRenderer().render(DATA)), json.loads(JSONRenderer().render(DATA)))
+        without_exponents = {key: value for key, value in DATA.items() if key != 'small'}
+        self.assertEqual(ORJSONRenderer().render(without_exponents), JSONRenderer().render(without_exponents))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_orjson_renderer_fallbacks(self):
+        # Integer over 64 bits and indented output
+        self.assertEqual(ORJSONRenderer().render({'id': 2**70}), JSONRenderer().render({'id': 2**70}))
+        self.assertEqual(ORJSONRenderer().render(DATA, 'application/json; indent=4'),
+                         JSONRenderer().render(DATA, 'application/json; indent=4'))
+
+    def test_orjson_renderer_non_finite(self):
+        # Written as null, where the strict JSONRenderer raises
+        data = {'nan': float('nan'), 'values': [float('inf'), -float('inf'), 1.5]}
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), {'nan': None, 'values': [None, None, 1.5]})
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+
+    def test_orjson_parser(self):
+        content = JSONRenderer().render(DATA)
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(content)), json.loads(content))
+        for content in [b'{"id": 1', b'{"value": NaN}']:
+            with self.assertRaises(ParseError):
+                ORJSONParser().parse(io.BytesIO(content))
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        content = MessagePackRenderer().render(DATA)
+        self.assertEqual(MessagePackParser().parse(io.BytesIO(content)), json.loads(JSONRenderer().render(DATA)))
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(io.BytesIO(b'\xc1'))
+
+
+class ContentNegotiationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.report = Report.objects.create(name='Report 1')
+        Source.objects.bulk_create(Source(report=self.report, description=f'Source {i}', value=i, emission_factor=2)
+                                   for i in range(50))
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+    def test_json(self):
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+
+        response = self.client.post('/reports/', {'name': 'Report 2'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'Report 2')
+
+    @override_settings(COMPRESSION_MIN_SIZE=1000)
+    def test_compression(self):
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(JSONRenderer().render(response.data)))
+
+        # Small response
+        response = self.client.get(f'/reports/{self.report.pk}/?fields=id', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.json(), {'id': self.report.pk})
+
+    @unittest.skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020', HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), json.loads(JSONRenderer().render(response.data)))
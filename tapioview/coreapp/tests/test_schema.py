@@ -0,0 +1,72 @@
+import importlib
+import json
+import os
+import tempfile
+from contextlib import redirect_stderr
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from coreapp import schema
+# from django.test import tag
+
+
+class BuiltSchemaTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / 'openapi.json'
+        settings = override_settings(OPENAPI_SCHEMA_FILE=self.path)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        with redirect_stderr(StringIO()): # summary of the generator
+            call_command('build_schema', stdout=StringIO(), stderr=StringIO())
+
+    def test_built_schema(self):
+        content, version = schema.built_schema()
+        self.assertIn('/reports/', json.loads(content)['paths'])
+
+        response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], schema.CONTENT_TYPE)
+        self.assertEqual(response.content, content)
+        self.assertIn('max-age=300', response['Cache-Control'])
+        self.assertEqual(self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # The pages link the versioned URL, cached for a year
+        page = self.client.get('/api/schema/swagger-ui/')
+        self.assertContains(page, f'/api/schema/?v\\u003D{version}') # escaped in the script
+        self.assertIn('max-age=300', page['Cache-Control'])
+        self.assertContains(self.client.get('/api/schema/redoc/'), f'v={version}')
+        response = self.client.get(f'/api/schema/?v={version}')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(f'max-age={schema.IMMUTABLE_MAX_AGE}', response['Cache-Control'])
+
+        # A new build gives a new version
+        self.path.write_text(json.dumps({**json.loads(content), 'info': {'title': 'Rebuilt', 'version': '2'}}))
+        os.utime(self.path, ns=(0, 0))
+        self.assertNotEqual(schema.built_schema()[1], version)
+
+    def test_missing_schema_file(self):
+        # Not built yet: generated on request, reported by check --deploy
+        self.path.unlink()
+        with self.assertLogs('coreapp.schema', level='WARNING'):
+            self.assertIsNone(schema.built_schema())
+        with self.assertLogs('coreapp.schema', level='WARNING'):
+            response = self.client.get('/api/schema/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/reports/')
+        self.assertEqual([warning.id for warning in schema.check_schema_file(None)], ['coreapp.W001'])
+
+
+class ProductionSettingsTest(TestCase):
+
+    def test_no_development_apps(self):
+        with mock.patch.dict(os.environ, {'DJANGO_SECRET_KEY': 'secret'}):
+            production = importlib.import_module('tapioview.settings_production')
+        self.assertFalse(production.DEBUG)
+        self.assertEqual(production.SECRET_KEY, 'secret')
+        self.assertNotIn('debug_toolbar', production.INSTALLED_APPS)
+        self.assertFalse([middleware for middleware in production.MIDDLEWARE if middleware.startswith('debug_toolbar')])
+        self.assertTrue(production.OPENAPI_SCHEMA_FILE)
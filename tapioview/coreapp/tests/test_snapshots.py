@@ -0,0 +1,129 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from coreapp import aggregates, snapshots
+from coreapp.models import Report, ReportSnapshot, Source, ReductionStrategy, ReductionModification, ReportYearEmission, StrategyYearDelta
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+
+        self.report = Report.objects.create(name='Report 1')
+        self.old_source = Source.objects.create(report=self.report, value=10, emission_factor=2, lifetime=5, acquisition_year=2016)
+        self.source = Source.objects.create(report=self.report, value=3, emission_factor=1)
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        self.modification = ReductionModification.objects.create(strategy=self.strategy, source=self.old_source,
+                                                                 value_modification=-4, modification_start_year=2018)
+        Source.objects.create(strategy=self.strategy, value=1, emission_factor=1, acquisition_year=2019)
+
+    def test_freeze(self):
+        snapshot = snapshots.freeze_report(self.report, 2019)
+        self.assertAlmostEqual(snapshot.total_emission, self.report.year_emission(2019))
+        self.assertEqual(snapshot.source_emissions(), {self.old_source.pk: 4.0, self.source.pk: 3.0})
+        self.assertAlmostEqual(snapshot.strategy_deltas[str(self.strategy.pk)], self.strategy.year_delta_emission(2019))
+        self.assertTrue(ReportYearEmission.objects.get(report=self.report, year=2019).frozen)
+        self.assertTrue(StrategyYearDelta.objects.get(strategy=self.strategy, year=2019).frozen)
+
+        # The rows of the frozen year are kept by a full materialization
+        aggregates.materialize_report(self.report)
+        aggregates.materialize_strategy(self.strategy)
+        self.assertTrue(ReportYearEmission.objects.get(report=self.report, year=2019).frozen)
+        self.assertEqual(ReportYearEmission.objects.filter(report=self.report).count(), len(aggregates.horizon_years()))
+        self.assertEqual(StrategyYearDelta.objects.filter(strategy=self.strategy).count(), len(aggregates.horizon_years()))
+
+    def test_frozen_sources(self):
+        snapshots.freeze_report(self.report, 2019)
+
+        # The sources existing in the frozen year cannot be changed
+        self.old_source.value = 20
+        with self.assertRaises(snapshots.FrozenYearError):
+            self.old_source.save()
+        with self.assertRaises(snapshots.FrozenYearError), transaction.atomic():
+            self.source.delete()
+        with self.assertRaises(snapshots.FrozenYearError):
+            Source.objects.create(report=self.report, value=1, emission_factor=1)
+        with self.assertRaises(snapshots.FrozenYearError):
+            Source.objects.create(report=self.report, value=1, emission_factor=1, acquisition_year=2019)
+        # nor the modifications started in or before it
+        self.modification.value_modification = -2
+        with self.assertRaises(snapshots.FrozenYearError):
+            self.modification.save()
+
+        # The later sources and modifications can
+        source = Source.objects.create(report=self.report, value=1, emission_factor=1, acquisition_year=2025)
+        source.value = 2
+        source.save()
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, value_modification=-1, modification_start_year=2022)
+        # and the description of the old ones
+        self.source.description = 'Renamed'
+        self.source.save()
+        self.assertAlmostEqual(aggregates.report_year_emission(self.report, 2019), 7.0)
+        self.assertAlmostEqual(aggregates.report_year_emission(self.report, 2025), self.report.year_emission(2025))
+
+        # Deleting the report deletes its snapshots
+        self.report.delete()
+        self.assertFalse(ReportSnapshot.objects.exists())
+
+    def test_unfreeze(self):
+        snapshots.freeze_report(self.report, 2019)
+        self.assertTrue(snapshots.unfreeze_report(self.report, 2019))
+        self.assertFalse(snapshots.unfreeze_report(self.report, 2019))
+        self.assertFalse(ReportYearEmission.objects.get(report=self.report, year=2019).frozen)
+
+        self.old_source.value = 20
+        self.old_source.save()
+        self.assertAlmostEqual(aggregates.report_year_emission(self.report, 2019), 11.0)
+        self.assertAlmostEqual(aggregates.strategy_year_delta(self.strategy, 2019), self.strategy.year_delta_emission(2019))
+
+    def test_snapshot_api(self):
+        url = f'/reports/{self.report.pk}/snapshot/'
+        self.assertEqual(self.client.get(f'{url}?year=2019').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(f'{url}?year=1990').status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(f'{url}?year=2019')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total_emission'], 7.0)
+        self.assertEqual(response.data['sources'], [{'id': self.old_source.pk, 'year_emission': 4.0},
+                                                    {'id': self.source.pk, 'year_emission': 3.0}])
+        self.assertEqual(response.data['strategies'][0]['id'], self.strategy.pk)
+        self.assertEqual(self.client.post(f'{url}?year=2019').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.get(f'{url}?year=2019').data, response.data)
+
+        # The changes of the frozen year are conflicts
+        response = self.client.patch(f'/reports/{self.report.pk}/sources/{self.source.pk}/', {'value': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('2019', response.data['detail'])
+        response = self.client.delete(f'/reports/{self.report.pk}/sources/{self.source.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        response = self.client.post(f'/reports/{self.report.pk}/sources/import/?type=ndjson',
+                                    b'{"value": 1, "emission_factor": 1}\n{"value": 1, "emission_factor": 1, "acquisition_year": 2024}\n',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.data['created'], response.data['error_count']), (1, 1))
+
+        # Re-frozen after an explicit unfreeze
+        self.assertEqual(self.client.delete(f'{url}?year=2019').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(f'{url}?year=2019').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.patch(f'/reports/{self.report.pk}/sources/{self.source.pk}/', {'value': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(f'{url}?year=2019')
+        self.assertEqual(response.data['total_emission'], 9.0)
+
+    def test_reads_from_snapshot(self):
+        snapshots.freeze_report(self.report, 2019)
+        # Bypasses the signals: only the live computation sees it
+        Source.objects.filter(pk=self.source.pk).update(value=100)
+
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2019')
+        self.assertEqual(response.data['total_emission'], 7.0)
+        response = self.client.get(f'/reports/{self.report.pk}/sources/?year=2019')
+        self.assertEqual([source['total_emission'] for source in response.data['results']], [4.0, 3.0])
+        response = self.client.get(f'/reports/{self.report.pk}/sources/?year=2020')
+        self.assertEqual([source['total_emission'] for source in response.data['results']], [4.0, 100.0])
@@ -0,0 +1,112 @@
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from coreapp import frames, uncertainty
+from coreapp.models import NORMAL, LOGNORMAL, TRIANGULAR, UNIFORM, ComputationJob, Report, Source, ReductionStrategy, ReductionModification
+from rest_framework.test import APIClient
+from rest_framework import status
+# from django.test import tag
+
+
+class UncertaintyTest(TestCase):
+    def setUp(self):
+        self.report = Report.objects.create(name='Report 1')
+        self.source = Source.objects.create(report=self.report, value=10, emission_factor=2, lifetime=5, acquisition_year=2016,
+                                            emission_factor_distribution=NORMAL, emission_factor_uncertainty=0.2)
+        other = Source.objects.create(report=self.report, value=3, emission_factor=1,
+                                      emission_factor_distribution=LOGNORMAL, emission_factor_uncertainty=0.5)
+        negative = Source.objects.create(report=self.report, value=-2, emission_factor=3, acquisition_year=2019)
+        self.strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, value_modification=-4, modification_start_year=2018)
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, emission_factor_change=1, modification_start_year=2020,
+                                             emission_factor_change_distribution=UNIFORM, emission_factor_change_uncertainty=0.9)
+        ReductionModification.objects.create(strategy=self.strategy, source=other, value_modification=-5, modification_start_year=2022)
+        ReductionModification.objects.create(strategy=self.strategy, source=negative, emission_factor_change=-1, modification_start_year=2021)
+        other_strategy = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        ReductionModification.objects.create(strategy=other_strategy, source=other, emission_factor_change=0.5, modification_start_year=2017,
+                                             emission_factor_change_distribution=TRIANGULAR, emission_factor_change_uncertainty=1.5)
+        Source.objects.create(strategy=other_strategy, value=1, emission_factor=1, lifetime=3, acquisition_year=2019,
+                              emission_factor_distribution=NORMAL, emission_factor_uncertainty=3)
+
+    def test_point_values(self):
+        # Without drawing, the same values as the rules
+        model = uncertainty.UncertaintyModel(uncertainty.load_data(self.report.pk), 2010, 2030)
+        total, deltas = model.point()
+        frame = frames.ReportFrame.load(self.report.pk)
+        for value, expected in zip(total.tolist(), frame.range_emission(2010, 2030)):
+            self.assertAlmostEqual(value, expected)
+        expected_deltas = frame.range_deltas(2010, 2030)
+        for strategy, strategy_deltas in zip(model.strategies, deltas.tolist()):
+            for value, expected in zip(strategy_deltas, expected_deltas[strategy.id]):
+                self.assertAlmostEqual(value, expected)
+
+    def test_percentiles(self):
+        result = uncertainty.compute_uncertainty(self.report, 2015, 2025, 2000, [5, 50, 95], 1)
+        self.assertEqual(len(result['years']), 11)
+        year = result['years'][5] # 2020
+        self.assertAlmostEqual(year['total_emission'], self.report.year_emission(2020))
+        self.assertLess(year['percentiles']['5'], year['percentiles']['50'])
+        self.assertLess(year['percentiles']['50'], year['percentiles']['95'])
+        self.assertAlmostEqual(year['mean'], year['total_emission'], delta=0.2)
+        strategy = result['strategies'][0]
+        self.assertEqual(strategy['name'], 'Strategy 1')
+        self.assertAlmostEqual(strategy['years'][5]['delta_total_emission'], self.strategy.year_delta_emission(2020))
+        self.assertLessEqual(strategy['years'][5]['delta_percentiles']['5'], strategy['years'][5]['delta_percentiles']['95'])
+
+        # Same draws for the same seed, in this process or in the pool
+        self.assertEqual(uncertainty.compute_uncertainty(self.report, 2015, 2025, 2000, [5, 50, 95], 1), result)
+        with override_settings(MONTE_CARLO_POOL_MIN_WORK=0, MONTE_CARLO_WORKERS=2):
+            self.assertEqual(uncertainty.compute_uncertainty(self.report, 2015, 2025, 2000, [5, 50, 95], 1), result)
+        self.assertNotEqual(uncertainty.compute_uncertainty(self.report, 2015, 2025, 2000, [5, 50, 95], 2), result)
+
+        # The deltas of the strategies simulated one by one when bounded, with the same draws
+        with mock.patch.object(uncertainty, 'DELTA_VALUES', 2000 * 11), \
+                mock.patch.object(uncertainty, 'simulate', wraps=uncertainty.simulate) as simulate:
+            self.assertEqual(uncertainty.compute_uncertainty(self.report, 2015, 2025, 2000, [5, 50, 95], 1), result)
+        self.assertEqual([call.args[3] for call in simulate.call_args_list], [slice(0, 1), slice(1, 2)])
+
+    def test_certain_emission_factors(self):
+        Source.objects.update(emission_factor_distribution='', emission_factor_uncertainty=None)
+        ReductionModification.objects.update(emission_factor_change_distribution='')
+        result = uncertainty.compute_uncertainty(self.report, 2020, 2020, 10, [5, 95], 0)
+        year = result['years'][0]
+        self.assertAlmostEqual(year['percentiles']['5'], year['total_emission'])
+        self.assertAlmostEqual(year['percentiles']['95'], year['total_emission'])
+
+
+class UncertaintyViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_authenticate(self.user)
+        self.report = Report.objects.create(name='Report 1')
+        Source.objects.create(report=self.report, value=10, emission_factor=2,
+                              emission_factor_distribution=NORMAL, emission_factor_uncertainty=0.1)
+
+    def test_uncertainty(self):
+        response = self.client.get(f'/reports/{self.report.pk}/uncertainty/?from=2020&to=2021&draws=20000&percentiles=5,50,95')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        year = response.data['years'][0]
+        self.assertEqual(year['total_emission'], 20)
+        # Normal distribution: 20 +- 1.645 x 2
+        self.assertAlmostEqual(year['percentiles']['5'], 20 - 1.645 * 2, delta=0.1)
+        self.assertAlmostEqual(year['percentiles']['50'], 20, delta=0.1)
+        self.assertAlmostEqual(year['percentiles']['95'], 20 + 1.645 * 2, delta=0.1)
+
+        for query in ['', 'from=2020&to=2021&draws=0', 'from=2020&to=2021&percentiles=5,101', 'from=2020&to=2021&seed=x']:
+            response = self.client.get(f'/reports/{self.report.pk}/uncertainty/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+        response = self.client.post('/jobs/', {'kind': ComputationJob.UNCERTAINTY, 'report': self.report.pk,
+                                               'parameters': {'from': 2020, 'to': 2021, 'draws': -1}}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_distribution_needs_uncertainty(self):
+        response = self.client.post(f'/reports/{self.report.pk}/sources/', {'report': self.report.pk, 'value': 1, 'emission_factor': 1,
+                                                                              'emission_factor_distribution': NORMAL}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('emission_factor_uncertainty', response.data)
+        response = self.client.post(f'/reports/{self.report.pk}/sources/', {'report': self.report.pk, 'value': 1, 'emission_factor': 1,
+                                                                              'emission_factor_distribution': NORMAL, 'emission_factor_uncertainty': 0.3},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -1,5 +1,13 @@
+import csv
+import json
+import math
+from unittest import mock
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from coreapp import aggregates
 from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
 from rest_framework.test import APIClient
 from rest_framework import status
@@ -40,6 +48,159 @@ class ReportViewTest(TestCase):
         self.assertEqual(len(response.data['sources']), 2)
         self.assertEqual(response.data['sources'][0]['id'], self.source1.pk)
         self.assertEqual(response.data['sources'][1]['id'], self.source2.pk)
+
+    def test_get_reports_query_count(self):
+        strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=strategy, source=self.source1, value_modification=-1, modification_start_year=2020)
+
+        with CaptureQueriesContext(connection) as small_report:
+            response = self.client.get('/reports/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The number of queries must not depend on the number of objects
+        for i in range(10):
+            source = Source.objects.create(report=self.report, value=1, emission_factor=10)
+            Source.objects.create(strategy=strategy, value=1, emission_factor=10)
+            ReductionModification.objects.create(strategy=strategy, source=source, value_modification=-1, modification_start_year=2020)
+        Report.objects.create(name='Report 2')
+
+        with CaptureQueriesContext(connection) as big_report:
+            response = self.client.get('/reports/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(big_report), len(small_report))
+
+        # Strategy sources and modifications are nested
+        strategy_data = response.data['results'][0]['reductionStrategies'][0]
+        self.assertEqual(len(strategy_data['sources']), 10)
+        self.assertEqual(len(strategy_data['modifications']), 11)
+        self.assertEqual(strategy_data['delta_total_emission'], strategy.year_delta_emission(2020))
+
+    def test_get_reports_outside_horizon(self):
+        strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=strategy, source=self.source1, value_modification=-1, modification_start_year=2020)
+        report2 = Report.objects.create(name='Report 2')
+        strategy2 = ReductionStrategy.objects.create(name='Strategy 2', report=report2)
+        Source.objects.create(strategy=strategy2, value=1, emission_factor=3)
+
+        # The deltas are computed with the frames of all the reports at once, without Source instances
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/reports/?year=2100&fields=id,total_emission,reductionStrategies.delta_total_emission')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('"coreapp_source"."description"' in query['sql'] for query in queries))
+        self.assertEqual(response.data['results'][0], {'id': self.report.pk, 'total_emission': 20,
+                                                       'reductionStrategies': [{'delta_total_emission': 10}]})
+        self.assertEqual(response.data['results'][1]['reductionStrategies'], [{'delta_total_emission': -3}])
+
+        response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{strategy.pk}/?year=2100')
+        self.assertEqual(response.data['delta_total_emission'], strategy.year_delta_emission(2100))
+
+    def test_get_report_fieldsets(self):
+        strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        ReductionModification.objects.create(strategy=strategy, source=self.source1, value_modification=-1, modification_start_year=2020)
+
+        response = self.client.get(f'/reports/{self.report.pk}/?fields=id,reductionStrategies.name')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'id': self.report.pk, 'reductionStrategies': [{'name': 'Strategy 1'}]})
+
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020&expand=reductionStrategies')
+        self.assertEqual(set(response.data), {'id', 'name', 'total_emission', 'reductionStrategies'})
+        self.assertEqual(set(response.data['reductionStrategies'][0]), {'id', 'report', 'name', 'delta_total_emission'})
+        self.assertEqual(response.data['reductionStrategies'][0]['delta_total_emission'], strategy.year_delta_emission(2020))
+
+        # The summary is the report header only: 1 report + 1 stored total
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/reports/{self.report.pk}/?year=2020&summary=1')
+        self.assertEqual(response.data, {'id': self.report.pk, 'name': 'Report 1', 'total_emission': 20})
+        report_queries = [query['sql'] for query in queries if 'coreapp_' in query['sql']]
+        self.assertEqual(len(report_queries), 3) # + the validators of the conditional GET
+        self.assertFalse(any('coreapp_source' in sql for sql in report_queries))
+
+    def test_get_report_not_modified(self):
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers['ETag']
+        self.assertIn('Last-Modified', response.headers)
+
+        # Same revision: no serialization, only the session, the user and the revision queries
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/reports/{self.report.pk}/?year=2020', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        # Other parameters: other payload
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2021', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Report changed
+        self.source1.value = 2
+        self.source1.save()
+        response = self.client.get(f'/reports/{self.report.pk}/?year=2020', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # List of reports
+        response = self.client.get('/reports/')
+        etag = response.headers['ETag']
+        response = self.client.get('/reports/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Report.objects.create(name='Report 2')
+        response = self.client.get('/reports/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_export_report(self):
+        strategy = ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        Source.objects.create(strategy=strategy, description='Source 3', value=1, emission_factor=10)
+        ReductionModification.objects.create(strategy=strategy, source=self.source1, emission_factor_change=5, modification_start_year=2020)
+
+        response = self.client.get(f'/reports/{self.report.pk}/export/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['type'] for row in rows], ['source', 'source', 'strategy', 'source', 'modification'])
+        self.assertEqual(rows[0]['year_emission'], 10)
+        self.assertEqual(rows[2]['delta_total_emission'], strategy.year_delta_emission(2020))
+
+        response = self.client.get(f'/reports/{self.report.pk}/export/?format=csv')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['description'], 'Source 1')
+        self.assertEqual(rows[0]['year_emission'], '')
+
+    def test_export_not_finite(self):
+        # Emissions that cannot be computed (NaN): null in NDJSON (NaN is not JSON), empty in CSV
+        ReductionStrategy.objects.create(name='Strategy 1', report=self.report)
+        with mock.patch.object(Source, 'year_emission', return_value=math.nan), \
+                mock.patch.object(aggregates, 'strategy_year_delta', return_value=math.inf):
+            response = self.client.get(f'/reports/{self.report.pk}/export/?year=2020')
+            content = b''.join(response.streaming_content).decode()
+            self.assertNotIn('NaN', content)
+            rows = [json.loads(line) for line in content.splitlines()]
+            self.assertIsNone(rows[0]['year_emission'])
+            self.assertIsNone(rows[2]['delta_total_emission'])
+
+            response = self.client.get(f'/reports/{self.report.pk}/export/?year=2020&format=csv')
+            rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+            self.assertEqual(rows[0]['year_emission'], '')
+            self.assertEqual(rows[2]['delta_total_emission'], '')
+
+    def test_get_report_timeseries(self):
+        response = self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2020&to=2022')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['id'], self.report.pk)
+        self.assertEqual(response.data['timeseries'], [{'year': 2020, 'total_emission': 20},
+                                                       {'year': 2021, 'total_emission': 20},
+                                                       {'year': 2022, 'total_emission': 20}])
+
+        # Invalid ranges
+        response = self.client.get(f'/reports/{self.report.pk}/timeseries/')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f'/reports/{self.report.pk}/timeseries/?from=2022&to=2020')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(f'/reports/{self.report.pk}/timeseries/?from=abc&to=2020')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         
         
 
@@ -86,6 +247,48 @@ class SourceViewTest(TestCase):
 
         response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/sources/{self.source3.pk}/?year=2020')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_sources_cursor_pagination(self):
+        response = self.client.get(f'/reports/{self.report.pk}/sources/?page_size=1&fields=id,total_emission&year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(response.data['results'], [{'id': self.source1.pk, 'total_emission': 10}])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'], [{'id': self.source2.pk, 'total_emission': 10}])
+        self.assertIsNone(response.data['next'])
+
+    def test_import_sources(self):
+        # CSV upload
+        upload = SimpleUploadedFile('sources.csv', (b'description,value,emission_factor,lifetime,acquisition_year\n'
+                                                    b'Imported 1,1,10,,\n'
+                                                    b'Imported 2,2,10,5,2020\n'
+                                                    b'Invalid 1,abc,10,,\n'
+                                                    b'Invalid 2,1,10,5,\n'), content_type='text/csv')
+        response = self.client.post(f'/reports/{self.report.pk}/sources/import/?batch_size=1', {'file': upload})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['error_count'], 2)
+        self.assertEqual([error['line'] for error in response.data['errors']], [4, 5])
+        self.assertIn('acquisition_year', response.data['errors'][1]['errors'])
+        self.assertEqual(self.report.sources.count(), 4)
+        self.assertEqual(self.report.year_emission(2020), 10+10+10+20/5)
+
+        # NDJSON raw body, into a strategy
+        body = b'{"description": "Imported 3", "value": 1, "emission_factor": 10}\n\n{"value": 1}\n'
+        response = self.client.post(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/sources/import/',
+                                    body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        self.assertEqual(self.strategy.sourcesStrategy.count(), 2)
+
+        # Nothing imported
+        response = self.client.post(f'/reports/{self.report.pk}/sources/import/?type=ndjson', b'not json\n', content_type='text/plain')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(f'/reports/{self.report.pk}/sources/import/', b'a,b\n', content_type='text/plain')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         
 
 class ReductionStrategyViewTest(TestCase):
@@ -124,6 +327,48 @@ class ReductionStrategyViewTest(TestCase):
         response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/?year=2020')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_compare_strategies(self):
+        old_source = Source.objects.create(report=self.report, value=-2, emission_factor=3, lifetime=4, acquisition_year=2016)
+        Source.objects.create(report=self.report, value=5, emission_factor=2, acquisition_year=2022)
+        ReductionModification.objects.create(strategy=self.strategy, source=old_source, value_modification=3, modification_start_year=2018)
+        strategy2 = ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+        Source.objects.create(strategy=strategy2, value=1, emission_factor=4, acquisition_year=2021)
+        ReductionModification.objects.create(strategy=strategy2, source=self.source, emission_factor_change=2, modification_start_year=2019)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/compare/?from=2015&to=2025')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(queries), 10)
+
+        self.assertEqual([strategy['id'] for strategy in response.data['strategies']], [self.strategy.pk, strategy2.pk])
+        for strategy, data in zip([self.strategy, strategy2], response.data['strategies']):
+            deltas = strategy.range_delta_emission(2015, 2025)
+            for year, delta, cell in zip(range(2015, 2026), deltas, data['years']):
+                self.assertEqual(cell['year'], year)
+                self.assertAlmostEqual(cell['baseline_emission'], self.report.year_emission(year))
+                self.assertAlmostEqual(cell['delta_total_emission'], delta)
+                self.assertAlmostEqual(cell['total_emission'], cell['baseline_emission'] - delta)
+
+        response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/compare/?from=2025&to=2015')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_strategies_query_count(self):
+        with CaptureQueriesContext(connection) as small_report:
+            response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The number of queries must not depend on the number of objects
+        for i in range(10):
+            source = Source.objects.create(report=self.report, value=1, emission_factor=10)
+            ReductionModification.objects.create(strategy=self.strategy, source=source, value_modification=-1, modification_start_year=2020)
+        ReductionStrategy.objects.create(name='Strategy 2', report=self.report)
+
+        with CaptureQueriesContext(connection) as big_report:
+            response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/?year=2020')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(big_report), len(small_report))
+        self.assertEqual(response.data['results'][0]['delta_total_emission'], self.strategy.year_delta_emission(2020))
+
 
 
 class ReductionModificationViewTest(TestCase):
@@ -161,4 +406,16 @@ class ReductionModificationViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
         response = self.client.get(f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/modifications/{self.modification.pk}/?year=2020')
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
\ No newline at end of file
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_modifications_not_modified(self):
+        url = f'/reports/{self.report.pk}/reductionStrategies/{self.strategy.pk}/modifications/'
+        etag = self.client.get(url).headers['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A new modification changes the report revision
+        ReductionModification.objects.create(strategy=self.strategy, source=self.source, value_modification=1, modification_start_year=2021)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
\ No newline at end of file
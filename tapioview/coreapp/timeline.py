@@ -0,0 +1,92 @@
+"""
+In-memory index of the modifications of a strategy.
+
+The modifications are grouped per source as sorted arrays of
+(start_year, cumulative value change, last emission factor), so the delta of a
+source for any year is a binary search instead of a query and a linear scan.
+"""
+from bisect import bisect_right
+
+
+class SourceTimeline:
+    """
+    The modifications of one source, sorted by (modification_start_year, order).
+    Index i of each array describes the state after applying the modifications 0..i
+    """
+    __slots__ = ('start_years', 'cumulative_values', 'emission_factors', 'first_emission_factor')
+
+    def __init__(self, modifications):
+        self.start_years = []
+        self.cumulative_values = []
+        self.emission_factors = []
+        self.first_emission_factor = None
+
+        cumulative_value = 0
+        emission_factor = None
+        for modification in modifications:
+            if modification.emission_factor_change:
+                emission_factor = modification.emission_factor_change
+            if modification.value_modification:
+                cumulative_value += modification.value_modification
+            self.start_years.append(modification.modification_start_year)
+            self.cumulative_values.append(cumulative_value)
+            self.emission_factors.append(emission_factor)
+
+        if self.emission_factors:
+            self.first_emission_factor = self.emission_factors[0]
+
+    def changes(self, year: int, lifetime: int | None) -> tuple[float, float | None]:
+        """
+        (value change, last emission factor set) of the modifications started in `year`.
+        As in the original rules, once the first modification is amortized the value changes
+        are not applied anymore, only its emission factor is kept
+        """
+        count = bisect_right(self.start_years, year)
+        if count == 0:
+            return 0, None
+        if lifetime and self.start_years[0] + lifetime < year:
+            return 0, self.first_emission_factor # already amortized
+        return self.cumulative_values[count - 1], self.emission_factors[count - 1]
+
+
+class ModificationTimeline:
+    """
+    Index of modifications grouped per source
+    """
+
+    def __init__(self, modifications):
+        grouped = {}
+        for modification in sorted(modifications, key=lambda modification: (modification.modification_start_year, modification.order)):
+            grouped.setdefault(modification.source_id, []).append(modification)
+        self.sources = {source_id: SourceTimeline(source_modifications)
+                        for source_id, source_modifications in grouped.items()}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def changes(self, source, year: int) -> tuple[float, float | None]:
+        timeline = self.sources.get(source.id)
+        if timeline is None:
+            return 0, None
+        return timeline.changes(year, source.lifetime)
+
+    def source_delta(self, source, year: int) -> float:
+        """
+        Same rules as Source.year_delta_emission, see its docstring
+        """
+        if source.acquisition_year and source.acquisition_year > year :
+            return 0 # source doesn't exist at this time
+
+        cumul_value = source.value
+        if source.lifetime and source.acquisition_year + source.lifetime < year:
+            cumul_value = 0 # already amortized
+
+        value_change, emission_factor = self.changes(source, year)
+        cumul_value += value_change
+        cumul_emission_factor = emission_factor or source.emission_factor
+
+        emission_modified = max(cumul_emission_factor * cumul_value, 0)
+        if source.lifetime:
+            emission_modified = emission_modified / source.lifetime
+
+        return source.year_emission(year) - emission_modified
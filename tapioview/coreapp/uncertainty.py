@@ -0,0 +1,385 @@
+"""
+Monte Carlo propagation of the uncertainty of the emission factors.
+
+A source or a modification may give its emission factor a distribution and a
+relative uncertainty (models.DISTRIBUTIONS). Each draw multiplies every uncertain
+emission factor by a random multiplier of mean 1, then evaluates the total
+emission of the report and the delta of each strategy for every year of the range
+with the rules of Source.year_emission and Source.year_delta_emission. The
+response gives the percentiles of these values over the draws.
+
+The rules are linear in the emission factors but for the clamp of the modified
+emission to 0, so the draws are evaluated together with a few matrix products,
+without any loop over the sources or the years:
+
+* the sources are sorted by their years of life: the emission of the sources alive
+  in each year is a sum per group of sources living the same years (np.add.reduceat)
+  by a (groups x years) 0/1 matrix;
+* the modified emission of a strategy is a (draws x emission factors) by (emission
+  factors x years) product, the coefficients adding up the modified values divided
+  by the lifetimes, per emission factor and year. The clamp is only applied to the
+  terms that can be negative: negative modified values, emission factors drawn negative.
+
+The draws are split in blocks of BLOCK_DRAWS, each with its own random stream
+spawned from the seed, so that the results only depend on the seed, whether the
+blocks run in this process or in a pool of settings.MONTE_CARLO_WORKERS processes
+(computations of at least settings.MONTE_CARLO_POOL_MIN_WORK). The temporary
+arrays of a block are bounded to CHUNK_SIZE values. The (strategies x draws x years)
+deltas kept for the percentiles are bounded to DELTA_VALUES values: beyond, the
+strategies are simulated by groups, each drawing the same emission factors again
+from the seed.
+"""
+import numpy as np
+from django.db.models import Case, IntegerField, Value, When
+from coreapp import caching, engine, frames, metrics, pools
+from coreapp.instrumentation import EMISSION, timer
+from coreapp.models import DISTRIBUTIONS, LOGNORMAL, NORMAL, TRIANGULAR, UNIFORM, Report, ReductionStrategy, ReductionModification, Source
+
+UNCERTAINTY_CACHE_NAME = 'uncertainty'
+
+# Draws of one random stream, the unit of work of the pool
+BLOCK_DRAWS = 1000
+# Values of the temporary (draws x emission factors) arrays
+CHUNK_SIZE = 2 ** 21
+# Draws x (emission factors + modified source-years)
+DEFAULT_POOL_MIN_WORK = 2 * 10 ** 8
+# Strategies x draws x years of the deltas simulated at once
+DELTA_VALUES = 2 * 10 ** 6
+
+# Multipliers of mean 1 of the emission factors, for their relative uncertainty u
+SAMPLERS = {
+    NORMAL: lambda rng, u, shape: 1 + u * rng.standard_normal(shape),
+    LOGNORMAL: lambda rng, u, shape: np.exp(u * rng.standard_normal(shape) - u ** 2 / 2),
+    UNIFORM: lambda rng, u, shape: 1 + u * rng.uniform(-1, 1, shape),
+    TRIANGULAR: lambda rng, u, shape: 1 + u * rng.triangular(-1, 0, 1, shape),
+}
+# The distributions are read from the database as numbers, 0 when the emission factor is certain
+CODES = {name: code for code, (name, _) in enumerate(DISTRIBUTIONS, start=1)}
+
+SOURCE_COLUMNS = [*engine.SOURCE_COLUMNS, 'distribution', 'emission_factor_uncertainty']
+MODIFICATION_COLUMNS = [*frames.MODIFICATION_COLUMNS, 'distribution', 'emission_factor_change_uncertainty']
+
+
+def distribution_code(field: str) -> Case:
+    """
+    The distribution of `field` as its number in CODES, as a SQL expression
+    """
+    return Case(*(When(**{field: name}, then=Value(code)) for name, code in CODES.items()),
+                default=Value(0), output_field=IntegerField())
+
+
+def load_data(report_id: int) -> frames.ReportData:
+    """
+    The rows of the report as frames.load_reports, with the distribution and the
+    uncertainty of the emission factors as last columns
+    """
+    sources = Source.objects.annotate(distribution=distribution_code('emission_factor_distribution'))
+    modifications = (ReductionModification.objects.filter(strategy__report_id=report_id).order_by()
+                     .annotate(distribution=distribution_code('emission_factor_change_distribution')))
+    return frames.ReportData(
+        report_id, list(ReductionStrategy.objects.filter(report_id=report_id).values_list('id', 'name')),
+        frames.fetch_columns(sources.filter(report_id=report_id).order_by('id'), 'id', *SOURCE_COLUMNS),
+        frames.fetch_columns(modifications, 'strategy_id', *MODIFICATION_COLUMNS),
+        frames.fetch_columns(sources.filter(strategy__report_id=report_id).order_by(), 'strategy_id', *SOURCE_COLUMNS))
+
+
+class Factors:
+    """
+    The emission factors of a report: value, distribution number and relative uncertainty
+    """
+    __slots__ = ('value', 'code', 'uncertainty')
+
+    def __init__(self, value, code, uncertainty):
+        # The emission factors not set by a modification are never used
+        self.value = np.nan_to_num(np.asarray(value, dtype=np.float64))
+        self.code = np.nan_to_num(np.asarray(code, dtype=np.float64)).astype(np.int64)
+        self.uncertainty = np.nan_to_num(np.asarray(uncertainty, dtype=np.float64))
+
+    def __len__(self):
+        return len(self.value)
+
+    def draw(self, rng: np.random.Generator, draws: int) -> np.ndarray:
+        """
+        (draws x factors) drawn emission factors
+        """
+        result = np.tile(self.value, (draws, 1))
+        for name, sample in SAMPLERS.items():
+            columns = np.flatnonzero(self.code == CODES[name])
+            if len(columns):
+                result[:, columns] *= sample(rng, self.uncertainty[columns], (draws, len(columns)))
+        return result
+
+
+class Intervals:
+    """
+    Sums over the sources alive in each year, the sources being sorted by (first year, last year)
+    """
+    __slots__ = ('starts', 'alive')
+
+    def __init__(self, first_year: np.ndarray, last_year: np.ndarray, years: np.ndarray):
+        new_group = (np.diff(first_year) != 0) | (np.diff(last_year) != 0)
+        self.starts = np.flatnonzero(np.concatenate([[len(first_year) > 0], new_group]))
+        first_year, last_year = first_year[self.starts], last_year[self.starts]
+        self.alive = ((years[None, :] >= first_year[:, None]) & (years[None, :] <= last_year[:, None])).astype(np.float64)
+
+    def sum(self, values: np.ndarray) -> np.ndarray:
+        """
+        (draws x years) sums of the (draws x sources) values
+        """
+        if len(self.starts) == 0:
+            return np.zeros((len(values), self.alive.shape[1]))
+        return np.add.reduceat(values, self.starts, axis=1) @ self.alive
+
+
+def year_sums(values: np.ndarray, years: np.ndarray, count: int) -> np.ndarray:
+    """
+    (draws x count) sums of the (draws x entries) values per year index, `years` being sorted
+    """
+    starts = np.flatnonzero(np.concatenate([[True], np.diff(years) != 0]))
+    sums = np.zeros((len(values), count))
+    sums[:, years[starts]] = np.add.reduceat(values, starts, axis=1)
+    return sums
+
+
+def sorted_sources(rows: np.ndarray) -> tuple[np.ndarray, engine.SourceColumns]:
+    """
+    (order, columns) of the sources of the (sources x SOURCE_COLUMNS) rows, sorted by their years of life
+    """
+    columns = engine.SourceColumns.from_array(rows[:, :len(engine.SOURCE_COLUMNS)])
+    order = np.lexsort((columns.last_year(), columns.first_year()))
+    return order, columns.take(order)
+
+
+class StrategyModel:
+    """
+    What a draw needs to compute the deltas of a strategy: the report sources it
+    modifies, the entries (emission factor, modified value / lifetime, year index)
+    of their modified emission and the coefficients adding them up, its new sources
+    """
+    __slots__ = ('id', 'name', 'modified', 'modified_intervals', 'factors', 'coefficients',
+                 'entry_factors', 'entry_values', 'entry_years', 'new_factors', 'new_weights', 'new_intervals')
+
+    def __init__(self, strategy_id: int, name: str, sources: engine.SourceColumns, years: np.ndarray,
+                 modified: np.ndarray, modifications: engine.ModificationColumns,
+                 new_sources: engine.SourceColumns, new_factors: np.ndarray):
+        self.id = strategy_id
+        self.name = name
+        self.modified = modified
+        columns = sources.take(modified)
+        first_year, last_year = columns.first_year(), columns.last_year()
+        self.modified_intervals = Intervals(first_year, last_year, years)
+
+        # Same rules as engine.SourceColumns.years_delta, keeping the emission factor of each value
+        divisor = np.where(columns.lifetime > 0, columns.lifetime, 1)
+        entries = []
+        step = max(1, engine.CHUNK_SIZE // len(years))
+        for start in range(0, len(columns), step):
+            chunk = slice(start, start + step)
+            exists = years[None, :] >= first_year[chunk, None]
+            alive = exists & (years[None, :] <= last_year[chunk, None])
+            value_change, factor = modifications.factor_changes(chunk, years, columns.lifetime[chunk])
+            value = np.where(alive, columns.value[chunk, None], 0.0) + value_change
+            factor = np.where(factor < 0, modified[chunk, None], factor)
+            rows, year_indexes = np.nonzero(exists & (value != 0))
+            entries.append((factor[rows, year_indexes], value[rows, year_indexes] / divisor[chunk][rows], year_indexes))
+        factors, values, year_indexes = (np.concatenate(parts) for parts in zip(*entries)) if entries else (np.zeros(0, np.int64),) * 3
+
+        order = np.argsort(year_indexes, kind='stable')
+        self.factors, self.entry_factors = np.unique(factors[order].astype(np.int64), return_inverse=True)
+        self.entry_values = values[order].astype(np.float64)
+        self.entry_years = year_indexes[order].astype(np.int64)
+        self.coefficients = np.bincount(self.entry_factors * len(years) + self.entry_years, weights=self.entry_values,
+                                        minlength=len(self.factors) * len(years)).reshape(len(self.factors), len(years))
+
+        self.new_factors = new_factors
+        self.new_weights = new_sources.value / np.where(new_sources.lifetime > 0, new_sources.lifetime, 1)
+        self.new_intervals = Intervals(new_sources.first_year(), new_sources.last_year(), years)
+
+    def work(self) -> int:
+        return len(self.entry_values) + len(self.modified) + len(self.new_factors)
+
+    def deltas(self, factors: np.ndarray, emission: np.ndarray) -> np.ndarray:
+        """
+        (draws x years) delta of the strategy but the unmodified delta of all the sources, for
+        the (draws x factors) drawn emission factors and the (draws x sources) emission of the sources
+        """
+        gain = self.modified_intervals.sum(np.maximum(emission[:, self.modified], 0.0))
+        used = factors[:, self.factors]
+        modified = used @ self.coefficients
+        # max(x, 0) = x - min(x, 0), for the entries that can be negative
+        clamped = np.flatnonzero((self.entry_values < 0) | (used < 0).any(axis=0)[self.entry_factors])
+        step = max(1, CHUNK_SIZE // len(factors))
+        for start in range(0, len(clamped), step):
+            entries = clamped[start:start + step]
+            modified -= year_sums(np.minimum(used[:, self.entry_factors[entries]] * self.entry_values[entries], 0.0),
+                                  self.entry_years[entries], modified.shape[1])
+        new = self.new_intervals.sum(factors[:, self.new_factors] * self.new_weights)
+        return gain - modified - new
+
+
+class UncertaintyModel:
+    """
+    The emission factors of a report, sources first, then the new sources and the
+    modifications of each strategy, and what a draw needs to evaluate them
+    """
+    __slots__ = ('id', 'years', 'factors', 'weights', 'intervals', 'strategies')
+
+    def __init__(self, data: frames.ReportData, start_year: int, end_year: int):
+        self.id = data.id
+        self.years = engine.year_range(start_year, end_year)
+        source_ids = data.sources[:, 0].astype(np.int64)
+        order, sources = sorted_sources(data.sources[:, 1:])
+        position = np.empty_like(order)
+        position[order] = np.arange(len(order))
+        factor_rows = [data.sources[order, 2:][:, [0, 3, 4]]] # emission_factor, distribution, uncertainty
+        count = len(sources)
+
+        modifications = frames.group_rows(data.modifications)
+        new_sources = frames.group_rows(data.new_sources)
+        self.strategies = []
+        for strategy_id, name in data.strategies:
+            new_order, new_columns = sorted_sources(new_sources.get(strategy_id, np.empty((0, len(SOURCE_COLUMNS)))))
+            new_rows = new_sources.get(strategy_id, np.empty((0, len(SOURCE_COLUMNS))))[new_order]
+            factor_rows.append(new_rows[:, [1, 4, 5]])
+            new_factors = np.arange(count, count + len(new_rows))
+            count += len(new_rows)
+
+            rows = modifications.get(strategy_id, np.empty((0, len(MODIFICATION_COLUMNS))))
+            known, source_rows = frames.known_source_rows(source_ids, rows[:, 0])
+            rows = rows[known]
+            factor_rows.append(rows[:, [4, 5, 6]])
+            modified, index = np.unique(position[source_rows], return_inverse=True)
+            modification_columns = engine.ModificationColumns.from_arrays(
+                len(modified), index, *rows[:, 1:5].T, ids=np.arange(count, count + len(rows)))
+            count += len(rows)
+
+            self.strategies.append(StrategyModel(strategy_id, name, sources, self.years, modified,
+                                                 modification_columns, new_columns, new_factors))
+
+        self.factors = Factors(*np.concatenate(factor_rows).T)
+        self.weights = sources.value / np.where(sources.lifetime > 0, sources.lifetime, 1)
+        self.intervals = Intervals(sources.first_year(), sources.last_year(), self.years)
+
+    def work(self, strategies: slice = slice(None)) -> int:
+        """
+        Operations of a draw for the `strategies`, about
+        """
+        return len(self.factors) + sum(strategy.work() for strategy in self.strategies[strategies])
+
+    def evaluate(self, factors: np.ndarray, strategies: slice = slice(None)) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (draws x years) total emission and (strategies x draws x years) deltas of the `strategies`
+        for the (draws x factors) drawn emission factors
+        """
+        emission = factors[:, :len(self.weights)] * self.weights
+        total = self.intervals.sum(emission)
+        unmodified = self.intervals.sum(np.minimum(emission, 0.0))
+        selected = self.strategies[strategies]
+        deltas = np.empty((len(selected), *total.shape))
+        for i, strategy in enumerate(selected):
+            deltas[i] = unmodified + strategy.deltas(factors, emission)
+        return total, deltas
+
+    def point(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        (years) total emission and (strategies x years) deltas with the emission factors as set
+        """
+        total, deltas = self.evaluate(self.factors.value[None, :])
+        return total[0], deltas[:, 0]
+
+    def run(self, seed: np.random.SeedSequence, draws: int, strategies: slice = slice(None)) -> tuple[np.ndarray, np.ndarray]:
+        """
+        evaluate() of `draws` draws of the random stream of `seed`, by chunks
+        """
+        rng = np.random.default_rng(seed)
+        step = max(1, CHUNK_SIZE // max(len(self.factors), 1))
+        totals, deltas = [], []
+        for start in range(0, draws, step):
+            total, delta = self.evaluate(self.factors.draw(rng, min(step, draws - start)), strategies)
+            totals.append(total)
+            deltas.append(delta)
+        return np.concatenate(totals), np.concatenate(deltas, axis=1)
+
+
+_worker_model = None
+
+
+def _init_worker(model: UncertaintyModel):
+    global _worker_model
+    _worker_model = model
+
+
+def _run_block(seed: np.random.SeedSequence, draws: int, strategies: slice) -> tuple[np.ndarray, np.ndarray]:
+    return _worker_model.run(seed, draws, strategies)
+
+
+def simulate(model: UncertaintyModel, draws: int, seed: int, strategies: slice = slice(None)) -> tuple[np.ndarray, np.ndarray]:
+    """
+    (draws x years) total emission and (strategies x draws x years) deltas of the `strategies`
+    for `draws` draws, the same for every selection of strategies
+    """
+    sizes = [min(BLOCK_DRAWS, draws - start) for start in range(0, draws, BLOCK_DRAWS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = pools.pool_workers(len(sizes), draws * model.work(strategies),
+                                 'MONTE_CARLO_POOL_MIN_WORK', DEFAULT_POOL_MIN_WORK, 'MONTE_CARLO_WORKERS')
+    if workers == 1:
+        results = [model.run(block_seed, size, strategies) for block_seed, size in zip(seeds, sizes)]
+    else:
+        # The model is sent once to each worker
+        with pools.process_pool(workers, _init_worker, (model,)) as pool:
+            results = list(pool.map(_run_block, seeds, sizes, [strategies] * len(sizes)))
+    totals, deltas = zip(*results)
+    return np.concatenate(totals), np.concatenate(deltas, axis=1)
+
+
+def _percentiles(values: np.ndarray, percentiles: list[float]) -> list[dict[str, float]]:
+    """
+    {percentile: value} of each year of the (draws x years) values
+    """
+    names = [f'{percentile:g}' for percentile in percentiles]
+    return [dict(zip(names, year)) for year in np.percentile(values, percentiles, axis=0).T.tolist()]
+
+
+def compute_uncertainty(report: Report, start_year: int, end_year: int, draws: int, percentiles: list[float], seed: int) -> dict:
+    metrics.registry.inc(metrics.COMPUTATIONS, method='monte_carlo')
+    model = UncertaintyModel(load_data(report.pk), start_year, end_year)
+    point_total, point_deltas = model.point()
+    years = model.years.tolist()
+
+    # The deltas of at most DELTA_VALUES values at once
+    group = max(1, DELTA_VALUES // (draws * len(years)))
+    strategies = []
+    for first in range(0, max(len(model.strategies), 1), group):
+        totals, deltas = simulate(model, draws, seed, slice(first, first + group))
+        if first == 0:
+            total_percentiles = _percentiles(totals, percentiles)
+            means = totals.mean(axis=0).tolist()
+        for i, strategy in enumerate(model.strategies[first:first + group]):
+            delta_percentiles = _percentiles(deltas[i], percentiles)
+            emission_percentiles = _percentiles(totals - deltas[i], percentiles)
+            strategies.append({'id': strategy.id,
+                               'name': strategy.name,
+                               'years': [{'year': year,
+                                          'delta_total_emission': delta,
+                                          'delta_percentiles': delta_percentiles[j],
+                                          'total_emission_percentiles': emission_percentiles[j]}
+                                         for j, (year, delta) in enumerate(zip(years, point_deltas[first + i].tolist()))]})
+
+    return {'id': report.id,
+            'draws': draws,
+            'seed': seed,
+            'percentiles': percentiles,
+            'years': [{'year': year, 'total_emission': total, 'mean': means[j], 'percentiles': total_percentiles[j]}
+                      for j, (year, total) in enumerate(zip(years, point_total.tolist()))],
+            'strategies': strategies}
+
+
+def report_uncertainty(report: Report, start_year: int, end_year: int, draws: int, percentiles: list[float], seed: int) -> dict:
+    """
+    Percentiles over `draws` Monte Carlo draws of the total emission of the report and of the
+    delta and the resulting emission of each strategy, for every year of the range, with their
+    values for the emission factors as set. Cached for the revision of the report
+    """
+    with timer(EMISSION):
+        return caching.cached(report.pk, UNCERTAINTY_CACHE_NAME, start_year, end_year, draws, seed, *percentiles,
+                              compute=lambda: compute_uncertainty(report, start_year, end_year, draws, percentiles, seed))
@@ -11,6 +11,8 @@ router.register(r'reports/(?P<report_id>\d+)/reductionStrategies/(?P<strategy_id
                 views.ReductionModificationViewSet, basename='modification')
 router.register(r'reports/(?P<report_id>\d+)/reductionStrategies/(?P<strategy_id>\d+)/sources', 
                 views.SourceViewSet, basename='sourceAdded')
+router.register(r'portfolios', views.PortfolioViewSet, basename='portfolio')
+router.register(r'jobs', views.ComputationJobViewSet, basename='job')
 
 
 # The API URLs are now determined automatically by the router.
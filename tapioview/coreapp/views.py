@@ -1,10 +1,93 @@
-from coreapp.models import Report, Source, ReductionStrategy, ReductionModification
-from coreapp.serializers import ReportSerializer, SourceSerializer, ReductionStrategySerializer, ReductionModificationSerializer
+from django.db import IntegrityError
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from coreapp import aggregates, attribution, comparison, exporters, importers, jobs, portfolios, queries, snapshots, uncertainty
+from coreapp.models import ComputationJob, Portfolio, Report, ReportSnapshot, ReductionStrategy
+from coreapp.conditional import ConditionalGetMixin, report_validators, reports_validators
+from coreapp.fieldsets import request_selection
+from coreapp.pagination import IdCursorPagination
+from coreapp.parameters import DEFAULT_DRAWS, MAX_DRAWS, parse_monte_carlo, parse_year, parse_year_range
+from coreapp.renderers import CSVRenderer, NDJSONRenderer, ORJSONRenderer
+from coreapp.serializers import (ComputationJobSerializer, PortfolioSerializer, ReportSerializer, ReportSnapshotSerializer,
+                                 SourceSerializer, ReductionStrategySerializer, ReductionModificationSerializer)
+from rest_framework import exceptions
+from rest_framework import mixins
 from rest_framework import permissions
+from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.views import exception_handler as default_exception_handler
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
 
+YEAR_RANGE_PARAMETERS = [
+    OpenApiParameter(
+        name='from',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        description='First year of the range (included).',
+        required=True
+    ),
+    OpenApiParameter(
+        name='to',
+        type=OpenApiTypes.INT,
+        location=OpenApiParameter.QUERY,
+        description='Last year of the range (included).',
+        required=True
+    )
+]
+
+FIELDSET_PARAMETERS = [
+    OpenApiParameter(
+        name='fields',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        description='Comma separated fields to return, dotted paths for the nested objects (e.g. `id,sources.value`).',
+        required=False
+    ),
+    OpenApiParameter(
+        name='expand',
+        type=OpenApiTypes.STR,
+        location=OpenApiParameter.QUERY,
+        description='Comma separated nested objects to embed (e.g. `reductionStrategies.modifications`), all by default.',
+        required=False
+    ),
+    OpenApiParameter(
+        name='summary',
+        type=OpenApiTypes.BOOL,
+        location=OpenApiParameter.QUERY,
+        description='Only the header and the computed totals, without the nested objects.',
+        required=False
+    )
+]
+
+
+class FrozenYear(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The year is frozen.'
+    default_code = 'frozen_year'
+
+
+def exception_handler(exc, context):
+    """
+    The changes rejected by a frozen year (coreapp.snapshots) are conflicts
+    """
+    if isinstance(exc, snapshots.FrozenYearError):
+        exc = FrozenYear(' '.join(exc.messages))
+    return default_exception_handler(exc, context)
+
+
+def get_year(request) -> int | None:
+    return parse_year(request.query_params)
+
+
+def get_year_range(request) -> tuple[int, int]:
+    return parse_year_range(request.query_params)
+
+
 @extend_schema(
     description='Computed value based on the year.',
     parameters=[
@@ -15,17 +98,147 @@ from drf_spectacular.types import OpenApiTypes
             description='The year for the computation.',
             required=False
         )
-    ]
+    ] + FIELDSET_PARAMETERS
 )
-class ReportViewSet(viewsets.ModelViewSet):
+class ReportViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
     """
-    queryset = Report.objects.all()
     serializer_class = ReportSerializer
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validators(self):
+        if 'pk' in self.kwargs:
+            return report_validators(self.kwargs['pk'])
+        return reports_validators()
+
+    def get_queryset(self):
+        # The computation actions load the sources by themselves
+        return queries.report_queryset(nested=self.action not in ['timeseries', 'export', 'snapshot', 'uncertainty'],
+                                       year=get_year(self.request),
+                                       selection=request_selection(self.request))
+
+    @extend_schema(
+        description='Total emission of the report for every year of the range.',
+        parameters=YEAR_RANGE_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True)
+    def timeseries(self, request, pk=None):
+        start_year, end_year = get_year_range(request)
+        return Response(jobs.report_timeseries(self.get_object(), start_year, end_year))
+
+    @extend_schema(
+        description='Monte Carlo draws of the emission factors given a distribution and an uncertainty: '
+                    'for every year of the range, the total emission of the report and, for every strategy, '
+                    'the delta and the resulting emission, with their percentiles over the draws. '
+                    'The same seed gives the same draws.',
+        parameters=YEAR_RANGE_PARAMETERS + [
+            OpenApiParameter(
+                name='draws',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description=f'Number of draws, {DEFAULT_DRAWS} by default, at most {MAX_DRAWS}.',
+                required=False
+            ),
+            OpenApiParameter(
+                name='percentiles',
+                type=OpenApiTypes.STR,
+                location=OpenApiParameter.QUERY,
+                description='Comma separated percentiles, `5,50,95` by default.',
+                required=False
+            ),
+            OpenApiParameter(
+                name='seed',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Seed of the random draws, 0 by default.',
+                required=False
+            )
+        ],
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True)
+    def uncertainty(self, request, pk=None):
+        parameters = parse_monte_carlo(request.query_params)
+        return Response(uncertainty.report_uncertainty(self.get_object(), *parameters))
+
+    @extend_schema(
+        description='Stream all the sources, strategies and modifications of the report, '
+                    'one row per object. With `year`, the rows contain the computed '
+                    '`year_emission` (sources) and `delta_total_emission` (strategies).',
+        parameters=[
+            OpenApiParameter(
+                name='format',
+                type=OpenApiTypes.STR,
+                enum=['ndjson', 'csv'],
+                location=OpenApiParameter.QUERY,
+                description='Format of the export (or the Accept header), NDJSON by default.',
+                required=False
+            )
+        ],
+        responses={(200, 'application/x-ndjson'): OpenApiTypes.BINARY,
+                   (200, 'text/csv'): OpenApiTypes.BINARY}
+    )
+    @action(detail=True, renderer_classes=[NDJSONRenderer, CSVRenderer, ORJSONRenderer])
+    def export(self, request, pk=None):
+        report = self.get_object()
+        year = get_year(request)
+        rows = exporters.export_rows(report, year)
+        if request.accepted_renderer.format == 'csv':
+            response = StreamingHttpResponse(exporters.csv_lines(rows), content_type='text/csv')
+            extension = 'csv'
+        else:
+            response = StreamingHttpResponse(exporters.ndjson_lines(rows), content_type='application/x-ndjson')
+            extension = 'ndjson'
+        response.headers['Content-Disposition'] = f'attachment; filename="report_{report.pk}.{extension}"'
+        return response
+
+    @extend_schema(
+        description='Frozen year of the report: its total emission, the emission of each source and the delta '
+                    'of each strategy, stored once. POST freezes the year: its totals are then read from the '
+                    'snapshot, and the sources and modifications of the year cannot be changed (409). '
+                    'DELETE unfreezes the year, which can then be frozen again.',
+        parameters=[
+            OpenApiParameter(
+                name='year',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='The frozen year.',
+                required=True
+            )
+        ],
+        request=None,
+        responses={200: ReportSnapshotSerializer, 201: ReportSnapshotSerializer, 204: None, 409: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True, methods=['get', 'post', 'delete'])
+    def snapshot(self, request, pk=None):
+        year = get_year(request)
+        if year is None:
+            raise ValidationError('The `year` parameter is required.')
+        report = self.get_object()
+
+        if request.method == 'POST':
+            # The frozen totals are the stored rows of the year
+            if year not in aggregates.horizon_years():
+                raise ValidationError('Only the years of the stored horizon can be frozen.')
+            if ReportSnapshot.objects.filter(report=report, year=year).exists():
+                raise FrozenYear(f'The year {year} is already frozen, unfreeze it first.')
+            try:
+                snapshot = snapshots.freeze_report(report, year)
+            except IntegrityError:
+                raise FrozenYear(f'The year {year} is already frozen, unfreeze it first.')
+            return Response(ReportSnapshotSerializer(snapshot).data, status=status.HTTP_201_CREATED)
+
+        if request.method == 'DELETE':
+            if not snapshots.unfreeze_report(report, year):
+                raise exceptions.NotFound(f'The year {year} is not frozen.')
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        snapshot = get_object_or_404(ReportSnapshot, report=report, year=year)
+        return Response(ReportSnapshotSerializer(snapshot).data)
+
 
 @extend_schema(
     description='Computed value based on the year.',
@@ -37,23 +250,95 @@ class ReportViewSet(viewsets.ModelViewSet):
             description='The year for the computation.',
             required=False
         )
-    ]
+    ] + FIELDSET_PARAMETERS
 )
-class SourceViewSet(viewsets.ModelViewSet):
+class SourceViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
     """
     serializer_class = SourceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdCursorPagination
     
     def get_queryset(self):
         if 'strategy_id' in self.kwargs :
             strategy_id = self.kwargs['strategy_id']
-            return Source.objects.filter(strategy_id=strategy_id)
+            return queries.source_queryset(strategy_id=strategy_id)
 
         report_id = self.kwargs['report_id']
-        return Source.objects.filter(report_id=report_id)
+        return queries.source_queryset(report_id=report_id)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # The emissions of a frozen year are read from its snapshot
+        if self.request.method == 'GET' and 'report_id' in self.kwargs and 'strategy_id' not in self.kwargs:
+            context['frozen_emissions'] = snapshots.source_emissions(self.kwargs['report_id'], get_year(self.request))
+        return context
+
+    def perform_destroy(self, instance):
+        # Checked again by coreapp.signals, but within the transaction of the deletion
+        snapshots.check_source(instance, None)
+        instance.delete()
+
+    @extend_schema(
+        description='Bulk import of sources from a CSV (with a header line) or NDJSON upload, '
+                    'as the `file` field of a multipart form or as the raw body. '
+                    'Invalid rows are skipped and listed in the response.',
+        parameters=[
+            OpenApiParameter(
+                name='type',
+                type=OpenApiTypes.STR,
+                enum=importers.FORMATS,
+                location=OpenApiParameter.QUERY,
+                description='Format of the upload, guessed from the content type or the file name if missing.',
+                required=False
+            ),
+            OpenApiParameter(
+                name='batch_size',
+                type=OpenApiTypes.INT,
+                location=OpenApiParameter.QUERY,
+                description='Number of sources inserted per query.',
+                required=False
+            )
+        ],
+        request={'multipart/form-data': {'type': 'object', 'properties': {'file': {'type': 'string', 'format': 'binary'}}},
+                 'text/csv': OpenApiTypes.BINARY,
+                 'application/x-ndjson': OpenApiTypes.BINARY},
+        responses={201: OpenApiTypes.OBJECT, 400: OpenApiTypes.OBJECT}
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def bulk_import(self, request, report_id=None, strategy_id=None):
+        report = get_object_or_404(Report, pk=report_id)
+        strategy = None
+        if strategy_id is not None:
+            strategy = get_object_or_404(ReductionStrategy, pk=strategy_id, report=report)
+            strategy.report, report = report, None
+
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError('The `file` field is required.')
+            stream, content_type, name = upload, upload.content_type, upload.name
+        else:
+            # Raw body, read as a stream
+            stream, content_type, name = request.stream, request.content_type, None
+            if stream is None:
+                raise ValidationError('The upload is empty.')
+
+        file_format = request.query_params.get('type') or importers.guess_format(content_type, name)
+        if file_format not in importers.FORMATS:
+            raise ValidationError(f'Unknown format, expected one of {importers.FORMATS}.')
+        try:
+            batch_size = int(request.query_params.get('batch_size', importers.DEFAULT_BATCH_SIZE))
+        except ValueError:
+            raise ValidationError('`batch_size` must be an integer.')
+        if batch_size < 1:
+            raise ValidationError('`batch_size` must be positive.')
+
+        result = importers.import_sources(stream, file_format, report=report, strategy=strategy, batch_size=batch_size)
+        response_status = status.HTTP_201_CREATED if result.created or not result.error_count else status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=response_status)
 
 @extend_schema(
     description='Computed value based on the year.',
@@ -65,9 +350,9 @@ class SourceViewSet(viewsets.ModelViewSet):
             description='The year for the computation.',
             required=False
         )
-    ]
+    ] + FIELDSET_PARAMETERS
 )
-class ReductionStrategyViewSet(viewsets.ModelViewSet):
+class ReductionStrategyViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
@@ -77,7 +362,37 @@ class ReductionStrategyViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         report_id = self.kwargs['report_id']
-        return ReductionStrategy.objects.filter(report_id=report_id)
+        if self.action == 'attribution':
+            # The computation loads the report by itself
+            return ReductionStrategy.objects.filter(report_id=report_id)
+        return queries.strategy_queryset(report_id, year=get_year(self.request),
+                                         selection=request_selection(self.request))
+
+    @extend_schema(
+        description='Baseline emission (`years`) and, for every strategy, baseline emission, delta '
+                    'and resulting emission for every year of the range.',
+        parameters=YEAR_RANGE_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=False)
+    def compare(self, request, report_id=None):
+        start_year, end_year = get_year_range(request)
+        report = get_object_or_404(Report, pk=report_id)
+        return Response(comparison.compare_strategies(report, start_year, end_year))
+
+    @extend_schema(
+        description='Contribution of each modification to the delta of the strategy, for every year of the '
+                    'range: marginal (the delta added by the modification after the previous ones of its '
+                    'source) and leave-one-out (the delta lost without it). The modifications are ranked by '
+                    'their marginal contribution over the range, with its cumulative total; `unattributed` '
+                    'is the delta of the new sources and of the negative emissions.',
+        parameters=YEAR_RANGE_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True)
+    def attribution(self, request, report_id=None, pk=None):
+        start_year, end_year = get_year_range(request)
+        return Response(attribution.strategy_attribution(self.get_object(), start_year, end_year))
         
 
 @extend_schema(
@@ -90,16 +405,81 @@ class ReductionStrategyViewSet(viewsets.ModelViewSet):
             description='The year for the computation.',
             required=False
         )
-    ]
+    ] + FIELDSET_PARAMETERS
 )
-class ReductionModificationViewSet(viewsets.ModelViewSet):
+class ReductionModificationViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     This viewset automatically provides `list`, `create`, `retrieve`,
     `update` and `destroy` actions.
     """
     serializer_class = ReductionModificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdCursorPagination
     
     def get_queryset(self):
         strategy_id = self.kwargs['strategy_id']
-        return ReductionModification.objects.filter(strategy_id=strategy_id)
\ No newline at end of file
+        return queries.modification_queryset(strategy_id)
+
+    def perform_destroy(self, instance):
+        # Checked again by coreapp.signals, but within the transaction of the deletion
+        snapshots.check_modification(instance, None)
+        instance.delete()
+
+
+class PortfolioViewSet(viewsets.ModelViewSet):
+    """
+    This viewset automatically provides `list`, `create`, `retrieve`,
+    `update` and `destroy` actions.
+    """
+    serializer_class = PortfolioSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return queries.portfolio_queryset()
+
+    @extend_schema(
+        description='Total emission of the portfolio and of each of its reports for every year of the range, '
+                    'and the delta of the strategies summed per strategy name over the reports.',
+        parameters=YEAR_RANGE_PARAMETERS,
+        responses={200: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True)
+    def emissions(self, request, pk=None):
+        start_year, end_year = get_year_range(request)
+        portfolio = get_object_or_404(Portfolio, pk=pk)
+        return Response(portfolios.portfolio_emissions(portfolio, start_year, end_year))
+
+
+class ComputationJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                            viewsets.GenericViewSet):
+    """
+    Submit a background computation (`create`), poll its status (`retrieve`)
+    and fetch its result (`result`). The jobs are run by `manage.py run_workers`.
+    """
+    serializer_class = ComputationJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = IdCursorPagination
+
+    def get_queryset(self):
+        if self.action == 'result':
+            return ComputationJob.objects.all()
+        # The results can be large, only read by the result action
+        return ComputationJob.objects.defer('result')
+
+    def perform_create(self, serializer):
+        jobs.check_parameters(serializer.validated_data['kind'], serializer.validated_data.get('parameters', {}))
+        serializer.save()
+
+    @extend_schema(
+        description='Result of the job when it is done (200), its status while it is pending '
+                    'or running (202), its error if it failed (409).',
+        responses={200: OpenApiTypes.OBJECT, 202: OpenApiTypes.OBJECT, 409: OpenApiTypes.OBJECT}
+    )
+    @action(detail=True)
+    def result(self, request, pk=None):
+        job = self.get_object()
+        if job.status == ComputationJob.DONE:
+            return Response(job.result)
+        if job.status == ComputationJob.FAILED:
+            return Response({'status': job.status, 'error': job.error}, status=status.HTTP_409_CONFLICT)
+        return Response({'status': job.status}, status=status.HTTP_202_ACCEPTED)
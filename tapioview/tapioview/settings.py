@@ -10,13 +10,14 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
 
-# Quick-start development settings - unsuitable for production
+# Quick-start development settings - unsuitable for production (see settings_production)
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
@@ -44,6 +45,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'coreapp.metrics.MetricsMiddleware',
+    'coreapp.instrumentation.ServerTimingMiddleware',
+    'coreapp.compression.CompressionMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -131,9 +135,83 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
-    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema'
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'EXCEPTION_HANDLER': 'coreapp.views.exception_handler',
+    'DEFAULT_RENDERER_CLASSES': [
+        'coreapp.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'coreapp.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# MessagePack (Accept: application/msgpack) when msgpack is installed
+if find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('coreapp.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('coreapp.parsers.MessagePackParser')
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# The local-memory cache is per process, use the file-based backend
+# ('django.core.cache.backends.filebased.FileBasedCache') to share it between workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'CULL_FREQUENCY': 4,
+        }
+    }
+}
+
+# Cache of the computed totals (coreapp.caching)
+COMPUTATION_CACHE_ALIAS = 'default'
+COMPUTATION_CACHE_TIMEOUT = 3600
+
+# Years stored in the ReportYearEmission and StrategyYearDelta tables
+EMISSION_YEARS_HORIZON = (2000, 2060)
+
+# Portfolio computations of at least this many rows (sources and modifications) are split
+# across PORTFOLIO_WORKERS processes (None for one per CPU) by coreapp.portfolios
+PORTFOLIO_POOL_MIN_ROWS = 200000
+PORTFOLIO_WORKERS = None
+
+# Monte Carlo computations of at least this much work (draws x emission factors and modified
+# source-years) are split across MONTE_CARLO_WORKERS processes (None for one per CPU) by coreapp.uncertainty
+MONTE_CARLO_POOL_MIN_WORK = 2 * 10 ** 8
+MONTE_CARLO_WORKERS = None
+
+# Directory of the memory-mapped report columns shared by the worker processes
+# (coreapp.columnstore), None to load the reports from the database in each process.
+# The revisions older than FRAME_STORE_MAX_AGE seconds are removed by `manage.py prune_frame_store`
+FRAME_STORE_DIR = None
+FRAME_STORE_MAX_AGE = 7 * 24 * 3600
+
+# Seconds without heartbeat after which a running ComputationJob is considered lost and queued
+# again, its worker refreshing the heartbeat every JOB_HEARTBEAT_INTERVAL seconds (coreapp.jobs)
+JOB_TIMEOUT = 600
+JOB_HEARTBEAT_INTERVAL = 60
+
+# Directory shared by the worker processes to add up their /metrics (coreapp.metrics),
+# None when there is a single process
+METRICS_DIR = None
+# /metrics is served to the staff users, and to `Authorization: Bearer <METRICS_TOKEN>` when set
+METRICS_TOKEN = None
+
+# OpenAPI schema built by `manage.py build_schema` and served from this file,
+# None to generate it on each request (coreapp.schema)
+OPENAPI_SCHEMA_FILE = None
+
+# Smaller responses are not compressed (coreapp.compression)
+COMPRESSION_MIN_SIZE = 1024
+
+# Requests slower than this are logged by coreapp.instrumentation (None to disable)
+SLOW_REQUEST_THRESHOLD_MS = 1000
+
 INTERNAL_IPS = [
     "127.0.0.1", # usefull for django-debug
 ]
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""
+Production settings: the development settings without the development tools.
+
+DJANGO_SETTINGS_MODULE=tapioview.settings_production, with the environment variables
+DJANGO_SECRET_KEY and DJANGO_ALLOWED_HOSTS (comma separated). The OpenAPI schema is
+served from OPENAPI_SCHEMA_FILE, built by `manage.py build_schema`. The Prometheus
+scraper reads /metrics with the METRICS_TOKEN environment variable.
+"""
+import os
+from tapioview.settings import *  # noqa: F403
+from tapioview.settings import BASE_DIR, INSTALLED_APPS, MIDDLEWARE
+
+SECRET_KEY = os.environ['DJANGO_SECRET_KEY']
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+# Development apps and middleware
+DEVELOPMENT_APPS = ['debug_toolbar']
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in DEVELOPMENT_APPS]
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware.split('.')[0] not in DEVELOPMENT_APPS]
+
+OPENAPI_SCHEMA_FILE = BASE_DIR / 'openapi.json'
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
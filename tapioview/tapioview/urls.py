@@ -14,16 +14,22 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView,SpectacularRedocView, SpectacularSwaggerView
+from coreapp import schema
+from coreapp.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('__debug__/', include('debug_toolbar.urls')),
     path('', include('coreapp.urls')),
     path('api-auth/', include('rest_framework.urls')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/schema/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    path('metrics', metrics_view, name='metrics'),
+    path('api/schema/', schema.SchemaView.as_view(), name='schema'),
+    path('api/schema/swagger-ui/', schema.SwaggerView.as_view(url_name='schema'), name='swagger-ui'),
+    path('api/schema/redoc/', schema.RedocView.as_view(url_name='schema'), name='redoc'),
 ]
+
+# Development only (left out by settings_production)
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))